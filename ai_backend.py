@@ -0,0 +1,263 @@
+"""
+Backends de generación IA.
+
+- ChatBackend: una sola llamada a chat.completions en streaming con salida
+  restringida por JSON Schema (structured outputs) y validada al recibirla.
+- AssistantsBackend: el camino anterior (thread + run con polling), que se
+  mantiene como fallback.
+
+Todos exponen `generate(prompt, schema, timeout) -> (payload, error)` y
+registran latencia y tokens (prompt/completion) por llamada en /metrics.
+Para probar contra un servidor local basta con OPENAI_BASE_URL.
+"""
+import json
+import re
+import time
+
+import metrics
+
+SYSTEM_PROMPT = (
+    "You are the social media editor of a news brand. "
+    "Always answer with a single JSON object that matches the requested schema."
+)
+
+# --------------------------------------------------------------------
+# Esquemas de salida
+# --------------------------------------------------------------------
+_VARIANT = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "subtitle": {"type": "string"},
+    },
+    "required": ["title", "subtitle"],
+    "additionalProperties": False,
+}
+
+VARIANTS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "variants": {
+            "type": "object",
+            "properties": {k: _VARIANT for k in ("A", "B", "C", "D")},
+            "required": ["A", "B", "C", "D"],
+            "additionalProperties": False,
+        },
+        "common_caption": {"type": "string"},
+        "image_keywords": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["variants", "common_caption", "image_keywords"],
+    "additionalProperties": False,
+}
+
+CAROUSEL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "recommended_slides": {"type": "integer"},
+        "recommendation_reason": {"type": "string"},
+        "slides": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "title": {"type": "string"},
+                    "sentence": {"type": "string"},
+                    "image_keywords": {"type": "array", "items": {"type": "string"}},
+                },
+                "required": ["title", "sentence", "image_keywords"],
+                "additionalProperties": False,
+            },
+        },
+        "caption": {"type": "string"},
+    },
+    "required": ["recommended_slides", "recommendation_reason", "slides", "caption"],
+    "additionalProperties": False,
+}
+
+# Variantes + carrusel en una sola petición (AI_MERGED_REQUEST=1)
+COMBINED_SCHEMA = {
+    "type": "object",
+    "properties": {**VARIANTS_SCHEMA["properties"], "carousel": CAROUSEL_SCHEMA},
+    "required": VARIANTS_SCHEMA["required"] + ["carousel"],
+    "additionalProperties": False,
+}
+
+AI_CALL_SECONDS = metrics.histogram(
+    "sentient_ai_call_duration_seconds", "Latencia de cada llamada IA", ("call", "backend", "outcome")
+)
+AI_TOKENS = metrics.counter(
+    "sentient_ai_tokens_total", "Tokens consumidos por llamada IA", ("call", "backend", "kind")
+)
+
+
+def record_call(call: str, backend: str, elapsed: float, usage=None, ok: bool = True):
+    AI_CALL_SECONDS.observe(elapsed, call=call, backend=backend, outcome="ok" if ok else "error")
+    if usage is not None:
+        AI_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0, call=call, backend=backend, kind="prompt")
+        AI_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0, call=call, backend=backend, kind="completion")
+
+
+_JSON_TYPES = {
+    "object": dict,
+    "array": list,
+    "string": str,
+    "integer": int,
+    "number": (int, float),
+    "boolean": bool,
+}
+
+
+def validate(payload, schema: dict, path: str = "$"):
+    """Validación mínima (type/required/items/properties). Devuelve un error o None."""
+    expected = _JSON_TYPES.get(schema.get("type"))
+    if expected and (not isinstance(payload, expected)
+                     or (schema.get("type") in ("integer", "number") and isinstance(payload, bool))):
+        return f"{path}: expected {schema['type']}"
+    if isinstance(payload, dict):
+        for key in schema.get("required", []):
+            if key not in payload:
+                return f"{path}: missing '{key}'"
+        for key, sub in schema.get("properties", {}).items():
+            if key in payload:
+                err = validate(payload[key], sub, f"{path}.{key}")
+                if err:
+                    return err
+    if isinstance(payload, list) and "items" in schema:
+        for i, item in enumerate(payload):
+            err = validate(item, schema["items"], f"{path}[{i}]")
+            if err:
+                return err
+    return None
+
+
+def parse_json_reply(text_response: str):
+    """Extrae el JSON de una respuesta en texto libre (con o sin ```json)."""
+    json_match = re.search(r'```json\s*([\s\S]+?)\s*```', text_response)
+    payload_str = json_match.group(1) if json_match else text_response
+    return json.loads(payload_str)
+
+
+# --------------------------------------------------------------------
+# Backends
+# --------------------------------------------------------------------
+class ChatBackend:
+    name = "chat"
+
+    def __init__(self, client, model: str):
+        self.client = client
+        self.model = model
+
+    def generate(self, prompt: str, schema: dict, timeout: float = 40, schema_name: str = "result"):
+        start = time.perf_counter()
+        usage = None
+        try:
+            stream = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt},
+                ],
+                response_format={
+                    "type": "json_schema",
+                    "json_schema": {"name": schema_name, "schema": schema, "strict": True},
+                },
+                stream=True,
+                # El último chunk trae el uso de tokens (choices vacío)
+                stream_options={"include_usage": True},
+                timeout=timeout,
+            )
+            parts = []
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+            text_response = "".join(parts)
+        except Exception as e:
+            record_call(schema_name, self.name, time.perf_counter() - start, usage, ok=False)
+            return None, f"Chat completion failed: {e}"
+
+        payload, err = None, None
+        try:
+            payload = json.loads(text_response)
+            err = validate(payload, schema)
+            if err:
+                err = f"AI schema validation error: {err}"
+        except json.JSONDecodeError as e:
+            err = f"AI JSON parse error: {e} | Response was: {text_response[:200]}"
+        record_call(schema_name, self.name, time.perf_counter() - start, usage, ok=err is None)
+        return (None, err) if err else (payload, None)
+
+
+class AssistantsBackend:
+    name = "assistants"
+
+    def __init__(self, client, assistant_id: str):
+        self.client = client
+        self.assistant_id = assistant_id
+
+    def generate(self, prompt: str, schema: dict = None, timeout: float = 40, schema_name: str = "result"):
+        start = time.perf_counter()
+        try:
+            run = self.client.beta.threads.create_and_run_poll(
+                assistant_id=self.assistant_id,
+                thread={
+                    "messages": [
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ]
+                },
+                poll_interval_ms=2000,
+                timeout=timeout
+            )
+            if run.status != 'completed':
+                record_call(schema_name, self.name, time.perf_counter() - start, run.usage, ok=False)
+                return None, f"Estado IA no completado: {run.status}"
+            msgs = self.client.beta.threads.messages.list(thread_id=run.thread_id)
+            text_response = msgs.data[0].content[0].text.value
+        except Exception as e:
+            record_call(schema_name, self.name, time.perf_counter() - start, ok=False)
+            return None, str(e)
+
+        try:
+            payload = parse_json_reply(text_response)
+        except Exception as e:
+            record_call(schema_name, self.name, time.perf_counter() - start, run.usage, ok=False)
+            return None, f"AI JSON parse error: {e} | Response was: {text_response[:200]}"
+        record_call(schema_name, self.name, time.perf_counter() - start, run.usage)
+        return payload, None
+
+
+class FallbackBackend:
+    """Prueba `primary` y, si falla, repite la petición con `fallback`."""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = f"{primary.name}+{fallback.name}"
+
+    def generate(self, prompt: str, schema: dict, timeout: float = 40, schema_name: str = "result"):
+        payload, err = self.primary.generate(prompt, schema, timeout=timeout, schema_name=schema_name)
+        if payload is not None:
+            return payload, None
+        print(f"⚠️ IA ({self.primary.name}) falló, usando {self.fallback.name}: {err}")
+        return self.fallback.generate(prompt, schema, timeout=timeout, schema_name=schema_name)
+
+
+def build_backend(client, mode: str = "chat", model: str = None, assistant_id: str = None):
+    """
+    Construye el backend según `mode` ('chat' o 'assistants'). En modo chat,
+    si hay assistant_id el camino de Assistants queda como fallback.
+    Devuelve None si faltan credenciales.
+    """
+    if client is None:
+        return None
+    assistants = AssistantsBackend(client, assistant_id) if assistant_id else None
+    if mode == "assistants":
+        return assistants
+    if not model:
+        return assistants
+    chat = ChatBackend(client, model)
+    return FallbackBackend(chat, assistants) if assistants else chat
@@ -1,26 +1,44 @@
+import contextvars
+import fcntl
+import hashlib
+import io
 import os
 import json
 import re
+import random
+import threading
 import time
-from urllib.parse import urlparse, quote_plus, parse_qs
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlparse, quote_plus, parse_qs, parse_qsl, urlencode
 
-import requests
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, Response
+from flask import Flask, g, request, jsonify, Response, send_file, stream_with_context
 
-# --- IA / OpenAI ---
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request as GoogleAuthRequest
-OPENAI_CLIENT = None
-try:
-    from openai import OpenAI
-except Exception:
-    OpenAI = None
+# Las dependencias pesadas se importan en su primer uso: el SDK de OpenAI en
+# get_ai_backend(), newspaper3k/NLTK en extractors.py, Pillow en los pools de
+# imágenes y render, httpx solo en el modo ASGI. preload() las adelanta en el
+# master de gunicorn para que los workers las hereden (ver gunicorn.conf.py).
 
-# --- Scraping principal ---
-from newspaper import Article
-# ArticleDownloadState ya no es necesario al usar scrape.do
+from ai_backend import CAROUSEL_SCHEMA, COMBINED_SCHEMA, VARIANTS_SCHEMA, build_backend
+import batches
+from batches import BatchStore
+from cache_store import CacheStore
+from domain_health import OPEN as CIRCUIT_OPEN, DomainHealth
+from extractors import extract, summarize
+from feeds import NotAFeed, parse_feed
+import http_client
+from image_cache import FITS as IMAGE_FITS, FORMATS as IMAGE_FORMATS, MAX_DIMENSION, ImageCache, PrefetchBatch
+from jobs import JobCancelled, JobQueue
+import metrics
+from pipeline import run_graph
+from prompt_context import compact
+import rate_limit
+import render
+from rate_limit import BACKGROUND, INTERACTIVE, RateLimited, RateLimiter, parse_limits
+from singleflight import Broadcast, SingleFlight
 
 # --------------------------------------------------------------------
 # Configuración base
@@ -32,32 +50,221 @@ app = Flask(__name__, static_url_path='', static_folder='static')
 # Claves
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_ASSISTANT_ID = os.getenv("OPENAI_ASSISTANT_ID")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")  # Opcional (proxy o servidor stub local)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+# 'chat' = structured outputs en streaming (Assistants como fallback); 'assistants' = camino anterior
+AI_BACKEND_MODE = os.getenv("AI_BACKEND", "chat")
 PEXELS_API_KEY = os.getenv("PEXELS_API_KEY") # Clave de Pexels (NECESARIA)
 GOOGLE_SEARCH_API_KEY = os.getenv("GOOGLE_SEARCH_API_KEY")
 GOOGLE_SEARCH_CX = os.getenv("GOOGLE_SEARCH_CX")
 SCRAPE_DO_KEY = os.getenv("SCRAPE_DO_KEY")  # Clave de Scrape.do
 
-# --- CONFIGURACIÓN DE GOOGLE LIMPIA ---
-SERVICE_ACCOUNT_FILE = 'service-account-key.json' 
+# Endpoints de los upstreams (sobrescribibles para stubs locales / benchmarks)
+SCRAPE_DO_URL = os.getenv("SCRAPE_DO_URL", "http://api.scrape.do/")
+PEXELS_API_URL = os.getenv("PEXELS_API_URL", "https://api.pexels.com/v1")
+GOOGLE_SEARCH_URL = os.getenv("GOOGLE_SEARCH_URL", "https://www.googleapis.com/customsearch/v1")
 
-if OPENAI_API_KEY and OpenAI is not None:
-    try:
-        OPENAI_CLIENT = OpenAI(api_key=OPENAI_API_KEY)
-        print("✅ IA (OpenAI): Cliente activo")
-    except Exception as e:
-        print(f"⚠️ ERROR: No se pudo iniciar el cliente OpenAI: {e}")
+# Módulos que preload() importa en el master (coma; vacío = ninguno)
+PRELOAD_MODULES = [m.strip() for m in os.getenv("PRELOAD_MODULES", "openai,PIL.Image,newspaper").split(",") if m.strip()]
 
-# --- Caché Persistente ---
-CACHE_FILE = 'scrape_cache.json'
-try:
-    with open(CACHE_FILE, 'r') as f:
-        SCRAPE_CACHE = json.load(f)
-    print(f"✅ Caché persistente cargada desde {CACHE_FILE}")
-except (FileNotFoundError, json.JSONDecodeError):
-    SCRAPE_CACHE = {}
-    print("⚠️ No se encontró caché persistente, iniciando vacía.")
+# Texto del artículo que se manda a la IA: las frases más informativas hasta
+# este presupuesto de tokens, compartido por las llamadas de variantes y carrusel
+AI_CONTEXT_TOKENS = int(os.getenv("AI_CONTEXT_TOKENS", "900"))
+# 1 = variantes y carrusel en una sola petición (el artículo se envía una vez;
+# a cambio el evento 'variants' del streaming llega junto con el carrusel)
+AI_MERGED_REQUEST = os.getenv("AI_MERGED_REQUEST", "0") == "1"
 
+# Extractor de artículos: 'auto' (lxml con fallback a newspaper), 'fast' o 'newspaper'
+EXTRACTION_ENGINE = os.getenv("EXTRACTION_ENGINE", "auto")
+
+# --- Caché Persistente (SQLite compartido entre workers) ---
+CACHE_FILE = 'scrape_cache.json'  # Volcado antiguo, se importa una sola vez
+CACHE_DB = os.getenv("CACHE_DB", "scrape_cache.db")
 CACHE_DURATION = 60 * 60 * 24  # 24 horas
+# Pasado CACHE_DURATION la entrada se sirve como 'stale' mientras se refresca en segundo plano
+CACHE_STALE_DURATION = int(os.getenv("CACHE_STALE_DURATION", str(60 * 60 * 24 * 7)))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+# Resultados de fallback (scrape fallido): TTL más corto para reintentar antes
+FALLBACK_CACHE_DURATION = int(os.getenv("FALLBACK_CACHE_DURATION", str(60 * 60)))
+# Pre-calentado opcional: refresca las claves más leídas antes de que expiren
+CACHE_PREWARM = os.getenv("CACHE_PREWARM", "0") == "1"
+CACHE_PREWARM_INTERVAL = int(os.getenv("CACHE_PREWARM_INTERVAL", "600"))
+CACHE_PREWARM_MARGIN = int(os.getenv("CACHE_PREWARM_MARGIN", "3600"))
+CACHE_PREWARM_BATCH = int(os.getenv("CACHE_PREWARM_BATCH", "10"))
+
+SCRAPE_CACHE = CacheStore(CACHE_DB, namespace="scrape", ttl=CACHE_DURATION + CACHE_STALE_DURATION,
+                          max_entries=CACHE_MAX_ENTRIES)
+CACHE_STATS = {"hit": 0, "miss": 0, "stale": 0, "refresh": 0, "prewarm": 0, "speculative": 0,
+               "revalidated": 0, "changed": 0}
+CACHE_STATS_LOCK = threading.Lock()
+
+# --- Revalidación de entradas expiradas ---
+# Antes de repetir scrape.do + IA se comprueba si el artículo cambió: GET
+# directo al sitio (condicional con ETag / Last-Modified si los dio) o hash del
+# texto extraído. Sin cambios se reutiliza el resultado guardado tal cual.
+REVALIDATE = os.getenv("REVALIDATE", "1") == "1"
+VALIDATORS_CACHE = CacheStore(CACHE_DB, namespace="validators", ttl=CACHE_DURATION + CACHE_STALE_DURATION,
+                              max_entries=CACHE_MAX_ENTRIES)
+# Dominios que rechazan el GET directo (403, captcha, muro...) no se reintentan en este tiempo
+ORIGIN_BLOCK_DURATION = int(os.getenv("ORIGIN_BLOCK_DURATION", str(60 * 60 * 24)))
+# La página directa solo vale si su texto es al menos esta fracción del guardado
+ORIGIN_MIN_TEXT_RATIO = 0.5
+UNCHANGED, CHANGED = "unchanged", "changed"
+
+# --- Caché de Pexels (misma base SQLite, namespace propio) ---
+PEXELS_CACHE_DURATION = int(os.getenv("PEXELS_CACHE_DURATION", str(60 * 60 * 6)))  # 6 horas
+PEXELS_CACHE = CacheStore(CACHE_DB, namespace="pexels", ttl=PEXELS_CACHE_DURATION,
+                          max_entries=int(os.getenv("PEXELS_CACHE_MAX_ENTRIES", "2000")))
+PEXELS_BATCH_MAX_QUERIES = 20
+CARD_IDS = ('A', 'B', 'C', 'D')
+
+# --- Alternativas (Google CSE) cuando el scrape falla ---
+SEARCH_CACHE_DURATION = int(os.getenv("SEARCH_CACHE_DURATION", str(60 * 60 * 6)))  # 6 horas
+SEARCH_CACHE = CacheStore(CACHE_DB, namespace="search", ttl=SEARCH_CACHE_DURATION,
+                          max_entries=int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2000")))
+ALTERNATIVES_MAX_RESULTS = 5
+# Cuántas alternativas se scrapean de antemano (en segundo plano) por búsqueda
+ALTERNATIVES_PREFETCH = int(os.getenv("ALTERNATIVES_PREFETCH", "2"))
+
+# --- Imágenes iniciales de las tarjetas (pool precalculado) ---
+INITIAL_IMAGE_QUERIES = [q.strip() for q in os.getenv(
+    "INITIAL_IMAGE_QUERIES",
+    "city skyline night,abstract technology,newspaper press,aerial ocean,mountain landscape,science laboratory"
+).split(",") if q.strip()]
+INITIAL_IMAGES_PER_QUERY = int(os.getenv("INITIAL_IMAGES_PER_QUERY", "4"))
+INITIAL_IMAGES_REFRESH = int(os.getenv("INITIAL_IMAGES_REFRESH", str(60 * 60 * 6)))  # 6 horas
+POOL_CACHE = CacheStore(CACHE_DB, namespace="pool", ttl=60 * 60 * 24 * 7, max_entries=10)
+INITIAL_IMAGES_KEY = "initial_images"
+
+# --- Caché de resultados IA (por contenido, compartida por /api/scrape y /api/generate_carousel) ---
+# La clave es un hash del título + texto normalizados, la versión de la
+# plantilla y el modelo: el mismo artículo sindicado en otra URL no se
+# vuelve a generar. Subir AI_PROMPT_VERSION invalida todo lo anterior
+# (cambiar el texto de una plantilla ya invalida sus resultados).
+AI_PROMPT_VERSION = os.getenv("AI_PROMPT_VERSION", "1")
+AI_CACHE_DURATION = int(os.getenv("AI_CACHE_DURATION", str(60 * 60 * 24 * 7)))  # 7 días
+AI_CACHE = CacheStore(CACHE_DB, namespace="ai", ttl=AI_CACHE_DURATION,
+                      max_entries=int(os.getenv("AI_CACHE_MAX_ENTRIES", "5000")))
+
+# --- Caché de imágenes del proxy (en disco) ---
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "image_cache")
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+IMAGE_RESIZE_WORKERS = int(os.getenv("IMAGE_RESIZE_WORKERS", "2"))
+IMAGE_BROWSER_MAX_AGE = 60 * 60 * 24
+
+# --- Concurrencia del pipeline ---
+# Etapas independientes de /api/scrape (IA variantes, IA carrusel, ...)
+PIPELINE_MAX_WORKERS = int(os.getenv("PIPELINE_MAX_WORKERS", "8"))
+# Búsquedas de imágenes por slide (pool propio para no bloquear el de etapas)
+IMAGE_MAX_WORKERS = int(os.getenv("IMAGE_MAX_WORKERS", "6"))
+PIPELINE_EXECUTOR = ThreadPoolExecutor(max_workers=PIPELINE_MAX_WORKERS, thread_name_prefix="stage")
+IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=IMAGE_MAX_WORKERS, thread_name_prefix="pexels")
+# Límite de llamadas simultáneas por etapa (por proceso)
+STAGE_SLOTS = {
+    'scrape_do': threading.BoundedSemaphore(int(os.getenv("SCRAPE_DO_MAX_CONCURRENCY", "4"))),
+    'ai': threading.BoundedSemaphore(int(os.getenv("AI_MAX_CONCURRENCY", "6"))),
+}
+# Presupuesto aparte, y menor, para el trabajo de fondo (lotes, refrescos,
+# scrapes especulativos): no ocupa los hilos ni los turnos de las peticiones
+# interactivas, que hacen cola FIFO en los semáforos de arriba
+BACKGROUND_PIPELINE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv("BACKGROUND_PIPELINE_MAX_WORKERS", "4")), thread_name_prefix="stage-bg"
+)
+BACKGROUND_STAGE_SLOTS = {
+    'scrape_do': threading.BoundedSemaphore(int(os.getenv("BACKGROUND_SCRAPE_DO_MAX_CONCURRENCY", "2"))),
+    'ai': threading.BoundedSemaphore(int(os.getenv("BACKGROUND_AI_MAX_CONCURRENCY", "2"))),
+}
+# Executor + slots del trabajo en curso (lo hereda quien copie el contexto,
+# como las etapas de run_graph); sin stage_budget() se eligen por prioridad
+_stage_budget = contextvars.ContextVar("stage_budget", default=None)
+
+
+@contextmanager
+def stage_budget(executor, slots: dict):
+    """Ejecuta el bloque con su propio executor de etapas y límites por etapa (p. ej. asgi.py)."""
+    token = _stage_budget.set((executor, slots))
+    try:
+        yield
+    finally:
+        _stage_budget.reset(token)
+
+
+def current_stage_budget():
+    """(executor, slots) para las etapas del trabajo actual."""
+    budget = _stage_budget.get()
+    if budget is not None:
+        return budget
+    if rate_limit.current_priority() == BACKGROUND:
+        return BACKGROUND_PIPELINE_EXECUTOR, BACKGROUND_STAGE_SLOTS
+    return PIPELINE_EXECUTOR, STAGE_SLOTS
+
+
+def stage_slot(name: str):
+    return current_stage_budget()[1][name]
+
+
+# Cuotas por upstream (token bucket compartido entre workers vía SQLite):
+# 'nombre=peticiones/segundos:burst'. El trabajo de fondo (refrescos,
+# pre-carga) deja libre RATE_LIMIT_RESERVE del cubo para las interactivas;
+# sin token a tiempo se espera hasta RATE_LIMIT_MAX_WAIT_* y luego se degrada.
+RATE_LIMITS = os.getenv(
+    "RATE_LIMITS", "pexels=200/3600:20,google=100/86400:10,scrape_do=5/1:10,openai=500/60:20"
+)
+RATE_LIMIT_RESERVE = float(os.getenv("RATE_LIMIT_RESERVE", "0.3"))
+RATE_LIMITER = RateLimiter(
+    CACHE_DB,
+    {name: rate_limit.Bucket(b.rate, b.burst, RATE_LIMIT_RESERVE) for name, b in parse_limits(RATE_LIMITS).items()},
+    max_wait={
+        INTERACTIVE: float(os.getenv("RATE_LIMIT_MAX_WAIT_INTERACTIVE", "5")),
+        BACKGROUND: float(os.getenv("RATE_LIMIT_MAX_WAIT_BACKGROUND", "120")),
+    },
+)
+http_client.set_limiter(RATE_LIMITER)
+
+# Salud por dominio: tras N fallos seguidos se salta scrape.do y se va al fallback
+DOMAIN_HEALTH = DomainHealth(
+    CACHE_DB,
+    failure_threshold=int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "3")),
+    cooldown=int(os.getenv("CIRCUIT_COOLDOWN", str(15 * 60))),
+)
+
+# Coalescencia de scrapes idénticos simultáneos (entre workers vía SQLite).
+# La cancelación de un trabajo no se contagia, ni la falta de cuota (el líder
+# puede ser de prioridad de fondo): quien esperaba vuelve a intentarlo
+SCRAPE_FLIGHTS = SingleFlight(CACHE_DB, namespace="scrape", retry_on=(JobCancelled, RateLimited))
+# Eventos parciales del scrape en curso (NDJSON de /api/scrape/stream) para
+# quien espera la misma clave en este proceso
+SCRAPE_EVENTS = Broadcast()
+
+# --- Cola de trabajos (scrapes en segundo plano) ---
+# SCRAPE_ASYNC=1 hace que /api/scrape encole por defecto en vez de bloquear
+SCRAPE_ASYNC = os.getenv("SCRAPE_ASYNC", "0") == "1"
+JOBS = JobQueue(CACHE_DB, workers=int(os.getenv("SCRAPE_JOB_WORKERS", "4")))
+
+# --- Lotes (/api/bulk_scrape: lista de URLs o feed RSS/Atom/sitemap) ---
+# Corren como trabajos de JOBS con prioridad de fondo; el progreso queda en SQLite para retomarlos
+BULK_MAX_URLS = int(os.getenv("BULK_MAX_URLS", "500"))
+BULK_MAX_SITEMAPS = int(os.getenv("BULK_MAX_SITEMAPS", "10"))  # hijos de un sitemap índice
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "4"))
+BULK_MAX_CONCURRENCY = int(os.getenv("BULK_MAX_CONCURRENCY", "16"))
+BULK_PER_DOMAIN = int(os.getenv("BULK_PER_DOMAIN", "2"))          # simultáneas por dominio
+BULK_DOMAIN_DELAY = float(os.getenv("BULK_DOMAIN_DELAY", "1.0"))  # segundos entre arranques por dominio
+BULK_EXECUTOR = ThreadPoolExecutor(max_workers=BULK_MAX_CONCURRENCY, thread_name_prefix="bulk",
+                                   initializer=rate_limit.set_thread_priority, initargs=(BACKGROUND,))
+BATCHES = BatchStore(CACHE_DB)
+BULK_STREAM_POLL = float(os.getenv("BULK_STREAM_POLL", "1.0"))  # segundos entre lecturas del progreso
+
+# --- Métricas (/metrics en formato Prometheus + header Server-Timing) ---
+# Cada worker vuelca las suyas a SQLite; /metrics devuelve la suma
+METRICS = metrics.SnapshotStore(CACHE_DB, interval=int(os.getenv("METRICS_PUBLISH_INTERVAL", "5")))
+REQUEST_SECONDS = metrics.histogram(
+    "sentient_http_request_duration_seconds", "Duración de las peticiones HTTP entrantes",
+    ("endpoint", "method", "status")
+)
+REQUESTS_IN_FLIGHT = metrics.gauge("sentient_http_requests_in_flight", "Peticiones HTTP en curso")
+CACHE_EVENTS = metrics.counter(
+    "sentient_cache_events_total", "Aciertos, fallos y refrescos por caché", ("cache", "event")
+)
 
 # Headers para simular navegador (Usado en proxy de imágenes)
 BROWSER_HEADERS = {
@@ -67,9 +274,76 @@ BROWSER_HEADERS = {
     'Accept-Language': 'en-US,en;q=0.9',
 }
 
+IMAGE_CACHE = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_MAX_BYTES,
+                         workers=IMAGE_RESIZE_WORKERS, fetch_headers=BROWSER_HEADERS)
+
+# --- Render de tarjetas y slides en el servidor (Pillow, pool de procesos) ---
+# Los PNG/JPEG se guardan en la caché de imágenes bajo un hash de su contenido
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_FONT_DIR = os.getenv("RENDER_FONT_DIR", "fonts")  # Inter-*.ttf (ver render.FONT_FILES)
+# Sin las fuentes /api/render/* responde 503; RENDER_REQUIRE_FONTS=0 acepta la de Pillow
+RENDER_REQUIRE_FONTS = os.getenv("RENDER_REQUIRE_FONTS", "1") == "1"
+RENDER_MAX_SLIDES = 20
+RENDERER = render.Renderer(RENDER_WORKERS, RENDER_FONT_DIR, require_fonts=RENDER_REQUIRE_FONTS)
+if RENDERER.missing:
+    print(f"❌ Render: faltan {', '.join(RENDERER.missing)} en '{RENDER_FONT_DIR}' "
+          + ("(/api/render/* responderá 503)" if RENDER_REQUIRE_FONTS else "(se usará la fuente de Pillow)"))
+# Hilos que preparan fondos y esperan al pool (export de un carrusel entero)
+RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=RENDER_WORKERS * 2, thread_name_prefix="render")
+# Layout y tag por tarjeta (state.data en static/app.js)
+CARD_PRESETS = {
+    'A': {'layout': 'layout-standard', 'tag': 'NEWS'},
+    'B': {'layout': 'layout-centered', 'tag': 'STORY'},
+    'C': {'layout': 'layout-bold', 'tag': 'BREAKING'},
+    'D': {'layout': 'layout-standard', 'tag': 'NERD'},
+}
+
+# --- Pre-carga de las imágenes de cada resultado en la caché del proxy ---
+IMAGE_PREFETCH = os.getenv("IMAGE_PREFETCH", "1") == "1"
+IMAGE_PREFETCH_WORKERS = int(os.getenv("IMAGE_PREFETCH_WORKERS", "4"))
+IMAGE_PREFETCH_BUDGET = int(os.getenv("IMAGE_PREFETCH_BUDGET", str(20 * 1024 * 1024)))  # bytes por scrape
+# Variante que piden las tarjetas (.render-target 1080x1440, fondo en cover); ver proxyImageUrl en utils.js
+CARD_IMAGE_VARIANT = {"width": 1080, "height": 1440, "fit": "cover"}
+PREFETCH_EXECUTOR = ThreadPoolExecutor(max_workers=IMAGE_PREFETCH_WORKERS, thread_name_prefix="prefetch",
+                                       initializer=rate_limit.set_thread_priority, initargs=(BACKGROUND,))
+
 # --------------------------------------------------------------------
 # Utilidades
 # --------------------------------------------------------------------
+_ai_backend = None
+_ai_backend_lock = threading.Lock()
+
+
+def get_ai_backend():
+    """
+    Backend de IA (ai_backend.build_backend), creado en el primer uso de cada
+    worker: el cliente de OpenAI abre su propio pool de conexiones y no debe
+    heredarse del master. None si faltan credenciales o el SDK.
+    """
+    global _ai_backend
+    if _ai_backend is None:
+        with _ai_backend_lock:
+            if _ai_backend is None:
+                _ai_backend = build_ai_backend() or False
+    return _ai_backend or None
+
+
+def build_ai_backend():
+    if not OPENAI_API_KEY:
+        return None
+    try:
+        from openai import OpenAI
+        client = OpenAI(api_key=OPENAI_API_KEY, base_url=OPENAI_BASE_URL)
+        print("✅ IA (OpenAI): Cliente activo")
+    except Exception as e:
+        print(f"⚠️ ERROR: No se pudo iniciar el cliente OpenAI: {e}")
+        return None
+    backend = build_backend(client, mode=AI_BACKEND_MODE, model=OPENAI_MODEL, assistant_id=OPENAI_ASSISTANT_ID)
+    if backend is not None:
+        print(f"✅ IA: backend '{backend.name}'")
+    return backend
+
+
 def clean_pexels_query(query: str) -> str:
     stop_words = set([
         'the', 'a', 'an', 'is', 'are', 'was', 'were', 'by', 'of', 'in',
@@ -81,26 +355,205 @@ def clean_pexels_query(query: str) -> str:
     return " ".join(words[:5])
 
 
-def get_pexels_images(query: str, count: int = 4):
+def get_pexels_images(query: str, count: int = 4, orientation: str = 'portrait'):
+    """
+    URLs de Pexels para `query` ([] si no hay resultados o falla). Lanza
+    RateLimited si la cuota está agotada, para que el llamador lo diga en
+    lugar de devolver una lista vacía como si no hubiera fotos.
+    """
     if not PEXELS_API_KEY:
         return []
     search_query = clean_pexels_query(query)
     if not search_query:
         return []
+
+    cache_key = pexels_cache_key(search_query, count, orientation)
+    cached = cached_pexels_images(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        headers = {'Authorization': PEXELS_API_KEY}
-        url = f'https://api.pexels.com/v1/search?query={quote_plus(search_query)}&per_page={count}&orientation=portrait'
-        r = requests.get(url, headers=headers, timeout=8)
-        if r.status_code == 200 and r.headers.get('content-type', '').startswith('application/json'):
-            data = r.json()
-            return [p['src']['large2x'] for p in data.get('photos', [])]
-        return []
+        with metrics.timed('pexels'):
+            r = http_client.get('pexels', pexels_search_url(search_query, count, orientation),
+                                headers={'Authorization': PEXELS_API_KEY})
+        return pexels_images_from_response(cache_key, r)
+    except RateLimited as e:
+        print(f"⏳ Pexels sin cuota ({search_query}): {e}")
+        raise
     except Exception:
         return []
 
 
+# Piezas de get_pexels_images compartidas con su versión asíncrona (asgi.py)
+def pexels_cache_key(search_query: str, count: int, orientation: str) -> str:
+    # Caché por consulta normalizada + orientación + cantidad
+    return f"{search_query}|{orientation}|{count}"
+
+
+def cached_pexels_images(cache_key: str):
+    cached = PEXELS_CACHE.get(cache_key)
+    if cached and time.time() - cached['ts'] < PEXELS_CACHE_DURATION:
+        CACHE_EVENTS.inc(cache="pexels", event="hit")
+        return cached['data']
+    CACHE_EVENTS.inc(cache="pexels", event="miss")
+    return None
+
+
+def pexels_search_url(search_query: str, count: int, orientation: str) -> str:
+    return f'{PEXELS_API_URL}/search?query={quote_plus(search_query)}&per_page={count}&orientation={orientation}'
+
+
+def pexels_images_from_response(cache_key: str, r) -> list:
+    """URLs de una respuesta de Pexels (requests o httpx); 429 -> RateLimited."""
+    if r.status_code == 429:
+        raise RateLimited('pexels', float(r.headers.get('Retry-After') or 60))
+    if r.status_code != 200 or not r.headers.get('content-type', '').startswith('application/json'):
+        return []
+    images = [p['src']['large2x'] for p in r.json().get('photos', [])]
+    # Solo se cachean respuestas válidas (los errores se reintentan)
+    PEXELS_CACHE.set(cache_key, images)
+    return images
+
+
+def get_pexels_images_batch(queries: list, count: int = 1, orientation: str = 'portrait') -> dict:
+    """
+    Resuelve varias consultas en paralelo. Las consultas que normalizan a lo
+    mismo se piden una sola vez. Devuelve {consulta_original: [urls]}.
+    Si alguna se quedó sin cuota se relanza RateLimited al final.
+    """
+    by_clean = {}
+    for q in queries:
+        by_clean.setdefault(clean_pexels_query(q), []).append(q)
+
+    results = {}
+    limited = None
+    futures = {
+        IMAGE_EXECUTOR.submit(metrics.with_context(get_pexels_images), originals[0], count, orientation): clean
+        for clean, originals in by_clean.items() if clean
+    }
+    for fut in as_completed(futures):
+        try:
+            images = fut.result()
+        except RateLimited as e:
+            limited, images = e, []
+        for q in by_clean[futures[fut]]:
+            results[q] = images
+    if limited is not None:
+        raise limited
+    for q in by_clean.get('', []):
+        results[q] = []
+    return results
+
+
+CONTEXT_TOKENS = metrics.counter(
+    "sentient_ai_context_tokens_total", "Tokens del artículo antes (source) y después (sent) de compactar", ("kind",)
+)
+
+
+@lru_cache(maxsize=64)
+def ai_context(title: str, text: str) -> str:
+    """
+    Texto compactado para los prompts. Cacheado por (título, texto): las
+    dos llamadas IA de un mismo scrape comparten el mismo contexto.
+    """
+    context = compact(title, text, AI_CONTEXT_TOKENS)
+    CONTEXT_TOKENS.inc(context.source_tokens, kind="source")
+    CONTEXT_TOKENS.inc(context.tokens, kind="sent")
+    if context.saved_tokens:
+        print(f"✂️ Contexto IA: {context.tokens}/{context.source_tokens} tokens "
+              f"({context.sentences_kept}/{context.sentences_total} frases)")
+    return context.text
+
+
+def article_prompt(title: str, text: str, source: str) -> str:
+    return f"""
+        Article data:
+        TITLE: {title}
+        SOURCE: {source}
+        TEXT: {ai_context((title or '').strip(), text or '')}
+        """
+
+
+VARIANTS_TASK = """
+        Task:
+        Return a JSON object with three keys:
+        1. "variants": An object with 4 variations (A, B, C, D) for social media posts.
+           - A: Standard News
+           - B: Storytelling
+           - C: Breaking News
+           - D: Nerd / Technical / Deep Dive (Focus on specs, numbers, analysis)
+        2. "common_caption": A general, engaging caption for the post.
+        3. "image_keywords": A JSON list of 3-5 specific, relevant keywords from the text for searching stock photos (e.g., ["solar storm", "aurora", "sun"]).
+        """
+
+CAROUSEL_TASK = """
+        Task:
+        Analyze this article and extract the 5 most important and interesting main ideas.
+        For each idea, create a carousel slide with:
+        1. A short, punchy TITLE (3-8 words max, attention-grabbing)
+        2. A SENTENCE that expands on the title (10-20 words, clear and engaging)
+        3. IMAGE_KEYWORDS: 2-4 specific keywords for finding a relevant stock photo on Pexels
+        
+        Also:
+        - Create a CAPTION: A longer, engaging caption (100-200 characters) for an Instagram post.
+        - RECOMMEND the ideal number of slides (2, 3, 4, or 5) based on:
+          * Article complexity and depth
+          * Number of distinct key points
+          * Audience engagement potential
+          * Content richness
+        
+        Return a JSON object with this structure:
+        {
+            "recommended_slides": 3,  // Your recommendation: 2, 3, 4, or 5
+            "recommendation_reason": "Brief reason for your choice",
+            "slides": [
+                {
+                    "title": "Short Punchy Title",
+                    "sentence": "Engaging sentence that expands the title.",
+                    "image_keywords": ["keyword1", "keyword2", "keyword3"]
+                },
+                ... (always provide exactly 5 slides, frontend will use subset based on selection)
+            ],
+            "caption": "Longer engaging caption for the post..."
+        }
+        """
+
+
+def ai_cache_key(call: str, title: str, text: str) -> str:
+    template = {"variants": VARIANTS_TASK, "carousel": CAROUSEL_TASK}[call]
+    normalize = lambda value: re.sub(r'\s+', ' ', value or '').strip().lower()
+    parts = [
+        call,
+        AI_PROMPT_VERSION,
+        hashlib.sha256(template.encode()).hexdigest()[:12],
+        str(AI_CONTEXT_TOKENS),
+        OPENAI_MODEL if AI_BACKEND_MODE == 'chat' else (OPENAI_ASSISTANT_ID or ''),
+        normalize(title),
+        normalize(text),
+    ]
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+def ai_cache_get(call: str, title: str, text: str):
+    cached = AI_CACHE.get(ai_cache_key(call, title, text))
+    if cached and time.time() - cached['ts'] < AI_CACHE_DURATION:
+        CACHE_EVENTS.inc(cache="ai", event="hit")
+        print(f"✅ IA ({call}) desde caché")
+        return cached['data']
+    CACHE_EVENTS.inc(cache="ai", event="miss")
+    return None
+
+
+def ai_cache_set(call: str, title: str, text: str, payload):
+    try:
+        AI_CACHE.set(ai_cache_key(call, title, text), payload)
+    except Exception as e:
+        print(f"⚠️ Error al guardar caché IA: {e}")
+
+
 def get_ai_data(title: str = None, text: str = None, source: str = None, keywords: str = None):
-    if not OPENAI_CLIENT or not OPENAI_ASSISTANT_ID:
+    backend = get_ai_backend()
+    if backend is None:
         return None, "Faltan credenciales OpenAI"
     
     try:
@@ -123,57 +576,31 @@ def get_ai_data(title: str = None, text: str = None, source: str = None, keyword
             3. "image_keywords": A JSON list of 3-5 specific, relevant keywords from the context (e.g., ["solar storm", "aurora", "sun"]).
             """
         else:
+            cached = ai_cache_get("variants", title, text)
+            if cached is not None:
+                return cached, None
             # --- PROMPT ORIGINAL (BASADO EN ARTÍCULO) ---
-            prompt_content = f"""
-            Article data:
-            TITLE: {title}
-            SOURCE: {source}
-            TEXT: {text[:3000]}
-            
-            Task:
-            Return a JSON object with three keys:
-            1. "variants": An object with 4 variations (A, B, C, D) for social media posts.
-               - A: Standard News
-               - B: Storytelling
-               - C: Breaking News
-               - D: Nerd / Technical / Deep Dive (Focus on specs, numbers, analysis)
-            2. "common_caption": A general, engaging caption for the post.
-            3. "image_keywords": A JSON list of 3-5 specific, relevant keywords from the text for searching stock photos (e.g., ["solar storm", "aurora", "sun"]).
-            """
+            prompt_content = article_prompt(title, text, source) + VARIANTS_TASK
 
-        run = OPENAI_CLIENT.beta.threads.create_and_run_poll(
-            assistant_id=OPENAI_ASSISTANT_ID,
-            thread={
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt_content
-                    }
-                ]
-            },
-            poll_interval_ms=2000,
-            timeout=40
-        )
-        if run.status == 'completed':
-            msgs = OPENAI_CLIENT.beta.threads.messages.list(thread_id=run.thread_id)
-            try:
-                text_response = msgs.data[0].content[0].text.value
-                json_match = re.search(r'```json\s*([\s\S]+?)\s*```', text_response)
-                if json_match:
-                    payload_str = json_match.group(1)
-                else:
-                    payload_str = text_response
-                
-                payload = json.loads(payload_str)
-                return payload, None
-            except Exception as e:
-                return None, f"AI JSON parse error: {e} | Response was: {msgs.data[0].content[0].text.value[:200]}"
-        else:
-            return None, f"Estado IA no completado: {run.status}"
+        RATE_LIMITER.acquire('openai')
+        with stage_slot('ai'), metrics.timed('fallback_ai' if keywords else 'variants_ai'):
+            payload, err = backend.generate(prompt_content, VARIANTS_SCHEMA, timeout=40, schema_name="variants")
+        if payload is not None and not err and not keywords:
+            ai_cache_set("variants", title, text, payload)
+        return payload, err
     except Exception as e:
         return None, str(e)
 
 
+def carousel_defaults(payload: dict) -> dict:
+    # Ensure recommended_slides has a default
+    if 'recommended_slides' not in payload:
+        payload['recommended_slides'] = min(len(payload.get('slides', [])), 5)
+    if 'recommendation_reason' not in payload:
+        payload['recommendation_reason'] = 'Based on article content analysis'
+    return payload
+
+
 def get_carousel_data(title: str, text: str, source: str):
     """
     Generate carousel content with multiple options: 2, 3, 4, and 5 slides.
@@ -181,84 +608,71 @@ def get_carousel_data(title: str, text: str, source: str):
     Each slide has a short title, a sentence, and image keywords.
     Plus a longer caption for the text card.
     """
-    if not OPENAI_CLIENT or not OPENAI_ASSISTANT_ID:
+    backend = get_ai_backend()
+    if backend is None:
         return None, "Faltan credenciales OpenAI"
     
     try:
-        prompt_content = f"""
-        Article data:
-        TITLE: {title}
-        SOURCE: {source}
-        TEXT: {text[:4000]}
-        
+        cached = ai_cache_get("carousel", title, text)
+        if cached is not None:
+            return cached, None
+
+        prompt_content = article_prompt(title, text, source) + CAROUSEL_TASK
+
+        RATE_LIMITER.acquire('openai')
+        with stage_slot('ai'), metrics.timed('carousel_ai'):
+            payload, err = backend.generate(prompt_content, CAROUSEL_SCHEMA, timeout=50, schema_name="carousel")
+        if err:
+            return None, f"Carousel AI: {err}"
+        payload = carousel_defaults(payload)
+        # Se guarda antes de que attach_slide_images añada las imágenes
+        ai_cache_set("carousel", title, text, payload)
+        return payload, None
+    except Exception as e:
+        return None, str(e)
+
+
+def get_combined_data(title: str, text: str, source: str):
+    """
+    Variantes y carrusel en una sola llamada (AI_MERGED_REQUEST=1).
+    Devuelve ((variants_payload, carousel_payload), error). Si solo una de
+    las dos está en caché devuelve (None, None) para que la otra se pida sola.
+    """
+    backend = get_ai_backend()
+    if backend is None:
+        return None, "Faltan credenciales OpenAI"
+
+    try:
+        cached_variants = ai_cache_get("variants", title, text)
+        cached_carousel = ai_cache_get("carousel", title, text)
+        if cached_variants is not None and cached_carousel is not None:
+            return (cached_variants, cached_carousel), None
+        if cached_variants is not None or cached_carousel is not None:
+            return None, None
+
+        prompt_content = article_prompt(title, text, source) + f"""
         Task:
-        Analyze this article and extract the 5 most important and interesting main ideas.
-        For each idea, create a carousel slide with:
-        1. A short, punchy TITLE (3-8 words max, attention-grabbing)
-        2. A SENTENCE that expands on the title (10-20 words, clear and engaging)
-        3. IMAGE_KEYWORDS: 2-4 specific keywords for finding a relevant stock photo on Pexels
-        
-        Also:
-        - Create a CAPTION: A longer, engaging caption (100-200 characters) for an Instagram post.
-        - RECOMMEND the ideal number of slides (2, 3, 4, or 5) based on:
-          * Article complexity and depth
-          * Number of distinct key points
-          * Audience engagement potential
-          * Content richness
-        
-        Return a JSON object with this structure:
-        {{
-            "recommended_slides": 3,  // Your recommendation: 2, 3, 4, or 5
-            "recommendation_reason": "Brief reason for your choice",
-            "slides": [
-                {{
-                    "title": "Short Punchy Title",
-                    "sentence": "Engaging sentence that expands the title.",
-                    "image_keywords": ["keyword1", "keyword2", "keyword3"]
-                }},
-                ... (always provide exactly 5 slides, frontend will use subset based on selection)
-            ],
-            "caption": "Longer engaging caption for the post..."
-        }}
+        Return a JSON object with the four keys "variants", "common_caption",
+        "image_keywords" and "carousel", completing both parts below.
+
+        PART 1 (keys "variants", "common_caption", "image_keywords"):
+        {VARIANTS_TASK}
+        PART 2 (key "carousel", same structure as described):
+        {CAROUSEL_TASK}
         """
 
-        run = OPENAI_CLIENT.beta.threads.create_and_run_poll(
-            assistant_id=OPENAI_ASSISTANT_ID,
-            thread={
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt_content
-                    }
-                ]
-            },
-            poll_interval_ms=2000,
-            timeout=50
-        )
-        
-        if run.status == 'completed':
-            msgs = OPENAI_CLIENT.beta.threads.messages.list(thread_id=run.thread_id)
-            try:
-                text_response = msgs.data[0].content[0].text.value
-                json_match = re.search(r'```json\s*([\s\S]+?)\s*```', text_response)
-                if json_match:
-                    payload_str = json_match.group(1)
-                else:
-                    payload_str = text_response
-                
-                payload = json.loads(payload_str)
-                
-                # Ensure recommended_slides has a default
-                if 'recommended_slides' not in payload:
-                    payload['recommended_slides'] = min(len(payload.get('slides', [])), 5)
-                if 'recommendation_reason' not in payload:
-                    payload['recommendation_reason'] = 'Based on article content analysis'
-                    
-                return payload, None
-            except Exception as e:
-                return None, f"Carousel AI JSON parse error: {e} | Response was: {text_response[:200]}"
-        else:
-            return None, f"Carousel AI no completado: {run.status}"
+        RATE_LIMITER.acquire('openai')
+        with stage_slot('ai'), metrics.timed('combined_ai'):
+            payload, err = backend.generate(prompt_content, COMBINED_SCHEMA, timeout=60, schema_name="combined")
+        if err:
+            return None, f"Combined AI: {err}"
+        carousel = payload.pop('carousel', None)
+        if not isinstance(carousel, dict):
+            return None, "Combined AI: missing carousel"
+        carousel = carousel_defaults(carousel)
+        ai_cache_set("variants", title, text, payload)
+        ai_cache_set("carousel", title, text, carousel)
+        return (payload, carousel), None
     except Exception as e:
         return None, str(e)
 
@@ -296,310 +710,1729 @@ def perform_google_search(query: str, max_results: int = 5):
     if not GOOGLE_SEARCH_API_KEY or not GOOGLE_SEARCH_CX:
         return []
     try:
-        url = "https://www.googleapis.com/customsearch/v1"
-        params = {
-            'key': GOOGLE_SEARCH_API_KEY,
-            'cx': GOOGLE_SEARCH_CX,
-            'q': query,
-            'num': max_results,
-            'fields': 'items(title,link,snippet)'
-        }
-        r = requests.get(url, params=params, timeout=8)
-        if not r.headers.get('Content-Type', '').startswith('application/json'):
-             return []
-
-        data = r.json()
-        results = []
-        for item in data.get('items', []):
-            results.append({
-                'title': item.get('title', 'No Title'),
-                'url': item.get('link', '#'),
-                'snippet': item.get('snippet', '')
-            })
-        return results
+        r = http_client.get('google', GOOGLE_SEARCH_URL, params=google_search_params(query, max_results))
+        return google_results_from_response(r)
+    except RateLimited as e:
+        print(f"⏳ Google sin cuota: {e}")
+        return []
     except Exception:
          return []
 
 
-def domain_of(url: str) -> str:
-    try:
-        return urlparse(url).netloc.replace('www.', '')
-    except Exception:
-        return ""
+def google_search_params(query: str, max_results: int) -> dict:
+    return {
+        'key': GOOGLE_SEARCH_API_KEY,
+        'cx': GOOGLE_SEARCH_CX,
+        'q': query,
+        'num': max_results,
+        'fields': 'items(title,link,snippet)'
+    }
 
 
-# --------------------------------------------------------------------
-# Rutas
-# --------------------------------------------------------------------
-@app.route('/')
-def home():
-    return app.send_static_file('index.html')
+def google_results_from_response(r) -> list:
+    if not r.headers.get('Content-Type', '').startswith('application/json'):
+        return []
+    results = []
+    for item in r.json().get('items', []):
+        results.append({
+            'title': item.get('title', 'No Title'),
+            'url': item.get('link', '#'),
+            'snippet': item.get('snippet', '')
+        })
+    return results
 
 
-@app.route('/api/search_image', methods=['POST'])
-def search_image():
-    payload = request.get_json(silent=True) or {}
-    query = payload.get('query', '').strip()
-    count = payload.get('count', 1) 
+def find_alternatives(url: str):
+    """
+    Artículos parecidos en otros medios para una URL que no se pudo scrapear.
+    Devuelve (query, results). Solo se cachean búsquedas con resultados.
+    """
+    query, cache_key = alternatives_query(url)
     if not query:
-        return jsonify({'error': 'Missing query'}), 400
+        return "", []
+    cached = cached_alternatives(cache_key)
+    if cached is not None:
+        return query, cached
+    return query, store_alternatives(cache_key, url, perform_google_search(query, ALTERNATIVES_MAX_RESULTS))
 
-    images = get_pexels_images(query, count=count)
-    return jsonify({'imageUrls': images}), 200
 
+def alternatives_query(url: str):
+    """(query, cache_key) para find_alternatives."""
+    domain, year, keywords = infer_search_info(url)
+    # Sin el dominio en la consulta: se buscan otras fuentes
+    query = " ".join(filter(None, [keywords, year])) or domain
+    return query, f"{query.lower()}|{ALTERNATIVES_MAX_RESULTS}"
 
-@app.route('/api/generate_carousel', methods=['POST'])
-def generate_carousel():
-    """
-    Generate carousel slides from article content.
-    Expects: { "title": "...", "text": "...", "source": "..." }
-    Returns: { "slides": [...], "caption": "...", "error": null }
-    """
-    payload = request.get_json(silent=True) or {}
-    title = payload.get('title', '').strip()
-    text = payload.get('text', '').strip()
-    source = payload.get('source', '').strip()
-    
-    if not title or not text:
-        return jsonify({'error': 'Missing title or text'}), 400
-    
-    # Generate carousel data via AI
-    carousel_data, carousel_err = get_carousel_data(title, text, source)
-    
-    if carousel_err or not carousel_data:
-        return jsonify({'error': carousel_err or 'Failed to generate carousel'}), 500
-    
-    # Get slides from carousel data
-    slides = carousel_data.get('slides', [])
-    caption = carousel_data.get('caption', '')
-    
-    # Fetch images for each slide using Pexels
-    for slide in slides:
-        keywords = slide.get('image_keywords', [])
-        if keywords:
-            query = ' '.join(keywords)
-            images = get_pexels_images(query, count=1)
-            slide['image'] = images[0] if images else ''
-        else:
-            slide['image'] = ''
-    
-    return jsonify({
-        'slides': slides,
-        'caption': caption,
-        'error': None
-    }), 200
 
+def cached_alternatives(cache_key: str):
+    cached = SEARCH_CACHE.get(cache_key)
+    if cached and time.time() - cached['ts'] < SEARCH_CACHE_DURATION:
+        CACHE_EVENTS.inc(cache="search", event="hit")
+        return cached['data']
+    CACHE_EVENTS.inc(cache="search", event="miss")
+    return None
 
-@app.route('/api/scrape', methods=['POST'])
-def scrape():
-    payload = request.get_json(silent=True) or {}
-    url = payload.get('url', '').strip()
-    if not url:
-        return jsonify({'error': 'Missing url'}), 400
 
-    # Caché
-    now = time.time()
-    if url in SCRAPE_CACHE:
-        cached = SCRAPE_CACHE[url]
-        # (Modo Test: Comentar la línea 'if' para forzar el caché)
-        if now - cached['ts'] < CACHE_DURATION: 
-            print("✅ Devolviendo resultado desde caché.")
-            return jsonify(cached['data'])
+def store_alternatives(cache_key: str, url: str, results: list) -> list:
+    """Quita los resultados del mismo dominio (también fallarían) y cachea si queda alguno."""
+    blocked = domain_of(url)
+    results = [r for r in results if r['url'] != '#' and domain_of(r['url']) != blocked]
+    if results:
+        SEARCH_CACHE.set(cache_key, results)
+    return results
 
-    try:
-        # ===== INTEGRACIÓN SCRAPE.DO (ÚNICA OPCIÓN) =====
-        if not SCRAPE_DO_KEY:
-             raise RuntimeError("Scrape.do API key (SCRAPE_DO_KEY) is not configured.")
 
-        target_url_encoded = quote_plus(url)
-        scrape_do_url = f"http://api.scrape.do/?token={SCRAPE_DO_KEY}&url={target_url_encoded}"
-        
-        response = requests.get(scrape_do_url, timeout=60)
-        
-        if not response.ok:
-            raise RuntimeError(f"Scrape.do failed: {response.status_code} - {response.text[:200]}")
-        
-        html_content = response.text
+# Solo parámetros de tracking conocidos: otros nombres genéricos (ref, src,
+# cid, share...) llevan en muchos sitios el id del artículo
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'gbraid', 'wbraid', 'msclkid', 'yclid', 'twclid', 'igshid',
+    'mc_cid', 'mc_eid', 'mkt_tok', '_ga', '_gl', '_hsenc', '_hsmi', 'ref_src', 'smid', 'smtyp',
+}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'mtm_', 'hsa_')
+MOBILE_HOST_PREFIXES = ('www.', 'm.', 'mobile.', 'amp.')
+# Subir al cambiar canonical_url: las claves ya guardadas se migran una vez (import_legacy_cache)
+CANONICAL_KEYS_VERSION = "2"
 
-        if not html_content:
-            raise RuntimeError("Downloaded HTML is empty")
 
-        art = Article(url)
-        art.set_html(html_content)
-        art.parse()
+def canonical_url(url: str) -> str:
+    """
+    Clave de caché canónica: esquema y host en minúsculas, sin www./m./amp.,
+    sin puerto por defecto, sin fragmento ni parámetros de tracking, sin
+    sufijos AMP y con el resto de parámetros ordenados.
+    """
+    try:
+        parsed = urlparse(url.strip())
+        if not parsed.netloc and not parsed.scheme:
+            parsed = urlparse('https://' + url.strip())
 
-        try:
-            art.nlp()
-        except Exception:
-            pass
-
-        title = art.title or ''
-        text = art.text or ''
-        source = domain_of(url) or 'UNKNOWN'
-        top_image = art.top_image 
-
-        original = {
-            "title": title.strip() or 'UNTITLED',
-            "subtitle": (text[:200] + '...') if text else ''
-        }
-        
-        summary = art.summary if art.summary else original["subtitle"]
+        host = (parsed.hostname or '').lower().rstrip('.')
+        for prefix in MOBILE_HOST_PREFIXES:
+            if host.startswith(prefix) and host.count('.') > 1:
+                host = host[len(prefix):]
+                break
+        if parsed.port and parsed.port not in (80, 443):
+            host = f"{host}:{parsed.port}"
 
-        ai_payload, ai_err = get_ai_data(title=original["title"], text=text, source=source)
-        
-        search_query = ""
-        if ai_payload and 'image_keywords' in ai_payload:
-            keywords = ai_payload.get('image_keywords', [])
-            if isinstance(keywords, list) and len(keywords) > 0:
-                search_query = " ".join(keywords)
-        
-        if not search_query and original["title"] != 'UNTITLED':
-            search_query = re.sub(r'[^\w\s]', '', original["title"] or '').lower()
+        path = re.sub(r'/+', '/', parsed.path or '/')
+        path = re.sub(r'(/amp/?|\.amp(?:\.html)?)$', '', path, flags=re.IGNORECASE) or '/'
+        if len(path) > 1:
+            path = path.rstrip('/')
 
-        images = {}
-        if top_image:
-            images["a"] = top_image
-        
-        fallback_variant_d = {
+        query = sorted(
+            (k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True)
+            if k.lower() not in TRACKING_PARAMS and not k.lower().startswith(TRACKING_PREFIXES)
+        )
+        canonical = f"https://{host}{path}"
+        if query:
+            canonical += '?' + urlencode(query)
+        return canonical
+    except Exception:
+        return url.strip()
+
+
+def domain_of(url: str) -> str:
+    try:
+        return urlparse(url).netloc.replace('www.', '')
+    except Exception:
+        return ""
+
+
+# --------------------------------------------------------------------
+# Pipeline de scraping (etapas)
+# --------------------------------------------------------------------
+class CircuitOpen(RuntimeError):
+    """scrape.do se salta porque el dominio tiene el circuito abierto."""
+
+
+class ScrapeDoUnavailable(RuntimeError):
+    """Fallo de scrape.do en sí (sin clave, 401/429/5xx propios): no es culpa del dominio."""
+
+
+class TargetSiteError(RuntimeError):
+    """scrape.do llegó al sitio de destino y este falló; cuenta para el circuito del dominio."""
+
+
+# Status que devolvió el sitio de destino; sin él, el error es del propio proxy
+SCRAPE_DO_TARGET_STATUS = "Scrape.do-Initial-Status-Code"
+
+
+def fetch_with_circuit(url: str) -> str:
+    """fetch_article_html con registro de salud por dominio y circuit breaker.
+
+    Solo los TargetSiteError cuentan como fallo del dominio: la falta de clave,
+    la cuota propia, los errores de transporte con scrape.do y sus 5xx se
+    propagan sin tocar el circuito (que se guarda en CACHE_DB y sobrevive
+    al arreglo del problema real).
+    """
+    if not SCRAPE_DO_KEY:
+        raise ScrapeDoUnavailable("Scrape.do API key (SCRAPE_DO_KEY) is not configured.")
+    domain = domain_of(url)
+    if not DOMAIN_HEALTH.allow(domain):
+        raise CircuitOpen(f"Circuit open for {domain}, skipping scrape.do")
+    start = time.perf_counter()
+    try:
+        html_content = fetch_article_html(url)
+    except TargetSiteError as e:
+        DOMAIN_HEALTH.record_failure(domain, time.perf_counter() - start, str(e))
+        raise
+    DOMAIN_HEALTH.record_success(domain, time.perf_counter() - start)
+    return html_content
+
+
+def fetch_article_html(url: str) -> str:
+    # ===== INTEGRACIÓN SCRAPE.DO (ÚNICA OPCIÓN) =====
+    with stage_slot('scrape_do'), metrics.timed('scrape_do'):
+        response = http_client.get('scrape_do', scrape_do_request_url(url))
+    return scrape_do_html(response)
+
+
+def scrape_do_request_url(url: str) -> str:
+    if not SCRAPE_DO_KEY:
+        raise ScrapeDoUnavailable("Scrape.do API key (SCRAPE_DO_KEY) is not configured.")
+    return f"{SCRAPE_DO_URL}?token={SCRAPE_DO_KEY}&url={quote_plus(url)}"
+
+
+def scrape_do_html(response) -> str:
+    """HTML de una respuesta de scrape.do (requests o httpx).
+
+    TargetSiteError si scrape.do informa de un status de error del sitio de
+    destino (o este devolvió HTML vacío); ScrapeDoUnavailable si el error es
+    del propio scrape.do.
+    """
+    target_status = str(response.headers.get(SCRAPE_DO_TARGET_STATUS) or "").strip()
+    if target_status.isdigit() and int(target_status) >= 400:
+        raise TargetSiteError(f"Target site failed: {target_status} - {response.text[:200]}")
+    if response.status_code >= 400:
+        raise ScrapeDoUnavailable(f"Scrape.do failed: {response.status_code} - {response.text[:200]}")
+
+    html_content = response.text
+    if not html_content:
+        raise TargetSiteError("Downloaded HTML is empty")
+    return html_content
+
+
+def parse_article(url: str, html_content: str) -> dict:
+    # Vía rápida (lxml) con fallback a newspaper; sin art.nlp() (ver article_summary)
+    with metrics.timed('parse'):
+        extraction = extract(url, html_content, engine=EXTRACTION_ENGINE)
+    return article_from_extraction(url, extraction)
+
+
+def article_from_extraction(url: str, extraction) -> dict:
+    title = extraction.title or ''
+    text = extraction.text or ''
+    original = {
+        "title": title.strip() or 'UNTITLED',
+        "subtitle": (text[:200] + '...') if text else ''
+    }
+    return {
+        "url": url,
+        "title": title,
+        "text": text,
+        "source": domain_of(url) or 'UNKNOWN',
+        "top_image": extraction.top_image,
+        "original": original,
+        "engine": extraction.engine,
+    }
+
+
+def article_summary(article: dict) -> str:
+    """Resumen para la variante D de fallback. Se calcula (con NLTK) solo la primera vez que se pide."""
+    if "summary" not in article:
+        with metrics.timed('nlp'):
+            summary = summarize(article["title"], article["text"]) if article["text"] else ''
+        article["summary"] = summary or article["original"]["subtitle"]
+    return article["summary"]
+
+
+def image_prefetcher():
+    """Lote de pre-carga para un resultado (None si está desactivada)."""
+    if not IMAGE_PREFETCH:
+        return None
+    return PrefetchBatch(IMAGE_CACHE, PREFETCH_EXECUTOR, IMAGE_PREFETCH_BUDGET, **CARD_IMAGE_VARIANT)
+
+
+def prefetch_result_images(result: dict, batch=None):
+    """Encola la imagen principal y las de los slides de un resultado ya armado."""
+    batch = batch or image_prefetcher()
+    if batch is None or not result:
+        return
+    urls = [(result.get('images') or {}).get('a')]
+    urls += [slide.get('image') for slide in (result.get('carousel') or {}).get('slides') or []]
+    batch.add_all(url for url in urls if url)
+
+
+def attach_slide_images(slides: list, on_image=None) -> list:
+    """
+    Busca en paralelo la imagen de Pexels de cada slide (modifica `slides`).
+    `on_image(index, url)` se llama a medida que cada búsqueda termina.
+    """
+    def lookup(slide):
+        keywords = slide.get('image_keywords', [])
+        if not keywords:
+            return ''
+        try:
+            images = get_pexels_images(' '.join(keywords), count=1)
+        except RateLimited:
+            return ''
+        return images[0] if images else ''
+
+    futures = {IMAGE_EXECUTOR.submit(metrics.with_context(lookup), slide): i for i, slide in enumerate(slides)}
+    for fut in as_completed(futures):
+        i = futures[fut]
+        slides[i]['image'] = fut.result()
+        if on_image:
+            on_image(i, slides[i]['image'])
+    return slides
+
+
+def build_ai_content(article: dict, ai_payload):
+    """Combina la respuesta IA con los fallbacks. Devuelve (variants, caption, search_query)."""
+    original = article["original"]
+
+    search_query = ""
+    if ai_payload and 'image_keywords' in ai_payload:
+        keywords = ai_payload.get('image_keywords', [])
+        if isinstance(keywords, list) and len(keywords) > 0:
+            search_query = " ".join(keywords)
+
+    if not search_query and original["title"] != 'UNTITLED':
+        search_query = re.sub(r'[^\w\s]', '', original["title"] or '').lower()
+
+    def fallback_variant_d():
+        return {
             "title": f"[Analysis] {original['title']}", 
-            "subtitle": summary
+            "subtitle": article_summary(article)
         }
-        fallback_variant_std = {
-            "title": original["title"], 
-            "subtitle": original["subtitle"]
+
+    fallback_variant_std = {
+        "title": original["title"], 
+        "subtitle": original["subtitle"]
+    }
+
+    final_variants = {}
+    common_caption = original["subtitle"]
+
+    if ai_payload and 'variants' in ai_payload:
+        ai_vars = ai_payload.get('variants', {})
+        final_variants['A'] = ai_vars.get('A', fallback_variant_std)
+        final_variants['B'] = ai_vars.get('B', fallback_variant_std)
+        final_variants['C'] = ai_vars.get('C', fallback_variant_std)
+        final_variants['D'] = ai_vars['D'] if 'D' in ai_vars else fallback_variant_d()
+        common_caption = ai_payload.get('common_caption', common_caption)
+    else:
+        final_variants = {
+            'A': fallback_variant_std,
+            'B': fallback_variant_std,
+            'C': fallback_variant_std,
+            'D': fallback_variant_d()
         }
+    return final_variants, common_caption, search_query
 
-        final_variants = {}
-        common_caption = original["subtitle"]
 
-        if ai_payload and 'variants' in ai_payload:
-            ai_vars = ai_payload.get('variants', {})
-            final_variants['A'] = ai_vars.get('A', fallback_variant_std)
-            final_variants['B'] = ai_vars.get('B', fallback_variant_std)
-            final_variants['C'] = ai_vars.get('C', fallback_variant_std)
-            final_variants['D'] = ai_vars.get('D', fallback_variant_d)
-            common_caption = ai_payload.get('common_caption', common_caption)
-        else:
-            final_variants = {
-                'A': fallback_variant_std,
-                'B': fallback_variant_std,
-                'C': fallback_variant_std,
-                'D': fallback_variant_d
-            }
-
-        # Generate carousel data upfront
-        carousel_data = None
-        carousel_slides = []
-        carousel_caption = common_caption
-        
-        if text and title:
-            print("🎨 Generating carousel data...")
-            carousel_payload, carousel_err = get_carousel_data(title, text, source)
-            
-            if carousel_payload and not carousel_err:
-                carousel_data = carousel_payload
-                carousel_slides = carousel_payload.get('slides', [])
-                carousel_caption = carousel_payload.get('caption', common_caption)
-                
-                # Fetch images for each carousel slide
-                for slide in carousel_slides:
-                    keywords = slide.get('image_keywords', [])
-                    if keywords:
-                        query = ' '.join(keywords)
-                        images_result = get_pexels_images(query, count=1)
-                        slide['image'] = images_result[0] if images_result else ''
-                    else:
-                        slide['image'] = ''
-                
-                print(f"✅ Generated {len(carousel_slides)} carousel slides")
-            else:
-                print(f"⚠️ Carousel generation failed: {carousel_err}")
-        
-        result = {
-            "source": source.upper() if source else "UNKNOWN",
-            "original": original,
-            "full_text": text,  # Include full text for carousel generation
-            "images": images, 
-            "ai_content": {
-                "variants": final_variants,
-                "common_caption": carousel_caption,  # Use carousel caption if available
-                "image_keywords": ai_payload.get('image_keywords', search_query.split()) if ai_payload else search_query.split()
-            },
-            "carousel": {
-                "slides": carousel_slides,
-                "caption": carousel_caption
-            },
-            "ai_error": ai_err
+def scrape_stages(article: dict, on_slide_image=None) -> dict:
+    """
+    Grafo de etapas posteriores al parseo. Las dos llamadas IA solo
+    necesitan título y texto, así que corren en paralelo; las imágenes
+    del carrusel dependen únicamente del carrusel. Con AI_MERGED_REQUEST
+    ambas salen de una sola llamada ('ai') y, si esta falla, cada etapa
+    repite la suya por separado.
+    """
+    title, text, source = article["title"], article["text"], article["source"]
+    # Contexto compactado una sola vez, antes de repartir las llamadas
+    ai_context((title or '').strip(), text or '')
+
+    def variants(ai=None):
+        if ai and ai[0]:
+            return ai[0][0], None
+        return get_ai_data(title=article["original"]["title"], text=text, source=source)
+
+    def carousel(ai=None):
+        if not (text and title):
+            return None, None
+        if ai and ai[0]:
+            return ai[0][1], None
+        print("🎨 Generating carousel data...")
+        return get_carousel_data(title, text, source)
+
+    def combined():
+        print("🎨 Generating variants + carousel data...")
+        payload, err = get_combined_data(title, text, source)
+        if err:
+            print(f"⚠️ {err}; repitiendo por separado")
+        return payload, err
+
+    def slide_images(carousel):
+        carousel_payload, carousel_err = carousel
+        if carousel_payload and not carousel_err:
+            attach_slide_images(carousel_payload.get('slides', []), on_image=on_slide_image)
+        return carousel_payload
+
+    if AI_MERGED_REQUEST and text and title:
+        return {
+            "ai": ((), combined),
+            "variants": (("ai",), variants),
+            "carousel": (("ai",), carousel),
+            "slide_images": (("carousel",), slide_images),
         }
+    return {
+        "variants": ((), variants),
+        "carousel": ((), carousel),
+        "slide_images": (("carousel",), slide_images),
+    }
 
-        SCRAPE_CACHE[url] = {"ts": now, "data": result}
-        
-        # Guardar en caché persistente
+
+def stage_outputs(results: dict, errors: dict):
+    """Normaliza la salida de run_graph a (ai_payload, ai_err, carousel_payload, carousel_err)."""
+    ai_payload, ai_err = results.get("variants") or (None, str(errors.get("variants")))
+    carousel_payload, carousel_err = results.get("carousel") or (None, str(errors.get("carousel")))
+    if "slide_images" in errors:
+        carousel_payload, carousel_err = None, str(errors["slide_images"])
+    return ai_payload, ai_err, carousel_payload, carousel_err
+
+
+def assemble_scrape_result(article: dict, ai_payload, ai_err, carousel_payload, carousel_err) -> dict:
+    original = article["original"]
+    source = article["source"]
+    text = article["text"]
+
+    images = {}
+    if article["top_image"]:
+        images["a"] = article["top_image"]
+
+    final_variants, common_caption, search_query = build_ai_content(article, ai_payload)
+
+    carousel_slides = []
+    carousel_caption = common_caption
+    if carousel_payload and not carousel_err:
+        carousel_slides = carousel_payload.get('slides', [])
+        carousel_caption = carousel_payload.get('caption', common_caption)
+        print(f"✅ Generated {len(carousel_slides)} carousel slides")
+    elif text and article["title"]:
+        print(f"⚠️ Carousel generation failed: {carousel_err}")
+
+    return {
+        "url": article["url"],  # URL pedida (la clave de caché es la canónica)
+        "source": source.upper() if source else "UNKNOWN",
+        "original": original,
+        "full_text": text,  # Include full text for carousel generation
+        "images": images, 
+        "ai_content": {
+            "variants": final_variants,
+            "common_caption": carousel_caption,  # Use carousel caption if available
+            "image_keywords": ai_payload.get('image_keywords', search_query.split()) if ai_payload else search_query.split()
+        },
+        "carousel": {
+            "slides": carousel_slides,
+            "caption": carousel_caption
+        },
+        "ai_error": ai_err
+    }
+
+
+def build_fallback_result(url: str):
+    """Resultado basado solo en keywords de la URL. Devuelve (result, error)."""
+    domain, year, keywords = infer_search_info(url)
+    fallback_query = f"{domain} {keywords} {year}".strip()
+    source = domain_of(url) or 'UNKNOWN'
+
+    ai_payload, ai_err = get_ai_data(source=source, keywords=fallback_query)
+
+    if not ai_payload:
+        return None, f'Scrape failed and AI fallback failed: {ai_err}'
+
+    fallback_title = " ".join(keywords.split()[:5])
+    fallback_subtitle = ai_payload.get('common_caption', 'Could not scrape article.')
+
+    result = {
+        "url": url,
+        "source": source.upper(),
+        "fallback": True,  # Se cachea con FALLBACK_CACHE_DURATION
+        "original": { "title": fallback_title, "subtitle": fallback_subtitle },
+        "images": {"a": ""}, 
+        "ai_content": {
+            "variants": ai_payload.get('variants', {}),
+            "common_caption": ai_payload.get('common_caption', fallback_subtitle),
+            "image_keywords": ai_payload.get('image_keywords', fallback_query.split())
+        },
+        "ai_error": ai_err 
+    }
+    return result, None
+
+
+def count_cache(event: str, n: int = 1):
+    with CACHE_STATS_LOCK:
+        CACHE_STATS[event] += n
+    CACHE_EVENTS.inc(n, cache="scrape", event=event)
+
+
+_refresh_scheduled = {}
+
+
+def claim_schedule(key: str) -> bool:
+    """True una sola vez cada pocos minutos por clave y proceso (evita encolar duplicados)."""
+    now = time.time()
+    with CACHE_STATS_LOCK:
+        if now - _refresh_scheduled.get(key, 0) < 300:
+            return False
+        _refresh_scheduled[key] = now
+        for k in [k for k, ts in _refresh_scheduled.items() if now - ts > 300]:
+            del _refresh_scheduled[k]
+    return True
+
+
+def schedule_refresh(url: str, key: str, seen_ts: float, reason: str = "refresh") -> bool:
+    """Encola (una vez cada pocos minutos por clave y proceso) el refresco de una entrada."""
+    if not claim_schedule(key):
+        return False
+    JOBS.submit('scrape_refresh', {'url': url, 'key': key, 'seen_ts': seen_ts})
+    count_cache(reason)
+    return True
+
+
+def schedule_speculative_scrapes(urls: list) -> int:
+    """
+    Scrapea de antemano (trabajo en segundo plano, prioridad baja) las URLs
+    que el usuario probablemente abra, para que su clic sea un acierto de caché.
+    Se saltan las ya cacheadas y los dominios con el circuito abierto.
+    """
+    scheduled = 0
+    for url in urls:
+        key = canonical_url(url)
+        ts = SCRAPE_CACHE.peek(key)
+        if ts is not None and time.time() - ts < CACHE_DURATION:
+            continue
+        if DOMAIN_HEALTH.state(domain_of(url)) == CIRCUIT_OPEN or not claim_schedule(key):
+            continue
+        JOBS.submit('scrape', {'url': url, 'priority': BACKGROUND})
+        count_cache("speculative")
+        scheduled += 1
+    return scheduled
+
+
+def entry_ttl(data: dict) -> float:
+    # Los resultados de fallback (solo keywords) caducan antes
+    return FALLBACK_CACHE_DURATION if data.get('fallback') else CACHE_DURATION
+
+
+def lookup_scrape_cache(key: str):
+    """
+    Stale-while-revalidate: devuelve la entrada fresca, o la expirada marcada
+    con "stale": true (y encola su refresco), o None si no hay nada usable.
+    """
+    with metrics.timed('cache_read'):
+        cached = SCRAPE_CACHE.get(key)
+    if not cached:
+        count_cache("miss")
+        return None
+    age = time.time() - cached['ts']
+    ttl = entry_ttl(cached['data'])
+    # (Modo Test: Comentar la línea 'if' para forzar el caché)
+    if age < ttl:
+        count_cache("hit")
+        print("✅ Devolviendo resultado desde caché.")
+        return cached['data']
+    if age < ttl + CACHE_STALE_DURATION:
+        count_cache("stale")
+        print("♻️ Devolviendo resultado stale desde caché (refresco en segundo plano).")
+        schedule_refresh(refresh_url(key, cached['data']), key, cached['ts'])
+        return dict(cached['data'], stale=True)
+    count_cache("miss")
+    return None
+
+
+def prewarm_loop():
+    """Refresca las claves más leídas que están a punto de expirar."""
+    while True:
+        time.sleep(CACHE_PREWARM_INTERVAL)
         try:
-            with open(CACHE_FILE, 'w') as f:
-                json.dump(SCRAPE_CACHE, f, indent=2)
-            print(f"✅ Caché persistente guardada en {CACHE_FILE}")
+            now = time.time()
+            expiring = SCRAPE_CACHE.hottest(
+                written_before=now - CACHE_DURATION + CACHE_PREWARM_MARGIN,
+                written_after=now - CACHE_DURATION,
+                limit=CACHE_PREWARM_BATCH
+            )
+            for key, ts, hits in expiring:
+                cached = SCRAPE_CACHE.get(key, touch=False)
+                if cached:
+                    schedule_refresh(refresh_url(key, cached['data']), key, ts, reason="prewarm")
         except Exception as e:
-            print(f"⚠️ Error al guardar caché en disco: {e}")
-            
-        return jsonify(result)
+            print(f"⚠️ Prewarm falló: {e}")
+
+
+_singleton_locks = {}
+_singleton_attempts = {}
+# Cada cuánto reintenta el flock un proceso que no lo consiguió (por si el dueño murió)
+SINGLETON_RETRY_INTERVAL = 60
+
+
+def start_singleton(name: str, target) -> bool:
+    """Arranca `target` en un hilo en un solo proceso (el que consiga el flock de `name`)."""
+    if name in _singleton_locks:
+        return False
+    # Se llama en cada petición: sin flock, no reintentar hasta pasado el intervalo
+    now = time.monotonic()
+    if now - _singleton_attempts.get(name, float("-inf")) < SINGLETON_RETRY_INTERVAL:
+        return False
+    _singleton_attempts[name] = now
+    lock_file = open(f"{CACHE_DB}.{name}.lock", "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _singleton_locks[name] = lock_file
+    threading.Thread(target=target, name=f"cache-{name}", daemon=True).start()
+    return True
+
+
+def start_prewarmer():
+    """Arranca el pre-calentador en un solo proceso."""
+    if CACHE_PREWARM and start_singleton("prewarm", prewarm_loop):
+        print("🔥 Pre-calentado de caché activo")
+
+
+def refresh_initial_images() -> int:
+    """Rehace el pool de /api/initial_images y lo pre-carga en la caché del proxy."""
+    with rate_limit.priority(BACKGROUND):
+        found = get_pexels_images_batch(INITIAL_IMAGE_QUERIES, count=INITIAL_IMAGES_PER_QUERY)
+    urls = list(dict.fromkeys(url for q in INITIAL_IMAGE_QUERIES for url in found.get(q, [])))
+    if urls:
+        POOL_CACHE.set(INITIAL_IMAGES_KEY, urls)
+        batch = image_prefetcher()
+        if batch is not None:
+            batch.add_all(urls)
+    return len(urls)
+
+
+def initial_images_loop():
+    while True:
+        try:
+            ts = POOL_CACHE.peek(INITIAL_IMAGES_KEY)
+            if ts is None or time.time() - ts >= INITIAL_IMAGES_REFRESH:
+                print(f"🖼️ Pool de imágenes iniciales: {refresh_initial_images()} URLs")
+        except RateLimited as e:
+            print(f"⏳ Pool de imágenes iniciales aplazado: {e}")
+        except Exception as e:
+            print(f"⚠️ Pool de imágenes iniciales falló: {e}")
+        time.sleep(min(INITIAL_IMAGES_REFRESH, 600))
+
+
+def start_initial_images():
+    """Mantiene el pool de imágenes iniciales (un solo proceso)."""
+    if PEXELS_API_KEY and INITIAL_IMAGE_QUERIES:
+        start_singleton("initial_images", initial_images_loop)
+
+
+def degraded_result(data: dict) -> bool:
+    """Resultado de fallback o sin IA: no debe sustituir a uno bueno."""
+    return bool(data.get('fallback') or data.get('ai_error'))
+
+
+def servable_entry(key: str, now: float):
+    """Entrada que lookup_scrape_cache aún serviría (fresca o stale), o None."""
+    cached = SCRAPE_CACHE.get(key, touch=False)
+    if cached and now - cached['ts'] < entry_ttl(cached['data']) + CACHE_STALE_DURATION:
+        return cached
+    return None
+
+
+def refresh_url(key: str, data: dict) -> str:
+    """URL con la que refrescar una entrada (las anteriores a guardarla usan la clave)."""
+    return data.get('url') or key
+
+
+def store_scrape_result(key: str, result: dict, now: float):
+    # Un refresco que acabó en fallback (o sin IA) no pisa la entrada buena que se sigue sirviendo
+    if degraded_result(result):
+        cached = servable_entry(key, now)
+        if cached and not degraded_result(cached['data']):
+            print("⚠️ Resultado degradado: se conserva la entrada guardada.")
+            return
+    # Guardar en caché persistente (solo esta clave)
+    try:
+        with metrics.timed('cache_write'):
+            SCRAPE_CACHE.set(key, result, ts=now)
+        print(f"✅ Caché persistente guardada en {CACHE_DB}")
+    except Exception as e:
+        print(f"⚠️ Error al guardar caché en disco: {e}")
+
+
+_legacy_imported = False
+_legacy_lock = threading.Lock()
+
+
+def import_legacy_cache():
+    """
+    Vuelca scrape_cache.json en la caché SQLite y migra las claves a
+    canonical_url (una vez por proceso; cada paso, una vez por base).
+    """
+    global _legacy_imported
+    with _legacy_lock:
+        if _legacy_imported:
+            return
+        _legacy_imported = True
+    try:
+        imported = SCRAPE_CACHE.import_json(CACHE_FILE, key_fn=canonical_url)
+        if imported:
+            print(f"✅ Importadas {imported} entradas desde {CACHE_FILE}")
+        # Entradas guardadas con URLs sin canonicalizar (o con una versión anterior)
+        moved = SCRAPE_CACHE.rekey(canonical_url, f"canonical_url:{CANONICAL_KEYS_VERSION}")
+        if moved:
+            print(f"✅ {moved} claves de caché migradas a URL canónica")
+        print(f"✅ Caché persistente lista en {CACHE_DB}")
+    except Exception as e:
+        print(f"⚠️ Error al importar caché desde {CACHE_FILE}: {e}")
+
+
+def preload():
+    """
+    Trabajo de arranque para el master de gunicorn (preload_app): importa la
+    caché JSON y los módulos pesados de PRELOAD_MODULES para que los workers
+    los hereden ya cargados (páginas compartidas por copy-on-write), y cierra
+    las conexiones SQLite abiertas aquí, que no deben cruzar el fork. Ni
+    hilos ni pools ni clientes HTTP: eso lo arranca cada worker.
+    """
+    import importlib
+
+    import_legacy_cache()
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except Exception as e:
+            print(f"⚠️ Preload: no se pudo importar {name}: {e}")
+    for store in (SCRAPE_CACHE, VALIDATORS_CACHE, PEXELS_CACHE, SEARCH_CACHE, POOL_CACHE, AI_CACHE,
+                  RATE_LIMITER, DOMAIN_HEALTH, SCRAPE_FLIGHTS, JOBS, BATCHES, METRICS, IMAGE_CACHE):
+        store.close()
+    print(f"✅ Preload listo ({', '.join(PRELOAD_MODULES) or 'sin módulos'})")
+
+
+# --------------------------------------------------------------------
+# Rutas
+# --------------------------------------------------------------------
+@app.before_request
+def start_background_tasks():
+    # Los hilos se arrancan tras el fork de gunicorn, no al importar
+    import_legacy_cache()
+    start_prewarmer()
+    start_initial_images()
+    METRICS.ensure_started()
+    # Consumidores de la cola: retoman lo que quedó encolado (o colgado) antes del reinicio
+    JOBS.ensure_started()
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_start = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+    metrics.start_request()
+
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    REQUEST_SECONDS.observe(elapsed, endpoint=request.endpoint or 'unknown',
+                            method=request.method, status=response.status_code)
+    # En streaming solo aparece lo medido antes de enviar los headers
+    response.headers['Server-Timing'] = metrics.server_timing(metrics.request_timings(), total=elapsed)
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(exc=None):
+    if g.pop('request_start', None) is not None:
+        REQUESTS_IN_FLIGHT.dec()
+    metrics.end_request()
+
+
+@app.route('/')
+def home():
+    return app.send_static_file('index.html')
+
+
+def rate_limited_response(e: RateLimited):
+    """503 + Retry-After: el cliente sabe que es cuota agotada y cuándo reintentar."""
+    retry_after = max(1, int(e.retry_after + 0.5))
+    response = jsonify({'error': f'{e.upstream} rate limit reached', 'retry_after': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 503
+
+
+@app.route('/api/search_image', methods=['POST'])
+def search_image():
+    payload = request.get_json(silent=True) or {}
+    query = payload.get('query', '').strip()
+    count = payload.get('count', 1) 
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+
+    try:
+        images = get_pexels_images(query, count=count)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    return jsonify({'imageUrls': images}), 200
+
+
+@app.route('/api/initial_images', methods=['GET'])
+def initial_images():
+    """
+    Fondos de las tarjetas A-D al cargar la página, elegidos al azar del pool
+    precalculado (initial_images_loop); nunca se consulta Pexels aquí.
+    Returns: { "A": url, "B": url, "C": url, "D": url } (vacío si el pool aún no existe)
+    """
+    pool = POOL_CACHE.get(INITIAL_IMAGES_KEY)
+    urls = (pool or {}).get('data') or []
+    CACHE_EVENTS.inc(cache="initial_images", event="hit" if urls else "miss")
+    picks = random.sample(urls, min(len(urls), len(CARD_IDS)))
+    return jsonify(dict(zip(CARD_IDS, picks))), 200
+
+
+@app.route('/api/search_alternatives', methods=['POST'])
+def search_alternatives():
+    """
+    Artículos similares cuando el scrape de una URL falla.
+    Expects: { "url": "..." }
+    Returns: { "query": "...", "results": [ { "title", "url", "snippet" }, ... ] }
+    Las primeras ALTERNATIVES_PREFETCH se scrapean ya en segundo plano.
+    """
+    payload = request.get_json(silent=True) or {}
+    url = payload.get('url', '').strip()
+    if not url:
+        return jsonify({'error': 'Missing url'}), 400
+
+    query, results = find_alternatives(url)
+    if ALTERNATIVES_PREFETCH:
+        schedule_speculative_scrapes([r['url'] for r in results[:ALTERNATIVES_PREFETCH]])
+    return jsonify({'query': query, 'results': results}), 200
+
+
+@app.route('/api/search_images', methods=['POST'])
+def search_images_batch():
+    """
+    Búsqueda de imágenes para varias consultas a la vez.
+    Expects: { "queries": ["...", ...], "count": 1, "orientation": "portrait" }
+    Returns: { "results": [ { "query": "...", "imageUrls": [...] }, ... ] }
+    """
+    payload = request.get_json(silent=True) or {}
+    queries = payload.get('queries') or []
+    count = payload.get('count', 1)
+    orientation = payload.get('orientation', 'portrait')
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': 'Missing queries'}), 400
+    if len(queries) > PEXELS_BATCH_MAX_QUERIES:
+        return jsonify({'error': f'Too many queries (max {PEXELS_BATCH_MAX_QUERIES})'}), 400
+    if orientation not in ('portrait', 'landscape', 'square'):
+        return jsonify({'error': 'Invalid orientation'}), 400
+
+    queries = [str(q).strip() for q in queries]
+    try:
+        found = get_pexels_images_batch(queries, count=count, orientation=orientation)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    return jsonify({'results': [{'query': q, 'imageUrls': found.get(q, [])} for q in queries]}), 200
+
+
+@app.route('/api/generate_carousel', methods=['POST'])
+def generate_carousel():
+    """
+    Generate carousel slides from article content.
+    Expects: { "title": "...", "text": "...", "source": "..." }
+    Returns: { "slides": [...], "caption": "...", "error": null }
+    """
+    payload = request.get_json(silent=True) or {}
+    title = payload.get('title', '').strip()
+    text = payload.get('text', '').strip()
+    source = payload.get('source', '').strip()
+    
+    if not title or not text:
+        return jsonify({'error': 'Missing title or text'}), 400
+    
+    # Generate carousel data via AI
+    carousel_data, carousel_err = get_carousel_data(title, text, source)
+    
+    if carousel_err or not carousel_data:
+        return jsonify({'error': carousel_err or 'Failed to generate carousel'}), 500
+    
+    # Get slides from carousel data
+    slides = carousel_data.get('slides', [])
+    caption = carousel_data.get('caption', '')
+    
+    # Fetch images for each slide using Pexels (en paralelo), pre-cargándolas en el proxy
+    prefetch = image_prefetcher()
+    attach_slide_images(slides, on_image=lambda i, image: prefetch and prefetch.add(image))
+    
+    return jsonify({
+        'slides': slides,
+        'caption': caption,
+        'error': None
+    }), 200
+
+
+def run_scrape(url: str, job=None):
+    """
+    Pipeline completo de /api/scrape (caché, scrape.do, IA, imágenes).
+    `job` (opcional) permite reportar la etapa y cancelar entre etapas.
+    Devuelve (result, error).
+    """
+    # Caché (clave canónica: sin tracking, www./m./amp., fragmento...)
+    key = canonical_url(url)
+    data = lookup_scrape_cache(key)
+    if data is not None:
+        # Las imágenes pueden haber salido de la caché del proxy
+        prefetch_result_images(data)
+        return data, None
+
+    # Peticiones simultáneas de la misma URL (en cualquier worker) esperan a una sola
+    return SCRAPE_FLIGHTS.do(key, lambda: compute_scrape(url, key, job))
+
 
+def compute_scrape(url: str, key: str, job=None, newer_than: float = None):
+    """
+    Ejecuta el pipeline sin caché y guarda el resultado bajo `key`.
+    Si ya hay una entrada escrita después de `newer_than` (por defecto, una
+    fresca) se devuelve esa. Devuelve (result, error).
+    """
+    with SCRAPE_EVENTS.publishing(key):
+        return _compute_scrape(url, key, job, newer_than)
+
+
+def _compute_scrape(url: str, key: str, job=None, newer_than: float = None):
+    now = time.time()
+    # Puede haberse completado mientras esperábamos el lease
+    cached = fresh_scrape_entry(key, now, newer_than)
+    if cached is not None:
+        return cached, None
+
+    # Entrada expirada: si el artículo no cambió se reutiliza sin scrape.do ni IA
+    base = revalidation_base(key)
+    validators = None
+    try:
+        if job:
+            job.progress('fetch')
+        article = None
+        if base:
+            outcome, article, validators = direct_revalidate(url, base)
+            if outcome == UNCHANGED:
+                return reuse_scrape_result(key, base, now, validators)
+        if article is None:
+            html_content = fetch_with_circuit(url)
+            if job:
+                job.progress('parse')
+            article = parse_article(url, html_content)
+        if base and article_hash(article) == base['validators']['text_hash']:
+            return reuse_scrape_result(key, base, now)
+    except (JobCancelled, RateLimited):
+        # Sin cuota de scrape.do no se cachea un fallback: el llamador responde 503 (o el trabajo falla)
+        raise
     except Exception as e:
-        # --- FLUJO DE FALLBACK (IA con Keywords) ---
         print(f'Scrape failed: {str(e)}')
-        
-        domain, year, keywords = infer_search_info(url)
-        fallback_query = f"{domain} {keywords} {year}".strip()
-        source = domain_of(url) or 'UNKNOWN'
-
-        ai_payload, ai_err = get_ai_data(source=source, keywords=fallback_query)
-
-        if not ai_payload:
-            return jsonify({'error': f'Scrape failed and AI fallback failed: {ai_err}'}), 500
-
-        fallback_title = " ".join(keywords.split()[:5])
-        fallback_subtitle = ai_payload.get('common_caption', 'Could not scrape article.')
-
-        result = {
-            "source": source.upper(),
-            "original": { "title": fallback_title, "subtitle": fallback_subtitle },
-            "images": {"a": ""}, 
-            "ai_content": {
-                "variants": ai_payload.get('variants', {}),
-                "common_caption": ai_payload.get('common_caption', fallback_subtitle),
-                "image_keywords": ai_payload.get('image_keywords', fallback_query.split())
-            },
-            "ai_error": ai_err 
+        if newer_than is not None and refresh_keeps_entry(key, now):
+            return None, f'Refresh failed: {e}'
+        return fallback_scrape(url, key, now, job)
+
+    if base:
+        count_cache("changed")
+    return generate_scrape(article, key, now, job, validators)
+
+
+def refresh_keeps_entry(key: str, now: float) -> bool:
+    """En un refresco fallido: True si la entrada actual sigue siendo mejor que un fallback."""
+    cached = servable_entry(key, now)
+    return cached is not None and not degraded_result(cached['data'])
+
+
+def fresh_scrape_entry(key: str, now: float, newer_than: float = None):
+    """Entrada fresca (o escrita después de `newer_than`) de la caché, o None."""
+    cached = SCRAPE_CACHE.get(key)
+    if cached:
+        fresh = now - cached['ts'] < entry_ttl(cached['data']) if newer_than is None else cached['ts'] > newer_than
+        if fresh:
+            return cached['data']
+    return None
+
+
+def fallback_scrape(url: str, key: str, now: float, job=None):
+    # --- FLUJO DE FALLBACK (IA con Keywords) ---
+    if job:
+        job.progress('fallback')
+    result, err = build_fallback_result(url)
+    if result:
+        store_scrape_result(key, result, now)
+    return result, err
+
+
+def generate_scrape(article: dict, key: str, now: float, job=None, validators: dict = None):
+    """
+    Etapas posteriores al parseo (IA, imágenes), ensamblado y guardado. Cada
+    etapa publica su evento en SCRAPE_EVENTS según termina.
+    """
+    if job:
+        job.progress('generate')
+    publish_scrape_event(key, "original", article_preview(article))
+    # Cada imagen se pre-carga en cuanto se conoce, mientras sigue la IA
+    prefetch = image_prefetcher()
+    if prefetch:
+        prefetch.add(article["top_image"])
+
+    def on_slide_image(index, image):
+        if prefetch:
+            prefetch.add(image)
+        publish_scrape_event(key, "slide_image", {"index": index, "image": image})
+
+    def on_done(name, value, error):
+        if error is None:
+            publish_stage_event(key, article, name, value)
+
+    results, errors = run_graph(
+        scrape_stages(article, on_slide_image=on_slide_image), current_stage_budget()[0], on_done=on_done
+    )
+    if job:
+        job.check()
+    result = assemble_scrape_result(article, *stage_outputs(results, errors))
+    store_scrape_result(key, result, now)
+    store_validators(key, article, validators)
+    return result, None
+
+
+def publish_scrape_event(key: str, name: str, data):
+    # Se serializa al publicar: los slides los sigue modificando el pool de imágenes
+    SCRAPE_EVENTS.publish(key, ndjson_event(name, data))
+
+
+def article_preview(article: dict) -> dict:
+    """Evento 'original': lo que ya se puede pintar tras el parseo."""
+    return {
+        "source": article["source"].upper(),
+        "original": article["original"],
+        "full_text": article["text"],
+        "images": {"a": article["top_image"]} if article["top_image"] else {},
+    }
+
+
+def publish_stage_event(key: str, article: dict, name: str, value):
+    """Eventos 'variants' y 'carousel' al terminar cada etapa IA."""
+    if name == "variants":
+        ai_payload, ai_err = value
+        variants, caption, _ = build_ai_content(article, ai_payload)
+        publish_scrape_event(key, "variants", {
+            "variants": variants,
+            "common_caption": caption,
+            "image_keywords": (ai_payload or {}).get('image_keywords', []),
+            "ai_error": ai_err,
+        })
+    elif name == "carousel":
+        carousel_payload, carousel_err = value
+        if carousel_payload and not carousel_err:
+            publish_scrape_event(key, "carousel", carousel_payload)
+
+
+# --------------------------------------------------------------------
+# Revalidación (entradas expiradas)
+# --------------------------------------------------------------------
+def text_hash(title: str, text: str) -> str:
+    normalize = lambda value: re.sub(r'\s+', ' ', value or '').strip().lower()
+    return hashlib.sha256(f"{normalize(title)}\x1f{normalize(text)}".encode()).hexdigest()
+
+
+def article_hash(article: dict) -> str:
+    return text_hash(article["original"]["title"], article["text"])
+
+
+def store_validators(key: str, article: dict, validators: dict = None):
+    """Guarda junto a la entrada el hash del texto y, si los hay, ETag / Last-Modified del sitio."""
+    try:
+        VALIDATORS_CACHE.set(key, dict(validators or {}, text_hash=article_hash(article)))
+    except Exception as e:
+        print(f"⚠️ Error al guardar validadores: {e}")
+
+
+def revalidation_base(key: str):
+    """
+    Entrada guardada que se puede reutilizar si el artículo no cambió:
+    {'data': resultado, 'validators': {text_hash, etag, last_modified}} o None.
+    """
+    if not REVALIDATE:
+        return None
+    cached = SCRAPE_CACHE.get(key)
+    if not cached or cached['data'].get('fallback') or not cached['data'].get('full_text'):
+        return None
+    data = cached['data']
+    stored = VALIDATORS_CACHE.get(key)
+    validators = dict(stored['data']) if stored else {}
+    # Entradas anteriores a los validadores: el hash sale del propio resultado
+    validators.setdefault('text_hash', text_hash(data['original'].get('title'), data['full_text']))
+    return {'data': data, 'validators': validators}
+
+
+def origin_blocked(domain: str) -> bool:
+    ts = VALIDATORS_CACHE.peek(f"blocked:{domain}")
+    return ts is not None and time.time() - ts < ORIGIN_BLOCK_DURATION
+
+
+def block_origin(domain: str, reason: str):
+    print(f"🚧 GET directo no disponible para {domain} ({reason}); se usará scrape.do")
+    VALIDATORS_CACHE.set(f"blocked:{domain}", {'reason': reason})
+
+
+def direct_revalidate(url: str, base: dict):
+    """
+    GET directo al sitio, sin scrape.do (condicional si hay ETag / Last-Modified).
+    Devuelve (UNCHANGED, None, validators), (CHANGED, article, validators) o
+    (None, None, None) si el sitio no lo permite o la página no se parece a la
+    guardada (muro de cookies, captcha...).
+    """
+    domain = domain_of(url)
+    if origin_blocked(domain):
+        return None, None, None
+    old = base['validators']
+    headers = dict(BROWSER_HEADERS)
+    if old.get('etag'):
+        headers['If-None-Match'] = old['etag']
+    if old.get('last_modified'):
+        headers['If-Modified-Since'] = old['last_modified']
+    try:
+        with metrics.timed('revalidate'):
+            r = http_client.get('origin', url, headers=headers)
+        validators = {
+            'etag': r.headers.get('ETag') or old.get('etag'),
+            'last_modified': r.headers.get('Last-Modified') or old.get('last_modified'),
         }
-        return jsonify(result)
+        if r.status_code == 304:
+            return UNCHANGED, None, dict(validators, text_hash=old['text_hash'])
+        if r.status_code != 200 or 'html' not in r.headers.get('Content-Type', ''):
+            block_origin(domain, f"status {r.status_code}")
+            return None, None, None
+        article = parse_article(url, r.text)
+    except Exception as e:
+        block_origin(domain, str(e))
+        return None, None, None
+
+    if len(article['text']) < len(base['data']['full_text']) * ORIGIN_MIN_TEXT_RATIO:
+        block_origin(domain, "incomplete page")
+        return None, None, None
+    validators['text_hash'] = article_hash(article)
+    if validators['text_hash'] == old['text_hash']:
+        return UNCHANGED, None, validators
+    return CHANGED, article, validators
+
+
+def reuse_scrape_result(key: str, base: dict, now: float, validators: dict = None):
+    """El artículo no cambió: la entrada guardada vuelve a ser fresca tal cual."""
+    store_scrape_result(key, base['data'], now)
+    try:
+        VALIDATORS_CACHE.set(key, validators or base['validators'])
+    except Exception as e:
+        print(f"⚠️ Error al guardar validadores: {e}")
+    count_cache("revalidated")
+    print("♻️ Artículo sin cambios: se reutiliza el resultado guardado (sin scrape.do ni IA).")
+    return base['data'], None
+
+
+def scrape_job(job):
+    with rate_limit.priority(job.payload.get('priority', INTERACTIVE)):
+        result, err = run_scrape(job.payload['url'], job)
+    if err:
+        raise RuntimeError(err)
+    return result
+
+
+def refresh_job(job):
+    """Regenera una entrada stale/por expirar; la respuesta ya se sirvió desde caché."""
+    key = job.payload['key']
+    with rate_limit.priority(BACKGROUND):
+        result, err = SCRAPE_FLIGHTS.do(
+            key, lambda: compute_scrape(job.payload['url'], key, job, newer_than=job.payload['seen_ts'])
+        )
+    if err:
+        raise RuntimeError(err)
+    return {'key': key}
+
+
+JOBS.register('scrape', scrape_job)
+JOBS.register('scrape_refresh', refresh_job)
+
+
+def enqueue_scrape(url: str, payload: dict) -> dict:
+    """Encola un scrape y devuelve el cuerpo de la respuesta 202."""
+    # "priority": "background" para lotes que no deben competir con la UI
+    priority = BACKGROUND if payload.get('priority') == BACKGROUND else INTERACTIVE
+    job_id = JOBS.submit('scrape', {'url': url, 'priority': priority})
+    return {
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/api/jobs/{job_id}',
+        'result_url': f'/api/jobs/{job_id}/result',
+    }
+
+
+@app.route('/api/scrape', methods=['POST'])
+def scrape():
+    """
+    Síncrono por defecto. Con {"async": true} (o SCRAPE_ASYNC=1) encola un
+    trabajo y responde 202 con el id; {"async": false} fuerza el modo síncrono.
+    """
+    payload = request.get_json(silent=True) or {}
+    url = payload.get('url', '').strip()
+    if not url:
+        return jsonify({'error': 'Missing url'}), 400
+
+    if payload.get('async', SCRAPE_ASYNC):
+        return jsonify(enqueue_scrape(url, payload)), 202
+
+    try:
+        result, err = run_scrape(url)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    if err:
+        return jsonify({'error': err}), 500
+    return jsonify(result)
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    job.pop('result')
+    return jsonify(job), 200
+
+
+@app.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = JOBS.get(job_id)
+    if not job:
+        return jsonify({'error': 'Unknown job'}), 404
+    if job['status'] == 'done':
+        return jsonify(job['result']), 200
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error']}), 500
+    if job['status'] == 'cancelled':
+        return jsonify({'error': 'Job cancelled'}), 409
+    return jsonify({'status': job['status'], 'stage': job['stage']}), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def job_cancel(job_id):
+    if JOBS.status(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if not JOBS.cancel(job_id):
+        return jsonify({'error': 'Job already finished'}), 409
+    return jsonify({'id': job_id, 'status': 'cancelled'}), 200
+
+
+def ndjson_event(name: str, data) -> str:
+    return json.dumps({"event": name, "data": data}) + "\n"
+
+
+@app.route('/api/scrape/stream', methods=['POST'])
+def scrape_stream():
+    """
+    Variante en streaming de /api/scrape (NDJSON, un evento por línea):
+      original    -> título, subtítulo, imagen principal (tras el parseo)
+      variants    -> variantes A–D y caption (al volver get_ai_data)
+      carousel    -> slides sin imagen (al volver get_carousel_data)
+      slide_image -> {index, image} por cada imagen resuelta
+      done        -> resultado completo (el mismo que /api/scrape)
+      error       -> {error}
+    El scrape es el mismo de /api/scrape (coalescido con SCRAPE_FLIGHTS) y
+    corre en su propio hilo: si el cliente se desconecta termina y se guarda
+    igual. Quien llega mientras otro scrapea la misma URL en este proceso
+    recibe también los eventos ya publicados.
+    """
+    payload = request.get_json(silent=True) or {}
+    url = payload.get('url', '').strip()
+    if not url:
+        return jsonify({'error': 'Missing url'}), 400
+
+    key = canonical_url(url)
+
+    def generate():
+        cached = lookup_scrape_cache(key)
+        if cached is not None:
+            prefetch_result_images(cached)
+            yield ndjson_event("done", cached)
+            return
+
+        events = SCRAPE_EVENTS.subscribe(key)
+        outcome = {}
+
+        def run():
+            try:
+                outcome["value"] = SCRAPE_FLIGHTS.do(key, lambda: compute_scrape(url, key))
+            except Exception as e:
+                outcome["error"] = e
+            finally:
+                events.put(None)
+
+        threading.Thread(target=run, name="scrape-stream", daemon=True).start()
+        try:
+            while True:
+                line = events.get()
+                if line is None:
+                    break
+                yield line
+        finally:
+            SCRAPE_EVENTS.unsubscribe(key, events)
+
+        error = outcome.get("error")
+        if isinstance(error, RateLimited):
+            yield ndjson_event("error", {"error": f"{error.upstream} rate limit reached",
+                                         "retry_after": max(1, int(error.retry_after + 0.5))})
+            return
+        if error is not None:
+            yield ndjson_event("error", {"error": str(error)})
+            return
+        result, err = outcome["value"]
+        if err:
+            yield ndjson_event("error", {"error": err})
+        else:
+            yield ndjson_event("done", result)
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+
+
+# --------------------------------------------------------------------
+# Lotes (/api/bulk_scrape)
+# --------------------------------------------------------------------
+def fetch_feed(url: str):
+    r = http_client.get('feeds', url, headers=BROWSER_HEADERS)
+    r.raise_for_status()
+    return parse_feed(r.content)
+
+
+def expand_feed(url: str) -> list:
+    """URLs de artículos de un feed RSS/Atom o sitemap (y de los hijos de un sitemap índice)."""
+    entries = fetch_feed(url)
+    urls = list(entries.urls)
+    for sitemap in entries.sitemaps[:BULK_MAX_SITEMAPS]:
+        if len(urls) >= BULK_MAX_URLS:
+            break
+        try:
+            urls.extend(fetch_feed(sitemap).urls)
+        except Exception as e:
+            print(f"⚠️ Sitemap ignorado ({sitemap}): {e}")
+    print(f"📰 Feed {url}: {len(urls)} URLs ({entries.kind})")
+    return urls[:BULK_MAX_URLS]
+
+
+def bulk_scrape_item(url: str) -> dict:
+    """Un elemento del lote: sin devolver entradas stale (se regeneran)."""
+    key = canonical_url(url)
+    result, err = SCRAPE_FLIGHTS.do(key, lambda: compute_scrape(url, key))
+    if err:
+        raise RuntimeError(err)
+    return result
+
+
+def bulk_options(payload: dict) -> dict:
+    """Lanza ValueError/TypeError si algún valor no es numérico."""
+    return {
+        'concurrency': min(max(int(payload.get('concurrency', BULK_CONCURRENCY)), 1), BULK_MAX_CONCURRENCY),
+        'per_domain': max(int(payload.get('per_domain', BULK_PER_DOMAIN)), 1),
+        'domain_delay': max(float(payload.get('domain_delay', BULK_DOMAIN_DELAY)), 0.0),
+    }
+
+
+def bulk_job(job):
+    """Ejecuta lo pendiente de un lote; el progreso se va guardando en BATCHES."""
+    batch_id = job.payload['batch_id']
+
+    def on_finish(key, url, result, error):
+        # Corre en el hilo del elemento: queda registrado aunque se cancele el trabajo
+        BATCHES.mark(batch_id, key, batches.FAILED if error else batches.DONE, error)
+
+    now = time.time()
+    todo = []
+    for key, url in BATCHES.pending(batch_id):
+        if fresh_scrape_entry(key, now) is not None:
+            BATCHES.mark(batch_id, key, batches.CACHED)
+        else:
+            todo.append((key, url, domain_of(url)))
+
+    print(f"📦 Lote {batch_id}: {len(todo)} URLs por scrapear")
+    finished = 0
+    for _ in batches.run_batch(BULK_EXECUTOR, todo, bulk_scrape_item, on_finish=on_finish,
+                               **job.payload['options']):
+        finished += 1
+        # Latido del trabajo; si lo cancelaron, lo que no arrancó queda pendiente
+        job.progress(f"{finished}/{len(todo)}")
+    return {'batch_id': batch_id, 'counts': BATCHES.summary(batch_id)['counts']}
+
+
+JOBS.register('bulk_scrape', bulk_job)
+
+
+def start_bulk_job(batch_id: str, options: dict) -> str:
+    """Encola el trabajo del lote, salvo que ya haya uno en marcha para él."""
+    job_id = BATCHES.job_id(batch_id)
+    if job_id and JOBS.status(job_id) in ('queued', 'running'):
+        return job_id
+    job_id = JOBS.submit('bulk_scrape', {'batch_id': batch_id, 'options': options})
+    BATCHES.set_job(batch_id, job_id)
+    return job_id
+
+
+@app.route('/api/bulk_scrape', methods=['POST'])
+def bulk_scrape():
+    """
+    Encola un lote (trabajo de JOBS con prioridad de fondo) y responde 202 con
+    su id; el progreso se consulta en GET /api/bulk_scrape/<id>.
+    Expects: {"urls": [...]} o {"feed": "https://.../rss"} (RSS, Atom o sitemap),
+             o {"batch_id": "..."} para retomar un lote interrumpido (solo hace lo pendiente).
+             Opcionales: "concurrency", "per_domain", "domain_delay",
+             "stream" (false) e "include_results" (true, solo con stream).
+    Con {"stream": true} devuelve NDJSON leyendo el progreso guardado (el lote
+    sigue aunque el cliente se vaya):
+      batch -> {id, job_id, total, pending, duplicates}
+      item  -> {url, status: cached | done | failed, result | error}
+      done  -> resumen del lote (el mismo que GET /api/bulk_scrape/<id>)
+    Las URLs con una entrada fresca en caché no se vuelven a scrapear y las
+    repetidas (misma clave canónica) solo se procesan una vez.
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        options = bulk_options(payload)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid concurrency options'}), 400
+    include_results = payload.get('include_results', True)
+
+    batch_id = (payload.get('batch_id') or '').strip()
+    duplicates = []
+    if batch_id:
+        if not BATCHES.exists(batch_id):
+            return jsonify({'error': 'Unknown batch'}), 404
+    else:
+        feed = (payload.get('feed') or '').strip()
+        if feed:
+            try:
+                urls = expand_feed(feed)
+            except NotAFeed as e:
+                return jsonify({'error': f'Not a feed or sitemap: {e}'}), 400
+            except Exception as e:
+                return jsonify({'error': f'Could not fetch feed: {e}'}), 502
+        else:
+            urls = payload.get('urls')
+            if not isinstance(urls, list):
+                return jsonify({'error': 'Missing urls or feed'}), 400
+        urls = [u.strip() for u in urls if isinstance(u, str) and u.strip()][:BULK_MAX_URLS]
+        if not urls:
+            return jsonify({'error': 'No urls to scrape'}), 400
+        batch_id, duplicates = BATCHES.create(feed or 'urls', [(canonical_url(u), u) for u in urls])
+
+    job_id = start_bulk_job(batch_id, options)
+    if not payload.get('stream'):
+        return jsonify({
+            'batch_id': batch_id,
+            'job_id': job_id,
+            'duplicates': duplicates,
+            'status_url': f'/api/bulk_scrape/{batch_id}',
+        }), 202
+
+    def item(key, url, status, error):
+        data = {"url": url, "status": status}
+        if error:
+            data["error"] = error
+        elif include_results:
+            cached = SCRAPE_CACHE.get(key)
+            data["result"] = cached['data'] if cached else None
+        return ndjson_event("item", data)
+
+    def generate():
+        items = BATCHES.items(batch_id)
+        # Lo terminado antes de esta petición (al retomar) no se vuelve a emitir
+        seen = {key for key, _, status, _ in items if status != batches.PENDING}
+        yield ndjson_event("batch", {
+            "id": batch_id,
+            "job_id": job_id,
+            "total": len(items),
+            "pending": len(items) - len(seen),
+            "duplicates": duplicates,
+        })
+        while True:
+            # El estado del trabajo se lee antes que los elementos: lo último que marcó sale igual
+            active = JOBS.status(job_id) in ('queued', 'running')
+            for key, url, status, error in BATCHES.items(batch_id):
+                if status != batches.PENDING and key not in seen:
+                    seen.add(key)
+                    yield item(key, url, status, error)
+            if len(seen) == len(items) or not active:
+                break
+            time.sleep(BULK_STREAM_POLL)
+        yield ndjson_event("done", BATCHES.summary(batch_id))
+
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Batch-Id': batch_id}
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson', headers=headers)
+
+
+@app.route('/api/bulk_scrape/<batch_id>', methods=['GET'])
+def bulk_scrape_status(batch_id):
+    summary = BATCHES.summary(batch_id, with_items=True)
+    if summary is None:
+        return jsonify({'error': 'Unknown batch'}), 404
+    return jsonify(summary), 200
+
+
+@app.route('/api/stats/cache', methods=['GET'])
+def cache_stats():
+    # Contadores hit/miss/stale del proceso + tamaño de la caché compartida
+    with CACHE_STATS_LOCK:
+        stats = dict(CACHE_STATS)
+    stats['entries'] = len(SCRAPE_CACHE)
+    return jsonify(stats), 200
+
+
+@app.route('/api/stats/domains', methods=['GET'])
+def domain_stats():
+    # Salud de scrape.do por dominio (compartida entre workers)
+    return jsonify(DOMAIN_HEALTH.stats()), 200
+
+
+@app.route('/api/stats/http', methods=['GET'])
+def http_stats():
+    # Contadores del cliente HTTP saliente (por upstream, por proceso)
+    return jsonify(http_client.stats()), 200
+
+
+@app.route('/api/stats/rate_limits', methods=['GET'])
+def rate_limit_stats():
+    # Tokens disponibles por upstream (cubos compartidos entre workers)
+    return jsonify(RATE_LIMITER.state()), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Suma de todos los workers + estado compartido leído de SQLite
+    merged = METRICS.collect()
+    merged['sentient_jobs'] = metrics.family(
+        "Trabajos en la cola por estado", {(status,): n for status, n in JOBS.depth().items()}, ("status",)
+    )
+    merged['sentient_cache_entries'] = metrics.family(
+        "Entradas en la caché persistente",
+        {("scrape",): len(SCRAPE_CACHE), ("pexels",): len(PEXELS_CACHE), ("ai",): len(AI_CACHE)},
+        ("cache",)
+    )
+    merged['sentient_image_cache_bytes'] = metrics.family(
+        "Bytes ocupados por la caché de imágenes", {(): IMAGE_CACHE.total_bytes()}
+    )
+    return Response(metrics.render(merged), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def proxy_image_params(args):
+    """(url, w, h, format, fit) validados desde los query params; ValueError si no son válidos."""
+    img_url = (args.get('url') or '').strip()
+    if not img_url:
+        raise ValueError('Missing url')
+    if urlparse(img_url).scheme not in ('http', 'https'):
+        raise ValueError('Invalid url')
+    # Como request.args.get(type=int): un valor no numérico cuenta como ausente
+    width, height = (int(v) if (v or '').lstrip('-').isdigit() else None for v in (args.get('w'), args.get('h')))
+    fmt = (args.get('format') or '').lower() or None
+    fit = (args.get('fit') or '').lower() or None
+    if any(d is not None and not 0 < d <= MAX_DIMENSION for d in (width, height)):
+        raise ValueError(f"w/h must be between 1 and {MAX_DIMENSION}")
+    if fmt and fmt not in IMAGE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(IMAGE_FORMATS)}")
+    if fit and fit not in IMAGE_FITS:
+        raise ValueError(f"fit must be one of {', '.join(IMAGE_FITS)}")
+    return img_url, width, height, fmt, fit
 
 
 @app.route('/api/proxy_image', methods=['GET'])
 def proxy_image():
-    img_url = request.args.get('url', '').strip()
-    if not img_url:
-        return jsonify({'error': 'Missing url'}), 400
+    """
+    Proxy de imágenes con caché en disco.
+    Params: url (obligatorio), w / h (px, opcionales), format (webp|jpeg|png),
+    fit (contain|cover; cover con w y h cubre la caja como background-size: cover).
+    Soporta If-None-Match (304) y Range vía send_file(conditional=True).
+    """
     try:
-        r = requests.get(img_url, headers=BROWSER_HEADERS, timeout=15, stream=True)
-        r.raise_for_status()
-        content_type = r.headers.get('Content-Type', 'image/jpeg')
-        
-        # === INICIO DE LA MODIFICACIÓN ===
-        headers = {
-            'Content-Type': content_type,
-            'Cache-Control': 'public, max-age=300',
-            'Access-Control-Allow-Origin': '*'  # Permite el acceso de origen cruzado
-        }
-        # === FIN DE LA MODIFICACIÓN ===
-        
-        def generate():
-            for chunk in r.iter_content(chunk_size=64 * 1024):
-                if chunk:
-                    yield chunk
-        return Response(generate(), headers=headers)
+        img_url, width, height, fmt, fit = proxy_image_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    CACHE_EVENTS.inc(cache="image", event="hit" if IMAGE_CACHE.contains(img_url, width, height, fmt, fit) else "miss")
+    try:
+        with metrics.timed('proxy_fetch'):
+            cached = IMAGE_CACHE.fetch(img_url, width, height, fmt, fit)
     except Exception as e:
         return jsonify({'error': f'proxy failed: {str(e)}'}), 502
 
+    response = send_file(cached.path, mimetype=cached.content_type, conditional=True,
+                         etag=cached.digest, max_age=IMAGE_BROWSER_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={IMAGE_BROWSER_MAX_AGE}'
+    response.headers['Access-Control-Allow-Origin'] = '*'  # Permite el acceso de origen cruzado
+    return response
+
+
+# --------------------------------------------------------------------
+# Render en el servidor (/api/render/*)
+# --------------------------------------------------------------------
+def render_source(url: str):
+    """Fondo desde la caché del proxy, en la misma variante que pintan las tarjetas (o None)."""
+    if not url or urlparse(url).scheme not in ('http', 'https'):
+        return None
+    try:
+        return IMAGE_CACHE.fetch(url, **CARD_IMAGE_VARIANT)
+    except Exception as e:
+        print(f"⚠️ Render sin fondo ({url}): {e}")
+        return None
+
+
+def render_image(kind: str, data: dict, fmt: str):
+    """CachedImage del render de una tarjeta ('card') o slide ('slide'), cacheado por contenido."""
+    spec = render.card_spec(data) if kind == 'card' else render.slide_spec(data)
+    source = render_source(spec['bg'] if kind == 'card' else spec['image'])
+    key = render.content_key(kind, spec, fmt, source.digest if source else None, RENDERER.fonts)
+    hit = IMAGE_CACHE.lookup(key)
+    CACHE_EVENTS.inc(cache="render", event="hit" if hit else "miss")
+    if hit:
+        return hit
+    with metrics.timed('render'):
+        image, content_type = RENDERER.submit(kind, spec, source.path if source else None, fmt).result()
+    return IMAGE_CACHE.put(key, key, image, content_type)
+
+
+def render_format(payload: dict) -> str:
+    fmt = (payload.get('format') or 'png').lower()
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(IMAGE_FORMATS)}")
+    return fmt
+
+
+def cards_from_result(result: dict) -> dict:
+    """Tarjetas A–D de un resultado de scrape, montadas como en finalizeUi (data-handler.js)."""
+    original = result.get('original') or {}
+    ai_content = result.get('ai_content') or {}
+    variants = ai_content.get('variants') or {}
+    title = original.get('title') or 'latest news'
+    query = ' '.join(ai_content.get('image_keywords') or []) or title
+    try:
+        pexels = get_pexels_images(query, 4)
+    except RateLimited:
+        pexels = []
+    first = pexels[0] if pexels else ''
+    backgrounds = {
+        'A': (result.get('images') or {}).get('a') or first,
+        'B': pexels[1] if len(pexels) > 1 else first,
+        'C': pexels[2] if len(pexels) > 2 else first,
+        'D': pexels[3] if len(pexels) > 3 else first,
+    }
+    return {
+        v: dict(
+            CARD_PRESETS[v],
+            title=(variants.get(v) or {}).get('title') or original.get('title') or 'UNTITLED',
+            subtitle=(variants.get(v) or {}).get('subtitle') or original.get('subtitle') or '',
+            bg=backgrounds[v],
+        )
+        for v in CARD_IDS
+    }
+
+
+def send_render(kind: str):
+    payload = request.get_json(silent=True) or {}
+    data = payload.get(kind)
+    if not isinstance(data, dict):
+        return jsonify({'error': f'Missing {kind}'}), 400
+    try:
+        fmt = render_format(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        RENDERER.check()
+    except render.FontsMissing as e:
+        return jsonify({'error': str(e)}), 503
+    try:
+        image = render_image(kind, data, fmt)
+    except Exception as e:
+        return jsonify({'error': f'render failed: {str(e)}'}), 500
+    response = send_file(image.path, mimetype=image.content_type, conditional=True,
+                         etag=image.digest, max_age=IMAGE_BROWSER_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={IMAGE_BROWSER_MAX_AGE}'
+    return response
+
+
+@app.route('/api/render/card', methods=['POST'])
+def render_card():
+    """
+    Expects: {"card": {...}, "format": "png" | "jpeg" | "webp"}; la tarjeta
+    con los campos de state.data en app.js (title, subtitle, tag, bg, layout,
+    overlayColor/Opacity, *Color, blur, contrast, brightness, grayscale).
+    Devuelve la imagen 1080x1440.
+    """
+    return send_render('card')
+
+
+@app.route('/api/render/slide', methods=['POST'])
+def render_slide():
+    """Expects: {"slide": {"title", "sentence", "image"}, "format": ...}. Devuelve la imagen 1080x1440."""
+    return send_render('slide')
+
+
+@app.route('/api/render/carousel', methods=['POST'])
+def render_carousel():
+    """
+    ZIP con las tarjetas A–D, los slides y el caption de un carrusel.
+    Expects: {"url": "..."} (artículo ya scrapeado, se toma de la caché) o
+             {"cards": {"A": {...}, ...}, "slides": [...], "caption": "..."};
+             "format" opcional (png).
+    """
+    payload = request.get_json(silent=True) or {}
+    try:
+        fmt = render_format(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        RENDERER.check()
+    except render.FontsMissing as e:
+        return jsonify({'error': str(e)}), 503
+
+    url = (payload.get('url') or '').strip()
+    if url:
+        cached = SCRAPE_CACHE.get(canonical_url(url))
+        if not cached:
+            return jsonify({'error': 'Article not scraped yet'}), 404
+        result = cached['data']
+        cards = cards_from_result(result)
+        slides = (result.get('carousel') or {}).get('slides') or []
+        caption = (result.get('carousel') or {}).get('caption') or ''
+    else:
+        cards = payload.get('cards') or {}
+        slides = payload.get('slides') or []
+        caption = payload.get('caption') or ''
+        if not isinstance(cards, dict) or not isinstance(slides, list):
+            return jsonify({'error': 'cards must be an object and slides a list'}), 400
+
+    ext = 'jpg' if fmt == 'jpeg' else fmt
+    jobs = [(f"card_{v}.{ext}", 'card', cards[v]) for v in CARD_IDS if isinstance(cards.get(v), dict)]
+    jobs += [(f"slide_{i:02d}.{ext}", 'slide', s)
+             for i, s in enumerate(slides[:RENDER_MAX_SLIDES], 1) if isinstance(s, dict)]
+    if not jobs:
+        return jsonify({'error': 'Nothing to render'}), 400
+
+    # Cada render con su propia copia del contexto (Server-Timing)
+    futures = [RENDER_EXECUTOR.submit(metrics.with_context(render_image), kind, data, fmt)
+               for _, kind, data in jobs]
+    try:
+        images = [f.result() for f in futures]
+    except Exception as e:
+        return jsonify({'error': f'render failed: {str(e)}'}), 500
+
+    buf = io.BytesIO()
+    # PNG/JPEG ya van comprimidos: se guardan tal cual
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as archive:
+        for (name, _, _), image in zip(jobs, images):
+            archive.write(image.path, name)
+        if caption:
+            archive.writestr('caption.txt', caption)
+    buf.seek(0)
+    print(f"🗜️ Carrusel exportado: {len(images)} imágenes ({fmt})")
+    return send_file(buf, mimetype='application/zip', as_attachment=True, download_name='carousel.zip')
+
 
 # --------------------------------------------------------------------
 # Entry point
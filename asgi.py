@@ -0,0 +1,387 @@
+"""
+Modo de servicio asíncrono (ASGI).
+
+    uvicorn asgi:app --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 asgi:app
+
+Las rutas que pasan casi todo el tiempo esperando a upstreams (/api/scrape
+síncrono, /api/search_image(s), /api/search_alternatives y /api/proxy_image)
+corren en el event loop con httpx (http_client.arequest): una espera no
+ocupa un hilo, así que un worker aguanta cientos de scrapes en vuelo. El
+parseo del HTML (CPU) va a un pool de procesos, las etapas IA (llamadas
+OpenAI bloqueantes) a un pool de hilos propio con sus propios límites y el
+resto de lo bloqueante (SQLite, ensamblado) al pool por defecto. El resto de
+rutas las sirve la misma app Flask montada como WSGI; `gunicorn app:app`
+sigue funcionando igual que antes.
+
+Necesita starlette, httpx, uvicorn y a2wsgi.
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import app as core
+import http_client
+import metrics
+from extractors import extract
+from rate_limit import RateLimited
+
+# Hilos para lo bloqueante (executor por defecto del loop: asyncio.to_thread)
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "64"))
+# Hilos para las rutas servidas por Flask
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "16"))
+# Procesos para parsear HTML
+ASGI_PARSE_PROCESSES = int(os.getenv("ASGI_PARSE_PROCESSES", str(min(os.cpu_count() or 1, 4))))
+# Llamadas simultáneas a scrape.do por worker (el equivalente de STAGE_SLOTS['scrape_do'],
+# mucho más alto porque aquí una espera no cuesta un hilo; la cuota la pone el limitador)
+ASGI_SCRAPE_DO_CONCURRENCY = int(os.getenv("ASGI_SCRAPE_DO_CONCURRENCY", "200"))
+# Llamadas IA simultáneas por worker. Siguen siendo bloqueantes, así que en
+# vez de PIPELINE_EXECUTOR/STAGE_SLOTS de app.py (8 hilos, 6 llamadas, pensados
+# para gunicorn) las etapas corren en pools propios de este tamaño
+ASGI_AI_CONCURRENCY = int(os.getenv("ASGI_AI_CONCURRENCY", "128"))
+
+_parse_pool = None
+_scrape_do_slots = None
+_generate_pool = None   # generate_scrape/fallback_scrape (esperan a sus etapas)
+_stage_pool = None      # etapas de run_graph
+_stage_slots = None
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    global _parse_pool, _scrape_do_slots, _generate_pool, _stage_pool, _stage_slots
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix="asgi")
+    )
+    _parse_pool = ProcessPoolExecutor(max_workers=ASGI_PARSE_PROCESSES)
+    _scrape_do_slots = asyncio.Semaphore(ASGI_SCRAPE_DO_CONCURRENCY)
+    _generate_pool = ThreadPoolExecutor(max_workers=ASGI_AI_CONCURRENCY, thread_name_prefix="asgi-generate")
+    # Hasta tres etapas a la vez por scrape (IA variantes, IA carrusel, imágenes)
+    _stage_pool = ThreadPoolExecutor(max_workers=ASGI_AI_CONCURRENCY * 3, thread_name_prefix="asgi-stage")
+    _stage_slots = dict(core.STAGE_SLOTS, ai=threading.BoundedSemaphore(ASGI_AI_CONCURRENCY))
+    # Hilos de fondo (caché legada, pre-calentado, métricas) una vez por worker, no por petición
+    await asyncio.to_thread(core.start_background_tasks)
+    # El SDK de OpenAI se importa en segundo plano, no en la primera petición
+    asyncio.get_running_loop().run_in_executor(None, core.get_ai_backend)
+    print(f"✅ Modo ASGI: {ASGI_THREADS} hilos, {ASGI_PARSE_PROCESSES} procesos de parseo, "
+          f"{ASGI_AI_CONCURRENCY} llamadas IA")
+    try:
+        yield
+    finally:
+        await http_client.aclose_clients()
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+        _generate_pool.shutdown(wait=False, cancel_futures=True)
+        _stage_pool.shutdown(wait=False, cancel_futures=True)
+
+
+def endpoint(fn):
+    """Lo que en Flask hacen los hooks before/after/teardown_request de app.py."""
+    @wraps(fn)
+    async def handler(request):
+        start = time.perf_counter()
+        core.REQUESTS_IN_FLIGHT.inc()
+        metrics.start_request()
+        status = 500
+        try:
+            response = await fn(request)
+            status = response.status_code
+            elapsed = time.perf_counter() - start
+            response.headers['Server-Timing'] = metrics.server_timing(metrics.request_timings(), total=elapsed)
+            return response
+        finally:
+            core.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=fn.__name__,
+                                         method=request.method, status=status)
+            core.REQUESTS_IN_FLIGHT.dec()
+            metrics.end_request()
+    return handler
+
+
+async def json_payload(request) -> dict:
+    try:
+        payload = await request.json()
+    except ValueError:
+        return {}
+    return payload if isinstance(payload, dict) else {}
+
+
+def rate_limited_response(e: RateLimited) -> JSONResponse:
+    retry_after = max(1, int(e.retry_after + 0.5))
+    return JSONResponse({'error': f'{e.upstream} rate limit reached', 'retry_after': retry_after},
+                        status_code=503, headers={'Retry-After': str(retry_after)})
+
+
+# --------------------------------------------------------------------
+# Upstreams (versiones asíncronas de las de app.py)
+# --------------------------------------------------------------------
+async def get_pexels_images(query: str, count: int = 4, orientation: str = 'portrait'):
+    if not core.PEXELS_API_KEY:
+        return []
+    search_query = core.clean_pexels_query(query)
+    if not search_query:
+        return []
+
+    cache_key = core.pexels_cache_key(search_query, count, orientation)
+    cached = await asyncio.to_thread(core.cached_pexels_images, cache_key)
+    if cached is not None:
+        return cached
+
+    try:
+        with metrics.timed('pexels'):
+            r = await http_client.aget('pexels', core.pexels_search_url(search_query, count, orientation),
+                                       headers={'Authorization': core.PEXELS_API_KEY})
+        return await asyncio.to_thread(core.pexels_images_from_response, cache_key, r)
+    except RateLimited as e:
+        print(f"⏳ Pexels sin cuota ({search_query}): {e}")
+        raise
+    except Exception:
+        return []
+
+
+async def get_pexels_images_batch(queries: list, count: int = 1, orientation: str = 'portrait') -> dict:
+    by_clean = {}
+    for q in queries:
+        by_clean.setdefault(core.clean_pexels_query(q), []).append(q)
+
+    cleans = [clean for clean in by_clean if clean]
+    found = await asyncio.gather(
+        *(get_pexels_images(by_clean[clean][0], count, orientation) for clean in cleans),
+        return_exceptions=True
+    )
+    results, limited = {}, None
+    for clean, images in zip(cleans, found):
+        if isinstance(images, RateLimited):
+            limited, images = images, []
+        elif isinstance(images, BaseException):
+            raise images
+        for q in by_clean[clean]:
+            results[q] = images
+    if limited is not None:
+        raise limited
+    for q in by_clean.get('', []):
+        results[q] = []
+    return results
+
+
+async def perform_google_search(query: str, max_results: int = 5):
+    if not core.GOOGLE_SEARCH_API_KEY or not core.GOOGLE_SEARCH_CX:
+        return []
+    try:
+        r = await http_client.aget('google', core.GOOGLE_SEARCH_URL,
+                                   params=core.google_search_params(query, max_results))
+        return core.google_results_from_response(r)
+    except RateLimited as e:
+        print(f"⏳ Google sin cuota: {e}")
+        return []
+    except Exception:
+        return []
+
+
+async def fetch_article_html(url: str) -> str:
+    async with _scrape_do_slots:
+        with metrics.timed('scrape_do'):
+            response = await http_client.aget('scrape_do', core.scrape_do_request_url(url))
+    return core.scrape_do_html(response)
+
+
+async def fetch_with_circuit(url: str) -> str:
+    # Mismo criterio que core.fetch_with_circuit: solo los fallos del sitio de destino cuentan
+    if not core.SCRAPE_DO_KEY:
+        raise core.ScrapeDoUnavailable("Scrape.do API key (SCRAPE_DO_KEY) is not configured.")
+    domain = core.domain_of(url)
+    if not await asyncio.to_thread(core.DOMAIN_HEALTH.allow, domain):
+        raise core.CircuitOpen(f"Circuit open for {domain}, skipping scrape.do")
+    start = time.perf_counter()
+    try:
+        html_content = await fetch_article_html(url)
+    except core.TargetSiteError as e:
+        await asyncio.to_thread(core.DOMAIN_HEALTH.record_failure, domain, time.perf_counter() - start, str(e))
+        raise
+    await asyncio.to_thread(core.DOMAIN_HEALTH.record_success, domain, time.perf_counter() - start)
+    return html_content
+
+
+async def parse_article(url: str, html_content: str) -> dict:
+    # El timing se toma aquí: las métricas del proceso hijo no llegarían a /metrics
+    with metrics.timed('parse'):
+        extraction = await asyncio.get_running_loop().run_in_executor(
+            _parse_pool, extract, url, html_content, core.EXTRACTION_ENGINE
+        )
+    return core.article_from_extraction(url, extraction)
+
+
+# --------------------------------------------------------------------
+# Pipeline de scraping
+# --------------------------------------------------------------------
+async def run_scrape(url: str):
+    """run_scrape() de app.py con la descarga y el parseo fuera de hilos."""
+    key = core.canonical_url(url)
+    data = await asyncio.to_thread(core.lookup_scrape_cache, key)
+    if data is not None:
+        await asyncio.to_thread(core.prefetch_result_images, data)
+        return data, None
+    return await core.SCRAPE_FLIGHTS.do_async(key, lambda: compute_scrape(url, key))
+
+
+async def compute_scrape(url: str, key: str):
+    # Los eventos parciales llegan también a /api/scrape/stream (Flask montado en este proceso)
+    with core.SCRAPE_EVENTS.publishing(key), core.stage_budget(_stage_pool, _stage_slots):
+        return await _compute_scrape(url, key)
+
+
+async def run_generation(fn, *args):
+    """`fn` (generate_scrape, fallback_scrape) en _generate_pool con el contexto actual (stage_budget)."""
+    ctx = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_generate_pool, ctx.run, fn, *args)
+
+
+async def _compute_scrape(url: str, key: str):
+    now = time.time()
+    cached = await asyncio.to_thread(core.fresh_scrape_entry, key, now)
+    if cached is not None:
+        return cached, None
+    # Revalidación de la entrada expirada como en app.compute_scrape (el GET directo, en un hilo)
+    base = await asyncio.to_thread(core.revalidation_base, key)
+    validators = None
+    try:
+        article = None
+        if base:
+            outcome, article, validators = await asyncio.to_thread(core.direct_revalidate, url, base)
+            if outcome == core.UNCHANGED:
+                return await asyncio.to_thread(core.reuse_scrape_result, key, base, now, validators)
+        if article is None:
+            html_content = await fetch_with_circuit(url)
+            article = await parse_article(url, html_content)
+        if base and core.article_hash(article) == base['validators']['text_hash']:
+            return await asyncio.to_thread(core.reuse_scrape_result, key, base, now)
+    except RateLimited:
+        raise
+    except Exception as e:
+        print(f'Scrape failed: {str(e)}')
+        return await run_generation(core.fallback_scrape, url, key, now)
+    if base:
+        core.count_cache("changed")
+    # Las etapas IA siguen siendo síncronas: run_graph sobre _stage_pool (stage_budget)
+    return await run_generation(core.generate_scrape, article, key, now, None, validators)
+
+
+# --------------------------------------------------------------------
+# Rutas
+# --------------------------------------------------------------------
+@endpoint
+async def scrape(request):
+    payload = await json_payload(request)
+    url = (payload.get('url') or '').strip()
+    if not url:
+        return JSONResponse({'error': 'Missing url'}, status_code=400)
+    if payload.get('async', core.SCRAPE_ASYNC):
+        return JSONResponse(await asyncio.to_thread(core.enqueue_scrape, url, payload), status_code=202)
+
+    try:
+        result, err = await run_scrape(url)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    if err:
+        return JSONResponse({'error': err}, status_code=500)
+    return JSONResponse(result)
+
+
+@endpoint
+async def search_image(request):
+    payload = await json_payload(request)
+    query = (payload.get('query') or '').strip()
+    if not query:
+        return JSONResponse({'error': 'Missing query'}, status_code=400)
+    try:
+        images = await get_pexels_images(query, count=payload.get('count', 1))
+    except RateLimited as e:
+        return rate_limited_response(e)
+    return JSONResponse({'imageUrls': images})
+
+
+@endpoint
+async def search_images_batch(request):
+    payload = await json_payload(request)
+    queries = payload.get('queries') or []
+    count = payload.get('count', 1)
+    orientation = payload.get('orientation', 'portrait')
+    if not isinstance(queries, list) or not queries:
+        return JSONResponse({'error': 'Missing queries'}, status_code=400)
+    if len(queries) > core.PEXELS_BATCH_MAX_QUERIES:
+        return JSONResponse({'error': f'Too many queries (max {core.PEXELS_BATCH_MAX_QUERIES})'}, status_code=400)
+    if orientation not in ('portrait', 'landscape', 'square'):
+        return JSONResponse({'error': 'Invalid orientation'}, status_code=400)
+
+    queries = [str(q).strip() for q in queries]
+    try:
+        found = await get_pexels_images_batch(queries, count=count, orientation=orientation)
+    except RateLimited as e:
+        return rate_limited_response(e)
+    return JSONResponse({'results': [{'query': q, 'imageUrls': found.get(q, [])} for q in queries]})
+
+
+@endpoint
+async def search_alternatives(request):
+    payload = await json_payload(request)
+    url = (payload.get('url') or '').strip()
+    if not url:
+        return JSONResponse({'error': 'Missing url'}, status_code=400)
+
+    query, cache_key = core.alternatives_query(url)
+    results = []
+    if query:
+        results = await asyncio.to_thread(core.cached_alternatives, cache_key)
+        if results is None:
+            found = await perform_google_search(query, core.ALTERNATIVES_MAX_RESULTS)
+            results = await asyncio.to_thread(core.store_alternatives, cache_key, url, found)
+    if core.ALTERNATIVES_PREFETCH and results:
+        await asyncio.to_thread(core.schedule_speculative_scrapes,
+                                [r['url'] for r in results[:core.ALTERNATIVES_PREFETCH]])
+    return JSONResponse({'query': query, 'results': results})
+
+
+@endpoint
+async def proxy_image(request):
+    try:
+        img_url, width, height, fmt, fit = core.proxy_image_params(request.query_params)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+
+    hit = await asyncio.to_thread(core.IMAGE_CACHE.contains, img_url, width, height, fmt, fit)
+    core.CACHE_EVENTS.inc(cache="image", event="hit" if hit else "miss")
+    try:
+        with metrics.timed('proxy_fetch'):
+            cached = await core.IMAGE_CACHE.fetch_async(img_url, width, height, fmt, fit)
+    except Exception as e:
+        return JSONResponse({'error': f'proxy failed: {str(e)}'}, status_code=502)
+
+    headers = {
+        'ETag': f'"{cached.digest}"',
+        'Cache-Control': f'public, max-age={core.IMAGE_BROWSER_MAX_AGE}',
+        'Access-Control-Allow-Origin': '*',
+    }
+    if cached.digest in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(cached.path, media_type=cached.content_type, headers=headers)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/scrape', scrape, methods=['POST']),
+        Route('/api/search_image', search_image, methods=['POST']),
+        Route('/api/search_images', search_images_batch, methods=['POST']),
+        Route('/api/search_alternatives', search_alternatives, methods=['POST']),
+        Route('/api/proxy_image', proxy_image, methods=['GET']),
+        Mount('/', app=WSGIMiddleware(core.app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,228 @@
+"""
+Lotes de scrapes (/api/bulk_scrape) con progreso persistente.
+
+Cada lote guarda en SQLite sus URLs (deduplicadas por clave canónica), el
+estado de cada una y el trabajo de la cola que lo ejecuta, así que un lote
+interrumpido (worker reiniciado, trabajo cancelado) se retoma con su id y
+solo procesa lo que falta.
+
+run_batch() ejecuta las pendientes con concurrencia acotada y límites de
+cortesía por dominio (peticiones simultáneas y separación mínima entre
+arranques) y va devolviendo los resultados según terminan.
+"""
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, wait
+
+PENDING, DONE, FAILED, CACHED = "pending", "done", "failed", "cached"
+
+
+class BatchStore:
+
+    def __init__(self, path: str, keep_for: float = 60 * 60 * 24 * 7):
+        self.path = path
+        self.keep_for = keep_for
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Cierra la conexión del hilo actual."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                source TEXT NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                job_id TEXT
+            )
+        """)
+        # Bases creadas antes de que los lotes corrieran como trabajos
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(batches)")]
+        if "job_id" not in columns:
+            conn.execute("ALTER TABLE batches ADD COLUMN job_id TEXT")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS batch_items (
+                batch_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                url TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                error TEXT,
+                finished REAL,
+                PRIMARY KEY (batch_id, key)
+            )
+        """)
+
+    # ----------------------------------------------------------------
+    # API
+    # ----------------------------------------------------------------
+    def create(self, source: str, items: list):
+        """
+        `items` = [(key, url), ...]. Devuelve (batch_id, duplicados): las URLs
+        cuya clave ya estaba en el lote no se añaden.
+        """
+        batch_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        duplicates = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT INTO batches (id, source, created, updated) VALUES (?, ?, ?, ?)",
+                         (batch_id, source, now, now))
+            for position, (key, url) in enumerate(items):
+                added = conn.execute(
+                    """
+                    INSERT OR IGNORE INTO batch_items (batch_id, key, url, position, status)
+                    VALUES (?, ?, ?, ?, ?)
+                    """,
+                    (batch_id, key, url, position, PENDING)
+                ).rowcount
+                if not added:
+                    duplicates.append(url)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self._purge()
+        return batch_id, duplicates
+
+    def exists(self, batch_id: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM batches WHERE id = ?", (batch_id,)).fetchone() is not None
+
+    def pending(self, batch_id: str) -> list:
+        """[(key, url)] aún sin terminar, en el orden original."""
+        return self._conn().execute(
+            "SELECT key, url FROM batch_items WHERE batch_id = ? AND status = ? ORDER BY position",
+            (batch_id, PENDING)
+        ).fetchall()
+
+    def items(self, batch_id: str) -> list:
+        """[(key, url, status, error)] de todo el lote, en el orden original."""
+        return self._conn().execute(
+            "SELECT key, url, status, error FROM batch_items WHERE batch_id = ? ORDER BY position",
+            (batch_id,)
+        ).fetchall()
+
+    def set_job(self, batch_id: str, job_id: str):
+        self._conn().execute("UPDATE batches SET job_id = ?, updated = ? WHERE id = ?",
+                             (job_id, time.time(), batch_id))
+
+    def job_id(self, batch_id: str):
+        row = self._conn().execute("SELECT job_id FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        return row[0] if row else None
+
+    def mark(self, batch_id: str, key: str, status: str, error: str = None):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "UPDATE batch_items SET status = ?, error = ?, finished = ? WHERE batch_id = ? AND key = ?",
+            (status, error, now, batch_id, key)
+        )
+        conn.execute("UPDATE batches SET updated = ? WHERE id = ?", (now, batch_id))
+
+    def summary(self, batch_id: str, with_items: bool = False):
+        row = self._conn().execute(
+            "SELECT source, created, updated, job_id FROM batches WHERE id = ?", (batch_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        items = self.items(batch_id)
+        counts = Counter(status for _, _, status, _ in items)
+        out = {
+            "id": batch_id,
+            "source": row[0],
+            "created": row[1],
+            "updated": row[2],
+            "job_id": row[3],
+            "total": len(items),
+            "counts": dict(counts),
+            "complete": counts.get(PENDING, 0) == 0,
+        }
+        if with_items:
+            out["items"] = [{"url": url, "status": status, "error": error} for _, url, status, error in items]
+        return out
+
+    def _purge(self):
+        conn = self._conn()
+        old = [r[0] for r in conn.execute(
+            "SELECT id FROM batches WHERE updated < ?", (time.time() - self.keep_for,)
+        ).fetchall()]
+        for batch_id in old:
+            conn.execute("DELETE FROM batch_items WHERE batch_id = ?", (batch_id,))
+            conn.execute("DELETE FROM batches WHERE id = ?", (batch_id,))
+
+
+def run_batch(executor, items, fn, on_finish=None, concurrency: int = 4,
+              per_domain: int = 2, domain_delay: float = 1.0):
+    """
+    Ejecuta fn(url) para cada (key, url, domain) de `items` en `executor` y
+    va devolviendo (key, url, result, error) según terminan.
+
+    Como mucho `concurrency` a la vez, `per_domain` por dominio y al menos
+    `domain_delay` segundos entre dos arranques del mismo dominio.
+    `on_finish(key, url, result, error)` corre en el hilo del trabajo: el
+    progreso queda registrado aunque quien itera se haya ido (entonces lo
+    que no había arrancado queda pendiente).
+    """
+    def task(key, url):
+        try:
+            result, error = fn(url), None
+        except Exception as e:
+            result, error = None, str(e)
+        if on_finish:
+            on_finish(key, url, result, error)
+        return result, error
+
+    pending = deque(items)
+    inflight = {}
+    running = Counter()
+    last_start = {}
+    while pending or inflight:
+        now = time.monotonic()
+        next_ready = None
+        waiting = deque()
+        while pending and len(inflight) < concurrency:
+            key, url, domain = item = pending.popleft()
+            ready_at = last_start.get(domain, float("-inf")) + domain_delay
+            if running[domain] >= per_domain or ready_at > now:
+                waiting.append(item)
+                if running[domain] < per_domain:
+                    next_ready = ready_at if next_ready is None else min(next_ready, ready_at)
+                continue
+            running[domain] += 1
+            last_start[domain] = now
+            inflight[executor.submit(task, key, url)] = item
+        # Los que esperan a su dominio conservan su turno
+        pending.extendleft(reversed(waiting))
+
+        if not inflight:
+            time.sleep(max(next_ready - now, 0))
+            continue
+        timeout = None if next_ready is None else max(next_ready - now, 0)
+        done, _ = wait(inflight, timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            key, url, domain = inflight.pop(future)
+            running[domain] -= 1
+            result, error = future.result()
+            yield key, url, result, error
@@ -0,0 +1,10 @@
+"""Utilidades compartidas por los benchmarks."""
+
+
+def percentile(values, p):
+    """Percentil por rango más cercano (p en 0..100)."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    k = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[k]
@@ -0,0 +1,166 @@
+"""
+Benchmark de extractores: vía rápida (lxml) vs newspaper3k.
+
+Corre ambos extractores sobre un corpus de HTML guardado y compara
+velocidad (ms por documento) y calidad de salida, tomando newspaper como
+referencia: similitud de título, F1 de tokens del texto e imagen igual.
+
+    python -m bench.extract --corpus bench/corpus
+    python -m bench.extract --fetch URL [URL ...] --corpus bench/corpus
+
+Cada documento es un .html; la URL se toma de <link rel="canonical"> u
+og:url (o del nombre del archivo si no hay).
+
+bench/corpus trae unas pocas páginas sintéticas con los casos típicos
+(metadatos og:, solo twitter:, sin metadatos, galería con poco texto,
+artículo largo por secciones); --fetch añade páginas reales al mismo
+directorio.
+"""
+import argparse
+import glob
+import hashlib
+import os
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+from difflib import SequenceMatcher
+
+import lxml.html
+
+from bench.common import percentile
+from extractors import ENGINE_FAST, ENGINE_NEWSPAPER, EXTRACTORS, MIN_CONFIDENCE, summarize
+
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+}
+
+
+def load_corpus(directory: str):
+    docs = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.html"))):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            html = f.read()
+        url = ""
+        try:
+            doc = lxml.html.fromstring(html)
+            found = doc.xpath('//link[@rel="canonical"]/@href') or doc.xpath('//meta[@property="og:url"]/@content')
+            url = found[0] if found else ""
+        except Exception:
+            pass
+        docs.append((url or f"https://corpus.local/{os.path.basename(path)}", html, path))
+    return docs
+
+
+def fetch_corpus(urls, directory: str):
+    import http_client
+
+    os.makedirs(directory, exist_ok=True)
+    for url in urls:
+        try:
+            r = http_client.get('proxy', url, headers=BROWSER_HEADERS)
+            r.raise_for_status()
+        except Exception as e:
+            print(f"⚠️ {url}: {e}")
+            continue
+        name = hashlib.sha1(url.encode()).hexdigest()[:12] + ".html"
+        html = r.text
+        if 'rel="canonical"' not in html:
+            html = f'<link rel="canonical" href="{url}">\n' + html
+        with open(os.path.join(directory, name), "w", encoding="utf-8") as f:
+            f.write(html)
+        print(f"✅ {url} -> {name}")
+
+
+def tokens(text: str) -> Counter:
+    return Counter(re.findall(r"\w+", (text or "").lower()))
+
+
+def token_f1(candidate: str, reference: str) -> float:
+    c, r = tokens(candidate), tokens(reference)
+    if not c and not r:
+        return 1.0
+    overlap = sum((c & r).values())
+    if not overlap:
+        return 0.0
+    precision, recall = overlap / sum(c.values()), overlap / sum(r.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def run(docs, with_nlp: bool):
+    rows = []
+    for url, html, path in docs:
+        try:
+            fast, fast_ms = timed(EXTRACTORS[ENGINE_FAST].extract, url, html)
+        except Exception as e:
+            print(f"⚠️ fast falló en {path}: {e}")
+            continue
+        ref, ref_ms = timed(EXTRACTORS[ENGINE_NEWSPAPER].extract, url, html)
+        nlp_ms = timed(summarize, ref.title, ref.text)[1] if with_nlp else 0.0
+        rows.append({
+            "path": os.path.basename(path),
+            "fast_ms": fast_ms,
+            "newspaper_ms": ref_ms,
+            "nlp_ms": nlp_ms,
+            "confidence": fast.confidence,
+            "title_sim": SequenceMatcher(None, fast.title.lower(), ref.title.lower()).ratio(),
+            "text_f1": token_f1(fast.text, ref.text),
+            "image_match": fast.top_image == ref.top_image,
+        })
+    return rows
+
+
+def report(rows, with_nlp: bool):
+    if not rows:
+        print("Corpus vacío.")
+        return
+    print(f"{'doc':<24} {'fast ms':>8} {'np ms':>8} {'conf':>5} {'title':>6} {'textF1':>7} img")
+    for r in rows:
+        print(f"{r['path'][:24]:<24} {r['fast_ms']:8.1f} {r['newspaper_ms']:8.1f} {r['confidence']:5.2f} "
+              f"{r['title_sim']:6.2f} {r['text_f1']:7.2f} {'✓' if r['image_match'] else '✗'}")
+
+    fast = [r["fast_ms"] for r in rows]
+    ref = [r["newspaper_ms"] for r in rows]
+    print()
+    print(f"Documentos:            {len(rows)}")
+    print(f"fast      p50/p95 ms:  {statistics.median(fast):.1f} / {percentile(fast, 95):.1f}")
+    print(f"newspaper p50/p95 ms:  {statistics.median(ref):.1f} / {percentile(ref, 95):.1f}")
+    if with_nlp:
+        nlp = [r["nlp_ms"] for r in rows]
+        print(f"summary (nlp) p50 ms:  {statistics.median(nlp):.1f}")
+    print(f"Speedup (p50):         {statistics.median(ref) / max(statistics.median(fast), 1e-6):.1f}x")
+    print(f"Título similar (≥0.9): {sum(r['title_sim'] >= 0.9 for r in rows) / len(rows):.0%}")
+    print(f"Texto F1 medio:        {statistics.mean(r['text_f1'] for r in rows):.2f}")
+    print(f"Imagen igual:          {sum(r['image_match'] for r in rows) / len(rows):.0%}")
+    print(f"Usarían fallback:      {sum(r['confidence'] < MIN_CONFIDENCE for r in rows) / len(rows):.0%}"
+          f" (confianza < {MIN_CONFIDENCE})")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(__file__), "corpus"))
+    parser.add_argument("--fetch", nargs="+", metavar="URL", help="descargar estas URLs al corpus y salir")
+    parser.add_argument("--nlp", action="store_true", help="medir también el resumen NLTK que ahora es perezoso")
+    args = parser.parse_args(argv)
+
+    if args.fetch:
+        fetch_corpus(args.fetch, args.corpus)
+        return 0
+
+    docs = load_corpus(args.corpus)
+    if not docs:
+        print(f"No hay .html en {args.corpus} (usa --fetch URL ... para crear el corpus)")
+        return 1
+    report(run(docs, args.nlp), args.nlp)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
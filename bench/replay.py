@@ -0,0 +1,216 @@
+"""
+Benchmark offline de extremo a extremo con upstreams simulados.
+
+Levanta los stubs de bench/stubs.py (scrape.do, OpenAI, Pexels, Google,
+origen de imágenes) con fixtures de scrape_cache.json, arranca la app en
+un servidor WSGI local con hilos apuntando a ellos y lanza peticiones a
+/api/scrape, /api/generate_carousel, /api/search_image y /api/proxy_image
+con distintos niveles de concurrencia. Reporta p50/p95/p99 y throughput
+por endpoint y por etapa del pipeline.
+
+    python -m bench.replay
+    python -m bench.replay --levels 1,8,32 --requests 64 \\
+        --latency scrapedo=900:300,openai=1800:400,pexels=150:50 --errors scrapedo=0.1
+
+--cache cold (por defecto) usa claves únicas por petición para medir el
+pipeline completo: el stub de scrape.do añade el tag de la URL al texto del
+artículo, así que tampoco acierta la caché de IA (que va por contenido);
+--cache warm reutiliza las de las fixtures.
+"""
+import argparse
+import functools
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench.common import percentile
+from bench.stubs import SERVICES, ServiceProfile, StubConfig, StubServer, load_fixtures
+
+ENDPOINTS = ("scrape", "generate_carousel", "search_image", "proxy_image")
+
+DEFAULT_LATENCY = "scrapedo=800:200,openai=1500:300,pexels=150:50,google=200:50,images=80:20"
+
+# Funciones de app.py que se cronometran como etapas
+STAGES = {
+    "fetch_article_html": "scrape_do",
+    "parse_article": "parse",
+    "get_ai_data": "variants_ai",
+    "get_carousel_data": "carousel_ai",
+    "get_pexels_images": "pexels",
+}
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wrap(self, name, fn):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.samples[name].append(time.perf_counter() - start)
+        return timed
+
+    def reset(self):
+        with self._lock:
+            self.samples = defaultdict(list)
+
+
+def parse_profiles(latency: str, errors: str) -> StubConfig:
+    config = StubConfig()
+    for item in filter(None, (latency or "").split(",")):
+        name, _, spec = item.partition("=")
+        base, _, jitter = spec.partition(":")
+        profile = config.profiles.setdefault(name.strip(), ServiceProfile())
+        profile.latency_ms, profile.jitter_ms = float(base or 0), float(jitter or 0)
+    for item in filter(None, (errors or "").split(",")):
+        name, _, rate = item.partition("=")
+        config.profiles.setdefault(name.strip(), ServiceProfile()).error_rate = float(rate)
+    unknown = set(config.profiles) - set(SERVICES)
+    if unknown:
+        raise SystemExit(f"Servicios desconocidos: {', '.join(sorted(unknown))}")
+    return config
+
+
+def build_request(endpoint: str, i: int, fixtures: list, stub: StubServer, cold: bool, run_id: str):
+    f = fixtures[i % len(fixtures)]
+    tag = f"{run_id}-{i}" if cold else ""
+    if endpoint == "scrape":
+        url = f["url"] + (("&" if "?" in f["url"] else "?") + f"replay={tag}" if cold else "")
+        return "POST", "/api/scrape", {"json": {"url": url}}
+    if endpoint == "generate_carousel":
+        title = f"{f['title']} {tag}".strip() if cold else f["title"]
+        return "POST", "/api/generate_carousel", {"json": {"title": title, "text": f["text"], "source": "bench"}}
+    if endpoint == "search_image":
+        # clean_pexels_query se queda con 5 palabras: el marcador va primero
+        query = (f"v{tag.replace('-', '')} " if cold else "") + " ".join(f["variants"]["image_keywords"][:3])
+        return "POST", "/api/search_image", {"json": {"query": query, "count": 1}}
+    if endpoint == "proxy_image":
+        name = f"replay-{tag}" if cold else f"replay-{i % len(fixtures)}"
+        return "GET", "/api/proxy_image", {"params": {"url": stub.image_url(name), "w": 540}}
+    raise ValueError(endpoint)
+
+
+def run_level(base_url: str, endpoint: str, level: int, total: int, fixtures, stub, cold: bool):
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=max(level, 10)))
+    run_id = f"{endpoint[:3]}{level}{int(time.time() * 1000) % 10**7}"
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        method, path, kwargs = build_request(endpoint, i, fixtures, stub, cold, run_id)
+        start = time.perf_counter()
+        try:
+            r = session.request(method, base_url + path, timeout=300, **kwargs)
+            ok = r.status_code < 400
+            r.content
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+    return latencies, errors, wall
+
+
+def fmt_ms(seconds: float) -> str:
+    return f"{seconds * 1000:8.0f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,4,16", help="niveles de concurrencia (coma)")
+    parser.add_argument("--requests", type=int, default=32, help="peticiones por endpoint y nivel")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--latency", default=DEFAULT_LATENCY, help="servicio=base_ms:jitter_ms,...")
+    parser.add_argument("--errors", default="", help="servicio=tasa,... (p. ej. scrapedo=0.1)")
+    parser.add_argument("--cache", choices=("cold", "warm"), default="cold")
+    parser.add_argument("--fixtures", default="scrape_cache.json")
+    args = parser.parse_args(argv)
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        raise SystemExit(f"No hay fixtures utilizables en {args.fixtures}")
+    stub = StubServer(fixtures, parse_profiles(args.latency, args.errors)).start()
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    os.environ.update(stub.env())
+    os.environ.update({
+        "CACHE_DB": os.path.join(workdir, "cache.db"),
+        "IMAGE_CACHE_DIR": os.path.join(workdir, "images"),
+    })
+
+    import app as app_module
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    timer = StageTimer()
+    for attr, stage in STAGES.items():
+        setattr(app_module, attr, timer.wrap(stage, getattr(app_module, attr)))
+    app_module.IMAGE_CACHE._download = timer.wrap("proxy_download", app_module.IMAGE_CACHE._download)
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app_module.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    print(f"Stubs en {stub.base_url} · app en {base_url} · datos en {workdir} · {len(fixtures)} fixtures")
+
+    levels = [int(x) for x in args.levels.split(",") if x]
+    endpoints = [e for e in args.endpoints.split(",") if e]
+    results = []
+    for endpoint in endpoints:
+        for level in levels:
+            timer.reset()
+            latencies, errors, wall = run_level(base_url, endpoint, level, args.requests,
+                                                fixtures, stub, args.cache == "cold")
+            stages = {name: list(values) for name, values in timer.samples.items()}
+            results.append((endpoint, level, latencies, errors, wall, stages))
+            print(f"· {endpoint} c={level}: {len(latencies)} req en {wall:.1f}s")
+
+    print()
+    print(f"{'endpoint':<18} {'conc':>4} {'n':>4} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>7}")
+    for endpoint, level, latencies, errors, wall, _ in results:
+        print(f"{endpoint:<18} {level:>4} {len(latencies):>4} {errors:>4} "
+              f"{fmt_ms(percentile(latencies, 50))} {fmt_ms(percentile(latencies, 95))} "
+              f"{fmt_ms(percentile(latencies, 99))} {len(latencies) / wall:7.2f}")
+
+    print()
+    print(f"{'endpoint':<18} {'conc':>4} {'stage':<14} {'n':>5} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for endpoint, level, _, _, _, stages in results:
+        for name, values in sorted(stages.items()):
+            print(f"{endpoint:<18} {level:>4} {name:<14} {len(values):>5} "
+                  f"{fmt_ms(percentile(values, 50))} {fmt_ms(percentile(values, 95))} {fmt_ms(percentile(values, 99))}")
+
+    print()
+    print("Upstreams simulados (peticiones / errores inyectados):")
+    for name, c in stub.counts.items():
+        print(f"  {name:<10} {c['requests']:>6} / {c['errors']}")
+
+    server.shutdown()
+    stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
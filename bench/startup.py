@@ -0,0 +1,189 @@
+"""
+Benchmark de arranque: tiempo de `import app` en frío y memoria por worker.
+
+Cada medida corre en un proceso nuevo (con CACHE_DB e IMAGE_CACHE_DIR en
+un directorio temporal) para que no cuente nada ya importado:
+
+- import: mediana de N `import app` en frío y RSS del proceso al terminar.
+- importtime: los paquetes que más tardan según `python -X importtime`.
+- workers: un master hace fork de W workers como gunicorn, con y sin
+  preload (app.preload() en el master vs. cada worker importando app). Cada
+  worker importa después lo que importaría su primera petición
+  (PRELOAD_MODULES) y reporta cuánto tardó en estar listo y su RSS, PSS y
+  USS (/proc/self/smaps_rollup). PSS es lo que cuesta de verdad cada worker
+  cuando comparte páginas con el master.
+
+    python -m bench.startup
+    python -m bench.startup --runs 10 --workers 4 --max-import-seconds 0.6 --max-worker-pss-mb 80
+
+Con --max-* sale con código 1 si se supera el umbral (para CI).
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+rss = 0
+with open("/proc/self/status") as f:
+    for line in f:
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) * 1024
+print(json.dumps({"seconds": elapsed, "rss": rss}))
+"""
+
+WORKERS_SCRIPT = """
+import importlib, json, os, sys, time
+
+def memory():
+    out = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if parts and parts[0].rstrip(":") in ("Rss", "Pss", "Private_Clean", "Private_Dirty"):
+                    out[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        return {"rss": 0, "pss": None, "uss": None}
+    return {"rss": out.get("Rss", 0), "pss": out.get("Pss"),
+            "uss": out.get("Private_Clean", 0) + out.get("Private_Dirty", 0)}
+
+workers, preload = int(sys.argv[1]), sys.argv[2] == "1"
+if preload:
+    import app
+    app.preload()
+
+# Cada worker avisa al estar listo y mide cuando el master cierra measure_w
+# (EOF en todos a la vez): así el PSS se reparte entre todos los workers vivos
+measure_r, measure_w = os.pipe()
+pipes = []
+for _ in range(workers):
+    read_fd, write_fd = os.pipe()
+    forked = time.perf_counter()
+    if os.fork() == 0:
+        os.close(read_fd)
+        os.close(measure_w)
+        import app
+        for name in app.PRELOAD_MODULES:
+            try:
+                importlib.import_module(name)
+            except Exception:
+                pass
+        app.SCRAPE_CACHE.get("startup-bench")
+        os.write(write_fd, (json.dumps({"ready": time.perf_counter() - forked}) + "\\n").encode())
+        os.read(measure_r, 1)
+        os.write(write_fd, (json.dumps(memory()) + "\\n").encode())
+        os._exit(0)
+    os.close(write_fd)
+    pipes.append(os.fdopen(read_fd))
+
+os.close(measure_r)
+results = [json.loads(p.readline()) for p in pipes]
+os.close(measure_w)
+for result, p in zip(results, pipes):
+    result.update(json.loads(p.readline()))
+for _ in pipes:
+    os.wait()
+print(json.dumps(results))
+"""
+
+
+def bench_env(workdir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "CACHE_DB": os.path.join(workdir, "cache.db"),
+        "IMAGE_CACHE_DIR": os.path.join(workdir, "images"),
+    })
+    return env
+
+
+def run_python(args, workdir: str, stderr=subprocess.DEVNULL) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=bench_env(workdir),
+                          stdout=subprocess.PIPE, stderr=stderr, text=True, check=True)
+
+
+def measure_import(runs: int) -> list:
+    samples = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory(prefix="startup-") as workdir:
+            out = run_python(["-c", IMPORT_SCRIPT], workdir).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return samples
+
+
+def measure_importtime(top: int) -> list:
+    """[(paquete, segundos propios)] sumando los submódulos de cada paquete."""
+    with tempfile.TemporaryDirectory(prefix="startup-") as workdir:
+        stderr = run_python(["-X", "importtime", "-c", "import app"], workdir, stderr=subprocess.PIPE).stderr
+    totals = defaultdict(float)
+    for line in stderr.splitlines():
+        m = re.match(r"import time:\s+(\d+)\s+\|\s+\d+\s+\|\s*(\S+)", line)
+        if m:
+            totals[m.group(2).split(".")[0]] += int(m.group(1)) / 1e6
+    return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)[:top]
+
+
+def measure_workers(workers: int, preload: bool) -> list:
+    with tempfile.TemporaryDirectory(prefix="startup-") as workdir:
+        out = run_python(["-c", WORKERS_SCRIPT, str(workers), "1" if preload else "0"], workdir).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def mb(value) -> str:
+    return f"{value / 2**20:8.1f}" if value is not None else f"{'-':>8}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="imports en frío para la mediana")
+    parser.add_argument("--workers", type=int, default=3, help="workers a simular por modo")
+    parser.add_argument("--top", type=int, default=12, help="paquetes a mostrar de -X importtime")
+    parser.add_argument("--max-import-seconds", type=float, help="umbral para la mediana de import app")
+    parser.add_argument("--max-worker-pss-mb", type=float, help="umbral para el PSS máximo por worker (con preload)")
+    args = parser.parse_args(argv)
+
+    samples = measure_import(args.runs)
+    seconds = [s["seconds"] for s in samples]
+    import_median = statistics.median(seconds)
+    print(f"import app en frío ({args.runs} runs): mediana {import_median * 1000:.0f} ms · "
+          f"min {min(seconds) * 1000:.0f} ms · max {max(seconds) * 1000:.0f} ms · "
+          f"RSS {statistics.median(s['rss'] for s in samples) / 2**20:.1f} MB")
+
+    print()
+    print(f"{'paquete':<24} {'ms propios':>10}")
+    for name, total in measure_importtime(args.top):
+        print(f"{name:<24} {total * 1000:10.1f}")
+
+    print()
+    print(f"{'modo':<12} {'worker':>6} {'listo ms':>9} {'RSS MB':>8} {'PSS MB':>8} {'USS MB':>8}")
+    worst_pss = None
+    for preload in (False, True):
+        label = "preload" if preload else "sin preload"
+        for i, w in enumerate(measure_workers(args.workers, preload)):
+            print(f"{label:<12} {i:>6} {w['ready'] * 1000:9.0f} {mb(w['rss'])} {mb(w['pss'])} {mb(w['uss'])}")
+            if preload and w["pss"] is not None:
+                worst_pss = max(worst_pss or 0, w["pss"])
+
+    failed = False
+    if args.max_import_seconds is not None and import_median > args.max_import_seconds:
+        print(f"❌ import app tarda {import_median:.2f}s (máximo {args.max_import_seconds:.2f}s)")
+        failed = True
+    if args.max_worker_pss_mb is not None and worst_pss is not None and worst_pss / 2**20 > args.max_worker_pss_mb:
+        print(f"❌ PSS por worker {worst_pss / 2**20:.1f} MB (máximo {args.max_worker_pss_mb:.1f} MB)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,308 @@
+"""
+Servidores locales que imitan scrape.do, OpenAI (chat completions),
+Pexels, Google CSE y un origen de imágenes, alimentados con fixtures
+construidas a partir de scrape_cache.json.
+
+Cada servicio tiene latencia configurable (base + jitter, en ms) y una
+tasa de errores inyectados. Un solo ThreadingHTTPServer enruta por prefijo:
+
+    /scrapedo/          -> HTML sintético del artículo (?url=...)
+    /v1/chat/completions-> respuesta JSON (streaming SSE si stream=true)
+    /pexels/v1/search   -> fotos que apuntan a /images/
+    /google/customsearch/v1
+    /images/<name>.jpg  -> JPEG generado
+"""
+import html
+import io
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SERVICES = ("scrapedo", "openai", "pexels", "google", "images")
+
+
+@dataclass
+class ServiceProfile:
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    error_rate: float = 0.0
+    error_status: int = 500
+
+
+@dataclass
+class StubConfig:
+    profiles: dict = field(default_factory=lambda: {name: ServiceProfile() for name in SERVICES})
+    seed: int = 1234
+
+
+# --------------------------------------------------------------------
+# Fixtures
+# --------------------------------------------------------------------
+def load_fixtures(cache_path: str = "scrape_cache.json"):
+    """Una fixture por entrada del volcado antiguo de la caché de scrape."""
+    with open(cache_path) as f:
+        legacy = json.load(f)
+
+    fixtures = []
+    for url, entry in legacy.items():
+        data = (entry or {}).get("data") or {}
+        original = data.get("original") or {}
+        ai = data.get("ai_content") or {}
+        variants = ai.get("variants") or {}
+        if not original.get("title") or not variants:
+            continue
+        text = data.get("full_text") or " ".join(
+            [original.get("subtitle", "")] + [v.get("subtitle", "") for v in variants.values()]
+        ) * 8
+        slides = (data.get("carousel") or {}).get("slides") or [
+            {
+                "title": v.get("title", ""),
+                "sentence": v.get("subtitle", ""),
+                "image_keywords": (ai.get("image_keywords") or ["news"])[:3],
+            }
+            for v in variants.values()
+        ]
+        fixtures.append({
+            "url": url,
+            "title": original["title"],
+            "text": text,
+            "variants": {
+                "variants": {k: {"title": v.get("title", ""), "subtitle": v.get("subtitle", "")}
+                             for k, v in variants.items()},
+                "common_caption": ai.get("common_caption", ""),
+                "image_keywords": ai.get("image_keywords") or ["news"],
+            },
+            "carousel": {
+                "recommended_slides": min(len(slides), 5) or 3,
+                "recommendation_reason": "Replay fixture",
+                "slides": [{k: s.get(k, "" if k != "image_keywords" else []) for k in ("title", "sentence", "image_keywords")}
+                           for s in slides][:5],
+                "caption": ai.get("common_caption", ""),
+            },
+        })
+    return fixtures
+
+
+def _stable(value: str) -> int:
+    # hash() cambia entre procesos; esto no
+    return zlib.crc32(value.encode())
+
+
+def _jpeg(width: int = 1200, height: int = 1800, seed: int = 0) -> bytes:
+    from PIL import Image
+
+    rnd = random.Random(seed)
+    img = Image.new("RGB", (width, height), (rnd.randrange(256), rnd.randrange(256), rnd.randrange(256)))
+    out = io.BytesIO()
+    img.save(out, "JPEG", quality=85)
+    return out.getvalue()
+
+
+# --------------------------------------------------------------------
+# Servidor
+# --------------------------------------------------------------------
+class StubServer:
+
+    def __init__(self, fixtures: list, config: StubConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.fixtures = fixtures
+        self.by_url = {f["url"]: f for f in fixtures}
+        self.by_title = {f["title"].strip().lower(): f for f in fixtures}
+        self.config = config or StubConfig()
+        self.random = random.Random(self.config.seed)
+        self.images = {}
+        self.counts = {name: {"requests": 0, "errors": 0} for name in SERVICES}
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+
+    # Endpoints para configurar la app
+    def env(self) -> dict:
+        return {
+            "SCRAPE_DO_KEY": "bench",
+            "SCRAPE_DO_URL": f"{self.base_url}/scrapedo/",
+            "OPENAI_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{self.base_url}/v1",
+            "AI_BACKEND": "chat",
+            "PEXELS_API_KEY": "bench",
+            "PEXELS_API_URL": f"{self.base_url}/pexels/v1",
+            "GOOGLE_SEARCH_API_KEY": "bench",
+            "GOOGLE_SEARCH_CX": "bench",
+            "GOOGLE_SEARCH_URL": f"{self.base_url}/google/customsearch/v1",
+            # Sin cuotas propias: los benchmarks miden los stubs, no el limitador
+            "RATE_LIMITS": "",
+        }
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name="bench-stubs", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+
+    def image_url(self, name: str) -> str:
+        return f"{self.base_url}/images/{name}.jpg"
+
+    def _delay_or_fail(self, service: str):
+        """Aplica latencia; devuelve un status de error si toca inyectarlo."""
+        profile = self.config.profiles.get(service) or ServiceProfile()
+        with self._lock:
+            self.counts[service]["requests"] += 1
+            jitter = self.random.uniform(-profile.jitter_ms, profile.jitter_ms)
+            fail = self.random.random() < profile.error_rate
+            if fail:
+                self.counts[service]["errors"] += 1
+        delay = max(profile.latency_ms + jitter, 0) / 1000
+        if delay:
+            time.sleep(delay)
+        return profile.error_status if fail else None
+
+    def _fixture_for_prompt(self, prompt: str):
+        match = re.search(r"TITLE:\s*(.+)", prompt)
+        if match:
+            found = self.by_title.get(match.group(1).strip().lower())
+            if found:
+                return found
+        return self.fixtures[0]
+
+    def _article_html(self, fixture: dict, url: str) -> str:
+        paragraphs = "".join(f"<p>{html.escape(p)}</p>" for p in re.split(r"(?<=[.!?])\s+", fixture["text"]) if p)
+        # En --cache cold la URL lleva ?replay=<tag>: el texto cambia con ella para
+        # que la caché de IA (por contenido, no por URL) tampoco acierte
+        tag = (parse_qs(urlparse(url).query).get("replay") or [""])[0]
+        if tag:
+            paragraphs += f"<p>Replay {html.escape(tag)}.</p>"
+        return (
+            "<html><head>"
+            f"<title>{html.escape(fixture['title'])}</title>"
+            f'<meta property="og:title" content="{html.escape(fixture["title"])}">'
+            f'<meta property="og:image" content="{self.image_url("top-" + str(_stable(url) % 1000))}">'
+            f'<link rel="canonical" href="{html.escape(url)}">'
+            "</head><body><nav><a href='/'>Home</a></nav>"
+            f"<article><h1>{html.escape(fixture['title'])}</h1>{paragraphs}</article>"
+            "<footer>Replay stub</footer></body></html>"
+        )
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _json(self, status: int, payload):
+                self._send(status, json.dumps(payload).encode())
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+
+                if parsed.path.startswith("/scrapedo"):
+                    status = stub._delay_or_fail("scrapedo")
+                    if status:
+                        return self._send(status, b"upstream blocked", "text/plain")
+                    url = (query.get("url") or [""])[0]
+                    base = url.split("?")[0]
+                    fixture = stub.by_url.get(url) or stub.by_url.get(base) or \
+                        stub.fixtures[_stable(base) % len(stub.fixtures)]
+                    return self._send(200, stub._article_html(fixture, url).encode(), "text/html; charset=utf-8")
+
+                if parsed.path.startswith("/pexels"):
+                    status = stub._delay_or_fail("pexels")
+                    if status:
+                        return self._json(status, {"error": "injected"})
+                    q = (query.get("query") or [""])[0]
+                    count = int((query.get("per_page") or ["1"])[0])
+                    photos = [{"src": {"large2x": stub.image_url(f"pexels-{_stable(q) % 500}-{i}")}}
+                              for i in range(count)]
+                    return self._json(200, {"photos": photos})
+
+                if parsed.path.startswith("/google"):
+                    status = stub._delay_or_fail("google")
+                    if status:
+                        return self._json(status, {"error": "injected"})
+                    q = (query.get("q") or [""])[0]
+                    items = [{"title": f["title"], "link": f["url"], "snippet": f["text"][:120]}
+                             for f in stub.fixtures[:int((query.get("num") or ["5"])[0])]]
+                    return self._json(200, {"items": items, "query": q})
+
+                if parsed.path.startswith("/images/"):
+                    status = stub._delay_or_fail("images")
+                    if status:
+                        return self._send(status, b"", "text/plain")
+                    name = parsed.path.rsplit("/", 1)[-1]
+                    with stub._lock:
+                        data = stub.images.get(name)
+                    if data is None:
+                        data = _jpeg(seed=_stable(name) % 10_000)
+                        with stub._lock:
+                            stub.images[name] = data
+                    return self._send(200, data, "image/jpeg")
+
+                self._send(404, b"not found", "text/plain")
+
+            def do_POST(self):
+                if not self.path.startswith("/v1/chat/completions"):
+                    return self._send(404, b"not found", "text/plain")
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                status = stub._delay_or_fail("openai")
+                if status:
+                    return self._json(status, {"error": {"message": "injected", "type": "server_error"}})
+
+                prompt = (body.get("messages") or [{}])[-1].get("content", "")
+                schema_name = ((body.get("response_format") or {}).get("json_schema") or {}).get("name")
+                fixture = stub._fixture_for_prompt(prompt)
+                if schema_name == "carousel":
+                    content = json.dumps(fixture["carousel"])
+                elif schema_name == "combined":
+                    content = json.dumps(dict(fixture["variants"], carousel=fixture["carousel"]))
+                else:
+                    content = json.dumps(fixture["variants"])
+                usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4,
+                         "total_tokens": (len(prompt) + len(content)) // 4}
+
+                if not body.get("stream"):
+                    return self._json(200, {
+                        "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                        "model": body.get("model", "bench"),
+                        "choices": [{"index": 0, "finish_reason": "stop",
+                                     "message": {"role": "assistant", "content": content}}],
+                        "usage": usage,
+                    })
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                chunks = [content[i:i + 64] for i in range(0, len(content), 64)]
+                for i, piece in enumerate(chunks):
+                    chunk = {
+                        "id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": body.get("model", "bench"),
+                        "choices": [{"index": 0, "delta": {"content": piece},
+                                     "finish_reason": "stop" if i == len(chunks) - 1 else None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    final = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": body.get("model", "bench"), "choices": [], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(final)}\n\n".encode())
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.close_connection = True
+
+        return Handler
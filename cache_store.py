@@ -0,0 +1,271 @@
+"""
+Caché persistente compartida entre workers (SQLite en modo WAL).
+
+Cada entrada vive en una fila propia, así que leer o escribir una URL no
+obliga a reescribir el resto de la caché. SQLite serializa las escrituras
+entre procesos, por lo que todos los workers de gunicorn pueden compartir
+el mismo archivo sin pisarse.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_DB_PATH = os.getenv("CACHE_DB", "scrape_cache.db")
+
+# Cada cuántas escrituras se barre la tabla (TTL + LRU)
+SWEEP_EVERY = 50
+
+
+class CacheStore:
+    """
+    Key/value store sobre SQLite con TTL y desalojo LRU.
+
+    `namespace` permite que varias cachés (scrape, pexels, ...) compartan el
+    mismo archivo sin mezclar claves. `ttl` es la edad a partir de la cual
+    una entrada se barre; `max_entries` limita el tamaño del namespace.
+    """
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, namespace: str = "scrape",
+                 ttl: float = 60 * 60 * 24, max_entries: int = 5000):
+        self.path = path
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._writes_lock = threading.Lock()
+        self._init_schema()
+
+    # ----------------------------------------------------------------
+    # Conexión
+    # ----------------------------------------------------------------
+    def _conn(self) -> sqlite3.Connection:
+        # Una conexión por hilo y por proceso (no se comparten tras un fork)
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Cierra la conexión de este hilo (p. ej. antes de hacer fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                ns TEXT NOT NULL,
+                key TEXT NOT NULL,
+                ts REAL NOT NULL,
+                accessed REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0,
+                data TEXT NOT NULL,
+                PRIMARY KEY (ns, key)
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_ts ON cache_entries (ns, ts)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries (ns, accessed)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+
+    # ----------------------------------------------------------------
+    # Lectura / escritura por clave
+    # ----------------------------------------------------------------
+    def get(self, key: str, touch: bool = True):
+        """
+        Devuelve {'ts': ..., 'data': ...} o None. Actualiza el acceso (LRU)
+        salvo con touch=False (lecturas internas que no cuentan como uso).
+        """
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT ts, data FROM cache_entries WHERE ns = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            data = json.loads(row[1])
+        except json.JSONDecodeError:
+            self.delete(key)
+            return None
+        if not touch:
+            return {"ts": row[0], "data": data}
+        conn.execute(
+            "UPDATE cache_entries SET accessed = ?, hits = hits + 1 WHERE ns = ? AND key = ?",
+            (time.time(), self.namespace, key)
+        )
+        return {"ts": row[0], "data": data}
+
+    def peek(self, key: str):
+        """`ts` de la entrada (o None) sin leer los datos ni contar un acceso."""
+        row = self._conn().execute(
+            "SELECT ts FROM cache_entries WHERE ns = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, data, ts: float = None):
+        now = time.time()
+        ts = now if ts is None else ts
+        self._conn().execute(
+            """
+            INSERT INTO cache_entries (ns, key, ts, accessed, hits, data)
+            VALUES (?, ?, ?, ?, 0, ?)
+            ON CONFLICT (ns, key) DO UPDATE SET
+                ts = excluded.ts, accessed = excluded.accessed, data = excluded.data
+            """,
+            (self.namespace, key, ts, now, json.dumps(data))
+        )
+        self._maybe_sweep()
+
+    def delete(self, key: str):
+        self._conn().execute(
+            "DELETE FROM cache_entries WHERE ns = ? AND key = ?",
+            (self.namespace, key)
+        )
+
+    def hottest(self, written_before: float, written_after: float = 0, limit: int = 20):
+        """Claves más leídas cuyo `ts` cae en la ventana dada: [(key, ts, hits)]."""
+        return self._conn().execute(
+            """
+            SELECT key, ts, hits FROM cache_entries
+            WHERE ns = ? AND ts < ? AND ts > ? AND hits > 0
+            ORDER BY hits DESC LIMIT ?
+            """,
+            (self.namespace, written_before, written_after, limit)
+        ).fetchall()
+
+    def __len__(self):
+        row = self._conn().execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE ns = ?", (self.namespace,)
+        ).fetchone()
+        return row[0]
+
+    # ----------------------------------------------------------------
+    # Mantenimiento
+    # ----------------------------------------------------------------
+    def _maybe_sweep(self):
+        with self._writes_lock:
+            self._writes += 1
+            due = self._writes % SWEEP_EVERY == 0
+        if due:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Borra entradas expiradas y aplica el tope LRU. Devuelve cuántas borró."""
+        conn = self._conn()
+        removed = conn.execute(
+            "DELETE FROM cache_entries WHERE ns = ? AND ts < ?",
+            (self.namespace, time.time() - self.ttl)
+        ).rowcount
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            removed += conn.execute(
+                """
+                DELETE FROM cache_entries WHERE ns = ? AND key IN (
+                    SELECT key FROM cache_entries WHERE ns = ?
+                    ORDER BY accessed ASC LIMIT ?
+                )
+                """,
+                (self.namespace, self.namespace, overflow)
+            ).rowcount
+        return removed
+
+    def import_json(self, json_path: str, key_fn=None) -> int:
+        """
+        Importa una sola vez un volcado {key: {'ts', 'data'}} (el antiguo
+        scrape_cache.json), pasando cada clave por `key_fn` si se da.
+        Devuelve el número de entradas importadas.
+        """
+        if not os.path.exists(json_path):
+            return 0
+        conn = self._conn()
+        marker = f"imported:{self.namespace}:{os.path.abspath(json_path)}"
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM cache_meta WHERE key = ?", (marker,)).fetchone():
+                conn.execute("COMMIT")
+                return 0
+            try:
+                with open(json_path, 'r') as f:
+                    legacy = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                legacy = {}
+            count = 0
+            for key, entry in legacy.items():
+                if not isinstance(entry, dict) or 'data' not in entry:
+                    continue
+                ts = entry.get('ts', 0)
+                conn.execute(
+                    """
+                    INSERT OR IGNORE INTO cache_entries (ns, key, ts, accessed, hits, data)
+                    VALUES (?, ?, ?, ?, 0, ?)
+                    """,
+                    (self.namespace, key_fn(key) if key_fn else key, ts, ts, json.dumps(entry['data']))
+                )
+                count += 1
+            conn.execute(
+                "INSERT INTO cache_meta (key, value) VALUES (?, ?)",
+                (marker, str(time.time()))
+            )
+            conn.execute("COMMIT")
+            return count
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def rekey(self, key_fn, version: str) -> int:
+        """
+        Migración única (por `version`) de las claves del namespace: cada
+        clave pasa por `key_fn`, p. ej. al cambiar cómo se canonicalizan las
+        URLs. Si dos claves acaban en la misma se queda la entrada más
+        reciente. Devuelve cuántas claves cambiaron.
+        """
+        conn = self._conn()
+        marker = f"rekeyed:{self.namespace}:{version}"
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM cache_meta WHERE key = ?", (marker,)).fetchone():
+                conn.execute("COMMIT")
+                return 0
+            rows = conn.execute(
+                "SELECT key, ts, accessed, hits, data FROM cache_entries WHERE ns = ?", (self.namespace,)
+            ).fetchall()
+            moved = 0
+            for key, ts, accessed, hits, data in rows:
+                new_key = key_fn(key)
+                if new_key == key:
+                    continue
+                moved += 1
+                conn.execute("DELETE FROM cache_entries WHERE ns = ? AND key = ?", (self.namespace, key))
+                conn.execute(
+                    """
+                    INSERT INTO cache_entries (ns, key, ts, accessed, hits, data)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (ns, key) DO UPDATE SET
+                        ts = excluded.ts, accessed = excluded.accessed,
+                        hits = cache_entries.hits + excluded.hits, data = excluded.data
+                    WHERE excluded.ts > cache_entries.ts
+                    """,
+                    (self.namespace, new_key, ts, accessed, hits, data)
+                )
+            conn.execute("INSERT INTO cache_meta (key, value) VALUES (?, ?)", (marker, str(time.time())))
+            conn.execute("COMMIT")
+            return moved
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
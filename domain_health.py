@@ -0,0 +1,191 @@
+"""
+Salud por dominio y circuit breaker para scrape.do.
+
+Guarda en SQLite (compartido por todos los workers) éxitos, fallos y
+latencia media por dominio. Tras `failure_threshold` fallos seguidos el
+circuito se abre y los scrapes de ese dominio van directos al fallback.
+Pasado `cooldown` se deja pasar una sola petición de prueba (half-open):
+si sale bien el circuito se cierra, si falla vuelve a abrirse con un
+cooldown el doble de largo (hasta `max_cooldown`).
+"""
+import os
+import sqlite3
+import threading
+import time
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class DomainHealth:
+
+    def __init__(self, path: str, failure_threshold: int = 3, cooldown: float = 15 * 60,
+                 max_cooldown: float = 6 * 60 * 60, probe_timeout: float = 120):
+        self.path = path
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Suelta la conexión de este hilo."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS domain_health (
+                domain TEXT PRIMARY KEY,
+                successes INTEGER NOT NULL DEFAULT 0,
+                failures INTEGER NOT NULL DEFAULT 0,
+                consecutive_failures INTEGER NOT NULL DEFAULT 0,
+                latency_avg REAL,
+                state TEXT NOT NULL DEFAULT 'closed',
+                cooldown REAL,
+                opened_at REAL,
+                probe_at REAL,
+                last_error TEXT,
+                updated REAL
+            )
+        """)
+
+    # ----------------------------------------------------------------
+    # Consulta
+    # ----------------------------------------------------------------
+    def allow(self, domain: str) -> bool:
+        """¿Se puede intentar scrape.do para este dominio? (reserva la prueba si toca)."""
+        if not domain:
+            return True
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT state, opened_at, cooldown, probe_at FROM domain_health WHERE domain = ?",
+            (domain,)
+        ).fetchone()
+        if row is None or row[0] == CLOSED:
+            return True
+        state, opened_at, cooldown, probe_at = row
+        now = time.time()
+        if state == OPEN and now - opened_at >= (cooldown or self.cooldown):
+            # Solo una petición (de cualquier worker) hace de prueba
+            return conn.execute(
+                "UPDATE domain_health SET state = ?, probe_at = ? WHERE domain = ? AND state = ?",
+                (HALF_OPEN, now, domain, OPEN)
+            ).rowcount == 1
+        if state == HALF_OPEN and now - (probe_at or 0) >= self.probe_timeout:
+            # La prueba anterior nunca informó (worker muerto): permitir otra
+            return conn.execute(
+                "UPDATE domain_health SET probe_at = ? WHERE domain = ? AND state = ? AND probe_at = ?",
+                (now, domain, HALF_OPEN, probe_at)
+            ).rowcount == 1
+        return False
+
+    def state(self, domain: str) -> str:
+        row = self._conn().execute(
+            "SELECT state FROM domain_health WHERE domain = ?", (domain,)
+        ).fetchone()
+        return row[0] if row else CLOSED
+
+    # ----------------------------------------------------------------
+    # Registro
+    # ----------------------------------------------------------------
+    def record_success(self, domain: str, latency: float):
+        if not domain:
+            return
+        self._conn().execute(
+            """
+            INSERT INTO domain_health (domain, successes, latency_avg, state, updated)
+            VALUES (?, 1, ?, 'closed', ?)
+            ON CONFLICT (domain) DO UPDATE SET
+                successes = successes + 1,
+                consecutive_failures = 0,
+                latency_avg = COALESCE(0.8 * latency_avg + 0.2 * excluded.latency_avg, excluded.latency_avg),
+                state = 'closed',
+                cooldown = NULL,
+                opened_at = NULL,
+                probe_at = NULL,
+                updated = excluded.updated
+            """,
+            (domain, latency, time.time())
+        )
+
+    def record_failure(self, domain: str, latency: float, error: str = None):
+        if not domain:
+            return
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT consecutive_failures, state, cooldown, latency_avg FROM domain_health WHERE domain = ?",
+                (domain,)
+            ).fetchone()
+            consecutive, state, cooldown, latency_avg = row if row else (0, CLOSED, None, None)
+            consecutive += 1
+            latency_avg = latency if latency_avg is None else 0.8 * latency_avg + 0.2 * latency
+
+            opened_at = None
+            if state == HALF_OPEN:
+                # Falló la prueba: reabrir con backoff
+                state, cooldown, opened_at = OPEN, min((cooldown or self.cooldown) * 2, self.max_cooldown), now
+            elif state == OPEN or consecutive >= self.failure_threshold:
+                if state != OPEN:
+                    print(f"🚫 Circuito abierto para {domain} tras {consecutive} fallos")
+                state, cooldown, opened_at = OPEN, cooldown or self.cooldown, now
+
+            conn.execute(
+                """
+                INSERT INTO domain_health (domain, failures, consecutive_failures, latency_avg,
+                                           state, cooldown, opened_at, last_error, updated)
+                VALUES (?, 1, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (domain) DO UPDATE SET
+                    failures = failures + 1,
+                    consecutive_failures = excluded.consecutive_failures,
+                    latency_avg = excluded.latency_avg,
+                    state = excluded.state,
+                    cooldown = excluded.cooldown,
+                    opened_at = COALESCE(excluded.opened_at, opened_at),
+                    last_error = excluded.last_error,
+                    updated = excluded.updated
+                """,
+                (domain, consecutive, latency_avg, state, cooldown, opened_at, (error or '')[:300], now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self, limit: int = 100) -> list:
+        rows = self._conn().execute(
+            """
+            SELECT domain, successes, failures, consecutive_failures, latency_avg, state, last_error, updated
+            FROM domain_health ORDER BY updated DESC LIMIT ?
+            """,
+            (limit,)
+        ).fetchall()
+        return [
+            {
+                "domain": r[0],
+                "successes": r[1],
+                "failures": r[2],
+                "success_rate": r[1] / (r[1] + r[2]) if r[1] + r[2] else None,
+                "consecutive_failures": r[3],
+                "latency_avg": r[4],
+                "state": r[5],
+                "last_error": r[6],
+                "updated": r[7],
+            }
+            for r in rows
+        ]
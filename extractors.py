@@ -0,0 +1,193 @@
+"""
+Extracción de título, texto e imagen principal a partir del HTML.
+
+- FastExtractor: lxml + metadatos (og:/twitter:) + bloque con más texto en
+  <p>. Sin NLTK; devuelve además una confianza 0..1.
+- NewspaperExtractor: newspaper3k Article.parse() (sin nlp()).
+
+extract() usa la vía rápida y cae a newspaper cuando la confianza es baja.
+El resumen (lo único que daba art.nlp()) se calcula aparte y solo si hace
+falta, con summarize().
+"""
+import re
+import threading
+from dataclasses import dataclass, field
+from urllib.parse import urljoin
+
+import lxml.html
+
+ENGINE_FAST = "fast"
+ENGINE_NEWSPAPER = "newspaper"
+
+# Por debajo de esto se repite la extracción con newspaper
+MIN_CONFIDENCE = 0.6
+
+BOILERPLATE_TAGS = ("script", "style", "noscript", "nav", "footer", "header", "aside",
+                    "form", "iframe", "svg", "button", "figure", "figcaption")
+BOILERPLATE_HINTS = re.compile(
+    r"comment|related|share|social|newsletter|promo|sidebar|footer|subscribe|advert|cookie|breadcrumb|menu",
+    re.IGNORECASE
+)
+MIN_PARAGRAPH_CHARS = 40
+
+
+@dataclass
+class Extraction:
+    title: str = ""
+    text: str = ""
+    top_image: str = ""
+    engine: str = ENGINE_FAST
+    confidence: float = 1.0
+    extra: dict = field(default_factory=dict)
+
+
+def _meta(doc, *names):
+    for name in names:
+        values = doc.xpath(f'//meta[@property="{name}" or @name="{name}"]/@content')
+        for value in values:
+            if value.strip():
+                return value.strip()
+    return ""
+
+
+def _clean_title(title: str, site_name: str) -> str:
+    title = re.sub(r"\s+", " ", title or "").strip()
+    # "Headline | Site" / "Headline - Site"
+    parts = re.split(r"\s+[|\-–—]\s+", title)
+    if len(parts) > 1 and (not site_name or site_name.lower() in parts[-1].lower() or len(parts[-1]) < 30):
+        title = max(parts[:-1], key=len)
+    return title
+
+
+class FastExtractor:
+    name = ENGINE_FAST
+
+    def extract(self, url: str, html: str) -> Extraction:
+        doc = lxml.html.fromstring(html)
+
+        site_name = _meta(doc, "og:site_name")
+        title = _meta(doc, "og:title", "twitter:title")
+        if not title:
+            h1 = doc.xpath("//h1")
+            title = h1[0].text_content() if h1 else "".join(doc.xpath("//title/text()"))
+        title = _clean_title(title, site_name)
+
+        top_image = _meta(doc, "og:image", "og:image:url", "twitter:image", "twitter:image:src")
+        if not top_image:
+            links = doc.xpath('//link[@rel="image_src"]/@href')
+            top_image = links[0] if links else ""
+        if top_image:
+            top_image = urljoin(url, top_image)
+
+        for el in doc.xpath("|".join(f"//{tag}" for tag in BOILERPLATE_TAGS)):
+            el.drop_tree()
+        for el in doc.xpath("//*[@class or @id]"):
+            hint = f"{el.get('class', '')} {el.get('id', '')}"
+            if BOILERPLATE_HINTS.search(hint) and el.tag not in ("body", "html", "article", "main"):
+                el.drop_tree()
+
+        paragraphs = self._best_block(doc)
+        text = "\n\n".join(paragraphs)
+
+        return Extraction(
+            title=title,
+            text=text,
+            top_image=top_image,
+            engine=self.name,
+            confidence=self._confidence(title, paragraphs),
+        )
+
+    @staticmethod
+    def _paragraphs(node):
+        out = []
+        for p in node.xpath(".//p"):
+            t = re.sub(r"\s+", " ", p.text_content()).strip()
+            if len(t) >= MIN_PARAGRAPH_CHARS:
+                out.append(t)
+        return out
+
+    def _best_block(self, doc):
+        # Preferir <article>/<main>; si no, el padre con más texto en <p>
+        for xpath in ("//article", "//main", '//*[@itemprop="articleBody"]'):
+            nodes = doc.xpath(xpath)
+            if nodes:
+                best = max((self._paragraphs(n) for n in nodes), key=lambda ps: sum(map(len, ps)))
+                if sum(map(len, best)) > 500:
+                    return best
+
+        scores = {}
+        for p in doc.xpath("//p"):
+            parent = p.getparent()
+            if parent is None:
+                continue
+            length = len(p.text_content().strip())
+            if length >= MIN_PARAGRAPH_CHARS:
+                scores[parent] = scores.get(parent, 0) + length
+        if not scores:
+            return []
+        return self._paragraphs(max(scores, key=scores.get))
+
+    @staticmethod
+    def _confidence(title: str, paragraphs: list) -> float:
+        chars = sum(map(len, paragraphs))
+        score = 0.0
+        score += 0.3 if title else 0.0
+        score += min(chars / 1500, 1.0) * 0.5
+        score += min(len(paragraphs) / 5, 1.0) * 0.2
+        return round(score, 3)
+
+
+class NewspaperExtractor:
+    name = ENGINE_NEWSPAPER
+
+    def extract(self, url: str, html: str) -> Extraction:
+        from newspaper import Article
+
+        art = Article(url)
+        art.set_html(html)
+        art.parse()
+        return Extraction(
+            title=art.title or "",
+            text=art.text or "",
+            top_image=art.top_image or "",
+            engine=self.name,
+        )
+
+
+EXTRACTORS = {
+    ENGINE_FAST: FastExtractor(),
+    ENGINE_NEWSPAPER: NewspaperExtractor(),
+}
+
+
+def extract(url: str, html: str, engine: str = "auto", min_confidence: float = MIN_CONFIDENCE) -> Extraction:
+    """`engine`: 'auto' (rápido con fallback), 'fast' o 'newspaper'."""
+    if engine in EXTRACTORS:
+        return EXTRACTORS[engine].extract(url, html)
+    try:
+        fast = EXTRACTORS[ENGINE_FAST].extract(url, html)
+        if fast.confidence >= min_confidence:
+            return fast
+    except Exception as e:
+        print(f"⚠️ Extractor rápido falló, usando newspaper: {e}")
+    return EXTRACTORS[ENGINE_NEWSPAPER].extract(url, html)
+
+
+_stopwords_loaded = set()
+_stopwords_lock = threading.Lock()
+
+
+def summarize(title: str, text: str, max_sents: int = 5, language: str = "en") -> str:
+    """Resumen extractivo de newspaper (NLTK). Caro: llamar solo si hace falta."""
+    from newspaper import nlp
+
+    try:
+        # Article.nlp() cargaba las stopwords; sin ellas las keywords (y el
+        # orden de las frases) salen de palabras vacías
+        with _stopwords_lock:
+            if language not in _stopwords_loaded:
+                nlp.load_stopwords(language)
+                _stopwords_loaded.add(language)
+        return "\n".join(nlp.summarize(title=title, text=text, max_sents=max_sents))
+    except Exception:
+        return ""
@@ -0,0 +1,86 @@
+"""
+URLs de artículos a partir de un feed RSS 1.0/2.0, Atom o un sitemap XML.
+
+parse_feed() solo interpreta el documento: devuelve las URLs de artículos
+y, si es un índice de sitemaps, los sitemaps hijos para que el llamador
+decida cuántos descargar.
+"""
+from dataclasses import dataclass, field
+
+from lxml import etree
+
+
+class NotAFeed(ValueError):
+    """El documento no es RSS, Atom ni sitemap."""
+
+
+@dataclass
+class FeedEntries:
+    kind: str                                       # rss | atom | sitemap | sitemapindex
+    urls: list = field(default_factory=list)
+    sitemaps: list = field(default_factory=list)
+
+
+def _local(tag) -> str:
+    # '{http://www.w3.org/2005/Atom}entry' -> 'entry'
+    return etree.QName(tag).localname if isinstance(tag, str) else ""
+
+
+def _children(node, name: str) -> list:
+    return [child for child in node if _local(child.tag) == name]
+
+
+def _text(node, name: str) -> str:
+    for child in _children(node, name):
+        if child.text and child.text.strip():
+            return child.text.strip()
+    return ""
+
+
+def _rss_link(item) -> str:
+    link = _text(item, "link")
+    if link:
+        return link
+    # <guid isPermaLink="true"> (por defecto lo es) cuando no hay <link>
+    for guid in _children(item, "guid"):
+        if (guid.get("isPermaLink") or "true").lower() == "true" and (guid.text or "").strip().startswith("http"):
+            return guid.text.strip()
+    return ""
+
+
+def _atom_link(entry) -> str:
+    links = _children(entry, "link")
+    for link in links:
+        if link.get("rel", "alternate") == "alternate" and link.get("href"):
+            return link.get("href").strip()
+    return links[0].get("href", "").strip() if links else ""
+
+
+def parse_feed(content: bytes) -> FeedEntries:
+    """Lanza NotAFeed si `content` no es un feed o sitemap reconocible."""
+    parser = etree.XMLParser(recover=True, resolve_entities=False, no_network=True, huge_tree=False)
+    try:
+        root = etree.fromstring(content, parser)
+    except etree.XMLSyntaxError as e:
+        raise NotAFeed(f"Invalid XML: {e}") from e
+    if root is None:
+        raise NotAFeed("Empty document")
+
+    kind = _local(root.tag).lower()
+    if kind == "rss":
+        items = [item for channel in _children(root, "channel") for item in _children(channel, "item")]
+        entries = FeedEntries("rss", [_rss_link(item) for item in items])
+    elif kind == "rdf":
+        entries = FeedEntries("rss", [_rss_link(item) for item in _children(root, "item")])
+    elif kind == "feed":
+        entries = FeedEntries("atom", [_atom_link(entry) for entry in _children(root, "entry")])
+    elif kind == "urlset":
+        entries = FeedEntries("sitemap", [_text(url, "loc") for url in _children(root, "url")])
+    elif kind == "sitemapindex":
+        entries = FeedEntries("sitemapindex", sitemaps=[_text(s, "loc") for s in _children(root, "sitemap")])
+    else:
+        raise NotAFeed(f"Unsupported document <{kind}>")
+
+    entries.urls = [u for u in entries.urls if u.startswith(("http://", "https://"))]
+    entries.sitemaps = [u for u in entries.sitemaps if u.startswith(("http://", "https://"))]
+    return entries
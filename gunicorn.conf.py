@@ -0,0 +1,17 @@
+"""
+Configuración de gunicorn (se carga sola desde el directorio de trabajo).
+
+Con preload_app el master importa app.py una vez y ejecuta app.preload()
+antes de hacer fork: los workers heredan los módulos ya importados y
+arrancan en milisegundos en vez de repetir el import cada uno. Hilos,
+pools y clientes HTTP se siguen creando en cada worker tras el fork.
+"""
+import os
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    if preload_app:
+        import app
+        app.preload()
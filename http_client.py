@@ -0,0 +1,310 @@
+"""
+Cliente HTTP saliente compartido.
+
+Cada upstream (pexels, google, scrape_do, proxy) tiene su propia sesión
+con pools keep-alive por host, su timeout y su política de reintentos con
+backoff exponencial + jitter. Se llevan contadores de peticiones, errores,
+reintentos, latencia y reutilización de conexiones; latencia y errores
+también se exportan en /metrics.
+
+Si se configura un limitador (set_limiter) cada intento toma antes un token
+del cubo de su upstream, y un 429 vacía el cubo para todos los workers.
+
+arequest()/aget() son las versiones asíncronas (httpx, solo para el modo
+ASGI de asgi.py): misma política, contadores, métricas y limitador.
+"""
+import asyncio
+import random
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+
+def _httpx():
+    # Solo lo necesita el modo asíncrono: el worker de Flask no paga su import
+    try:
+        import httpx
+    except ImportError:
+        raise RuntimeError("El modo asíncrono necesita httpx (pip install httpx)") from None
+    return httpx
+
+
+@dataclass(frozen=True)
+class Policy:
+    connect_timeout: float = 5
+    read_timeout: float = 10
+    retries: int = 2
+    backoff: float = 0.3          # segundos, se dobla en cada intento
+    max_backoff: float = 5
+    retry_statuses: tuple = (429, 500, 502, 503, 504)
+    pool_connections: int = 10    # hosts distintos con pool propio
+    pool_maxsize: int = 20        # conexiones keep-alive por host
+
+
+POLICIES = {
+    "pexels": Policy(read_timeout=8, retries=2),
+    "google": Policy(read_timeout=8, retries=1),
+    # Un intento de scrape.do ya puede tardar un minuto: un solo reintento
+    "scrape_do": Policy(read_timeout=60, retries=1, backoff=1, retry_statuses=(429, 502, 503, 504)),
+    # Imágenes de cualquier dominio: más hosts, pocos reintentos
+    "proxy": Policy(read_timeout=15, retries=1, pool_connections=50, pool_maxsize=10),
+    # GET directo a la página de un artículo (revalidación sin scrape.do): sin reintentos
+    "origin": Policy(read_timeout=10, retries=0, pool_connections=50, pool_maxsize=4),
+    # Feeds RSS/Atom y sitemaps de /api/bulk_scrape (directos, sin scrape.do)
+    "feeds": Policy(read_timeout=15, retries=1),
+}
+DEFAULT_POLICY = Policy()
+
+UPSTREAM_SECONDS = metrics.histogram(
+    "sentient_upstream_request_duration_seconds", "Latencia de cada intento HTTP por upstream", ("upstream",)
+)
+UPSTREAM_ERRORS = metrics.counter(
+    "sentient_upstream_errors_total", "Intentos HTTP fallidos por upstream (5xx, 429 o excepción)",
+    ("upstream", "reason")
+)
+UPSTREAM_RETRIES = metrics.counter(
+    "sentient_upstream_retries_total", "Reintentos HTTP por upstream", ("upstream",)
+)
+
+
+class _Counters:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.statuses = {}
+
+
+_sessions = {}
+_counters = {}
+_lock = threading.Lock()
+_limiter = None
+# Un AsyncClient por event loop y upstream (no se pueden compartir entre loops)
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def set_limiter(limiter):
+    """RateLimiter (rate_limit.py) compartido por todos los upstreams."""
+    global _limiter
+    _limiter = limiter
+
+
+def _session(upstream: str) -> requests.Session:
+    with _lock:
+        session = _sessions.get(upstream)
+        if session is None:
+            policy = POLICIES.get(upstream, DEFAULT_POLICY)
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=policy.pool_connections,
+                                  pool_maxsize=policy.pool_maxsize, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[upstream] = session
+            _counters.setdefault(upstream, _Counters())
+        return session
+
+
+def _async_client(upstream: str):
+    httpx = _httpx()
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(upstream)
+        if client is None:
+            policy = POLICIES.get(upstream, DEFAULT_POLICY)
+            # Sin tope de conexiones: la concurrencia la limitan el limitador y los semáforos
+            client = clients[upstream] = httpx.AsyncClient(
+                timeout=httpx.Timeout(policy.read_timeout, connect=policy.connect_timeout),
+                limits=httpx.Limits(max_connections=None,
+                                    max_keepalive_connections=policy.pool_connections * policy.pool_maxsize),
+                follow_redirects=True,
+            )
+            _counters.setdefault(upstream, _Counters())
+        return client
+
+
+async def aclose_clients():
+    """Cierra los AsyncClient del loop actual (al apagar el servidor ASGI)."""
+    with _lock:
+        clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    for client in clients.values():
+        await client.aclose()
+
+
+def _retry_delay(policy: Policy, attempt: int, response=None) -> float:
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), policy.max_backoff)
+    base = min(policy.backoff * (2 ** attempt), policy.max_backoff)
+    # "Full jitter": evita que varios workers reintenten a la vez
+    return random.uniform(0, base)
+
+
+def request(upstream: str, method: str, url: str, **kwargs) -> requests.Response:
+    """
+    Como requests.request pero con la sesión, timeout y reintentos del
+    upstream. Lanza la última excepción si se agotan los reintentos; si el
+    último intento devuelve un status reintentable, se devuelve la respuesta.
+    """
+    policy = POLICIES.get(upstream, DEFAULT_POLICY)
+    session = _session(upstream)
+    counters = _counters[upstream]
+    kwargs.setdefault("timeout", (policy.connect_timeout, policy.read_timeout))
+
+    attempt = 0
+    while True:
+        if _limiter is not None:
+            # Puede lanzar RateLimited: el llamador decide cómo degradar
+            _limiter.acquire(upstream)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            _on_error(upstream, counters, time.perf_counter() - start, e)
+            if attempt >= policy.retries:
+                raise
+            delay = _retry_delay(policy, attempt)
+            print(f"⚠️ HTTP {upstream}: {type(e).__name__}, reintento en {delay:.2f}s")
+        else:
+            drain = _on_response(upstream, policy, counters, time.perf_counter() - start, response)
+            if drain and _limiter is not None:
+                _limiter.drain(upstream, drain)
+            if response.status_code not in policy.retry_statuses or attempt >= policy.retries:
+                return response
+            delay = _retry_delay(policy, attempt, response)
+            response.close()
+            print(f"⚠️ HTTP {upstream}: status {response.status_code}, reintento en {delay:.2f}s")
+
+        attempt += 1
+        _on_retry(upstream, counters)
+        time.sleep(delay)
+
+
+def get(upstream: str, url: str, **kwargs) -> requests.Response:
+    return request(upstream, "GET", url, **kwargs)
+
+
+async def arequest(upstream: str, method: str, url: str, stream: bool = False, **kwargs):
+    """
+    request() sobre httpx.AsyncClient. Devuelve un httpx.Response; con
+    stream=True el cuerpo no se lee (el llamador cierra con aclose()).
+    """
+    httpx = _httpx()
+    policy = POLICIES.get(upstream, DEFAULT_POLICY)
+    client = _async_client(upstream)
+    counters = _counters[upstream]
+
+    attempt = 0
+    while True:
+        if _limiter is not None:
+            await _limiter.acquire_async(upstream)
+        start = time.perf_counter()
+        try:
+            response = await client.send(client.build_request(method, url, **kwargs), stream=stream)
+        except httpx.TransportError as e:
+            _on_error(upstream, counters, time.perf_counter() - start, e)
+            if attempt >= policy.retries:
+                raise
+            delay = _retry_delay(policy, attempt)
+            print(f"⚠️ HTTP {upstream}: {type(e).__name__}, reintento en {delay:.2f}s")
+        else:
+            drain = _on_response(upstream, policy, counters, time.perf_counter() - start, response)
+            if drain and _limiter is not None:
+                await asyncio.to_thread(_limiter.drain, upstream, drain)
+            if response.status_code not in policy.retry_statuses or attempt >= policy.retries:
+                return response
+            delay = _retry_delay(policy, attempt, response)
+            await response.aclose()
+            print(f"⚠️ HTTP {upstream}: status {response.status_code}, reintento en {delay:.2f}s")
+
+        attempt += 1
+        _on_retry(upstream, counters)
+        await asyncio.sleep(delay)
+
+
+async def aget(upstream: str, url: str, **kwargs):
+    return await arequest(upstream, "GET", url, **kwargs)
+
+
+def _on_error(upstream: str, counters: "_Counters", elapsed: float, error: Exception):
+    _record(counters, elapsed, error=True)
+    UPSTREAM_SECONDS.observe(elapsed, upstream=upstream)
+    UPSTREAM_ERRORS.inc(upstream=upstream, reason=type(error).__name__)
+
+
+def _on_response(upstream: str, policy: Policy, counters: "_Counters", elapsed: float, response) -> float:
+    """Registra el intento. Devuelve los segundos a vaciar el cubo si fue un 429 (0 si no)."""
+    status = response.status_code
+    _record(counters, elapsed, status=status, error=status >= 500)
+    UPSTREAM_SECONDS.observe(elapsed, upstream=upstream)
+    if status >= 500 or status == 429:
+        UPSTREAM_ERRORS.inc(upstream=upstream, reason=str(status))
+    if status != 429:
+        return 0.0
+    retry_after = response.headers.get("Retry-After", "")
+    return float(retry_after) if retry_after.isdigit() else policy.max_backoff
+
+
+def _on_retry(upstream: str, counters: "_Counters"):
+    with _lock:
+        counters.retries += 1
+    UPSTREAM_RETRIES.inc(upstream=upstream)
+
+
+def _record(counters: _Counters, elapsed: float, status: int = None, error: bool = False):
+    with _lock:
+        counters.requests += 1
+        counters.latency_total += elapsed
+        counters.latency_max = max(counters.latency_max, elapsed)
+        if error:
+            counters.errors += 1
+        if status is not None:
+            counters.statuses[status] = counters.statuses.get(status, 0) + 1
+
+
+def _pool_stats(session: requests.Session) -> dict:
+    """Conexiones abiertas vs peticiones servidas por los pools de urllib3."""
+    connections = served = 0
+    seen = set()
+    for adapter in session.adapters.values():
+        if id(adapter) in seen:
+            continue
+        seen.add(id(adapter))
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                served += pool.num_requests
+    return {
+        "connections_opened": connections,
+        "requests_served": served,
+        "connections_reused": max(served - connections, 0),
+    }
+
+
+def stats() -> dict:
+    """Contadores por upstream (para /metrics o depuración)."""
+    out = {}
+    with _lock:
+        snapshot = {name: (_sessions.get(name), c) for name, c in _counters.items()}
+    for name, (session, c) in snapshot.items():
+        out[name] = {
+            "requests": c.requests,
+            "errors": c.errors,
+            "retries": c.retries,
+            "latency_avg": (c.latency_total / c.requests) if c.requests else 0.0,
+            "latency_max": c.latency_max,
+            "statuses": dict(c.statuses),
+            # Los upstreams que solo se usan en modo asíncrono no tienen sesión requests
+            **(_pool_stats(session) if session is not None else {}),
+        }
+    return out
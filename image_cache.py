@@ -0,0 +1,441 @@
+"""
+Caché en disco para /api/proxy_image.
+
+Los bytes se guardan direccionados por contenido (sha256 → blobs/ab/abcd...),
+así que la misma imagen servida desde dos URLs ocupa un solo archivo y el
+hash sirve directamente de ETag. Un índice SQLite mapea URL (+ variante
+w/h/format/fit) → blob, con desalojo LRU por tamaño total. Las descargas
+concurrentes de la misma URL se coalescen (hilos y procesos) y los
+redimensionados / WebP se hacen con Pillow en un pool de procesos.
+
+PrefetchBatch calienta en segundo plano las imágenes de un resultado
+(p. ej. de un scrape) antes de que el navegador las pida.
+
+fetch_async() es la variante del modo ASGI: la descarga va por httpx y el
+resto (SQLite, disco, locks) en hilos, sin bloquear el event loop.
+"""
+import asyncio
+import fcntl
+import hashlib
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+import http_client
+import metrics
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "jpeg": ("JPEG", "image/jpeg"),
+    "png": ("PNG", "image/png"),
+}
+# contain: cabe dentro de w x h; cover: cubre w x h (como background-size: cover)
+FITS = ("contain", "cover")
+MAX_DIMENSION = 4000
+MAX_SOURCE_BYTES = 25 * 1024 * 1024
+
+
+@dataclass
+class CachedImage:
+    path: str
+    digest: str
+    content_type: str
+    size: int
+
+
+PREFETCH_EVENTS = metrics.counter(
+    "sentient_image_prefetch_total", "Imágenes pre-cargadas en la caché del proxy por resultado", ("outcome",)
+)
+PREFETCH_BYTES = metrics.counter(
+    "sentient_image_prefetch_bytes_total", "Bytes descargados por la pre-carga de imágenes"
+)
+
+
+def _transform(data: bytes, width: int, height: int, fmt: str, fit: str = None):
+    """Redimensiona (sin agrandar, manteniendo proporción) y recodifica. Corre en el pool."""
+    from PIL import Image
+
+    img = Image.open(io.BytesIO(data))
+    img.load()
+    if fit == "cover" and width and height:
+        scale = max(width / img.width, height / img.height)
+        if scale < 1:
+            img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+    elif width or height:
+        img.thumbnail((width or MAX_DIMENSION, height or MAX_DIMENSION), Image.LANCZOS)
+
+    pil_format, content_type = FORMATS.get(fmt) or (img.format or "JPEG", Image.MIME.get(img.format, "image/jpeg"))
+    if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    out = io.BytesIO()
+    save_kwargs = {"quality": 82} if pil_format in ("JPEG", "WEBP") else {}
+    img.save(out, format=pil_format, **save_kwargs)
+    return out.getvalue(), content_type
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class ImageCache:
+
+    def __init__(self, directory: str, max_bytes: int, workers: int = 2, fetch_headers: dict = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.fetch_headers = fetch_headers or {}
+        self._local = threading.local()
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._pool = None
+        self._pool_guard = threading.Lock()
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "locks"), exist_ok=True)
+        self._init_schema()
+
+    # ----------------------------------------------------------------
+    # Índice
+    # ----------------------------------------------------------------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(os.path.join(self.directory, "index.db"), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Cierra la conexión de este hilo."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS images (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                content_type TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_accessed ON images (accessed)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_images_digest ON images (digest)")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "blobs", digest[:2], digest)
+
+    @staticmethod
+    def variant_key(url: str, width: int = None, height: int = None, fmt: str = None, fit: str = None) -> str:
+        # 'contain' es el comportamiento por defecto y no cambia la clave
+        suffix = "|cover" if fit == "cover" and width and height else ""
+        return hashlib.sha256(f"{url}|{width or ''}|{height or ''}|{fmt or ''}{suffix}".encode()).hexdigest()
+
+    def lookup(self, key: str):
+        row = self._conn().execute(
+            "SELECT digest, content_type, size FROM images WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        path = self._blob_path(row[0])
+        if not os.path.exists(path):
+            self._conn().execute("DELETE FROM images WHERE key = ?", (key,))
+            return None
+        self._conn().execute("UPDATE images SET accessed = ? WHERE key = ?", (time.time(), key))
+        return CachedImage(path, row[0], row[1], row[2])
+
+    def contains(self, url: str, width: int = None, height: int = None, fmt: str = None, fit: str = None) -> bool:
+        row = self._conn().execute(
+            "SELECT 1 FROM images WHERE key = ?", (self.variant_key(url, width, height, fmt, fit),)
+        ).fetchone()
+        return row is not None
+
+    def _store(self, key: str, url: str, data: bytes, content_type: str) -> CachedImage:
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        now = time.time()
+        self._conn().execute(
+            """
+            INSERT OR REPLACE INTO images (key, url, digest, content_type, size, created, accessed)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (key, url, digest, content_type, len(data), now, now)
+        )
+        self.evict()
+        return CachedImage(path, digest, content_type, len(data))
+
+    def put(self, key: str, url: str, data: bytes, content_type: str) -> CachedImage:
+        """Guarda bytes generados en el servidor (p. ej. un render) bajo `key`."""
+        return self._store(key, url, data, content_type)
+
+    def total_bytes(self) -> int:
+        row = self._conn().execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT digest, MAX(size) AS size FROM images GROUP BY digest)"
+        ).fetchone()
+        return row[0]
+
+    def evict(self) -> int:
+        """Desaloja por LRU hasta quedar por debajo del 90% del tope."""
+        total = self.total_bytes()
+        if total <= self.max_bytes:
+            return 0
+        target = int(self.max_bytes * 0.9)
+        conn = self._conn()
+        removed = 0
+        for key, digest, size in conn.execute(
+            "SELECT key, digest, size FROM images ORDER BY accessed ASC"
+        ).fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM images WHERE key = ?", (key,))
+            removed += 1
+            still_used = conn.execute("SELECT 1 FROM images WHERE digest = ? LIMIT 1", (digest,)).fetchone()
+            if not still_used:
+                total -= size
+                try:
+                    os.remove(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    # ----------------------------------------------------------------
+    # Coalescencia
+    # ----------------------------------------------------------------
+    @contextmanager
+    def _key_lock(self, key: str):
+        """
+        Un solo productor por clave: lock de hilo + flock entre procesos.
+        Los locks se reparten en 65536 cubetas (prefijo del hash) para no
+        crear un archivo por URL.
+        """
+        handle = self._acquire_key(key)
+        try:
+            yield
+        finally:
+            self._release_key(handle)
+
+    @asynccontextmanager
+    async def _key_lock_async(self, key: str):
+        # threading.Lock y flock se pueden soltar desde otro hilo
+        handle = await asyncio.to_thread(self._acquire_key, key)
+        try:
+            yield
+        finally:
+            self._release_key(handle)
+
+    def _acquire_key(self, key: str):
+        bucket = key[:4]
+        with self._locks_guard:
+            lock = self._locks.setdefault(bucket, threading.Lock())
+        lock.acquire()
+        try:
+            lock_file = open(os.path.join(self.directory, "locks", bucket + ".lock"), "w")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except BaseException:
+            lock.release()
+            raise
+        return lock, lock_file
+
+    @staticmethod
+    def _release_key(handle):
+        lock, lock_file = handle
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        finally:
+            lock.release()
+
+    # ----------------------------------------------------------------
+    # Obtención
+    # ----------------------------------------------------------------
+    def fetch(self, url: str, width: int = None, height: int = None, fmt: str = None,
+              fit: str = None) -> CachedImage:
+        """Devuelve la imagen (o su variante) desde disco, descargándola si falta."""
+        key = self.variant_key(url, width, height, fmt, fit)
+        hit = self.lookup(key)
+        if hit:
+            return hit
+
+        if width or height or fmt:
+            original = self.fetch(url)
+            with self._key_lock(key):
+                hit = self.lookup(key)
+                if hit:
+                    return hit
+                with open(original.path, "rb") as f:
+                    source = f.read()
+                data, content_type = self._executor().submit(_transform, source, width, height, fmt, fit).result()
+                return self._store(key, url, data, content_type)
+
+        with self._key_lock(key):
+            # Otro hilo/proceso pudo haberla descargado mientras esperábamos
+            hit = self.lookup(key)
+            if hit:
+                return hit
+            data, content_type = self._download(url)
+            return self._store(key, url, data, content_type)
+
+    async def fetch_async(self, url: str, width: int = None, height: int = None, fmt: str = None,
+                          fit: str = None) -> CachedImage:
+        """fetch() para el modo ASGI."""
+        key = self.variant_key(url, width, height, fmt, fit)
+        hit = await asyncio.to_thread(self.lookup, key)
+        if hit:
+            return hit
+
+        if width or height or fmt:
+            original = await self.fetch_async(url)
+            async with self._key_lock_async(key):
+                hit = await asyncio.to_thread(self.lookup, key)
+                if hit:
+                    return hit
+                source = await asyncio.to_thread(_read, original.path)
+                data, content_type = await asyncio.wrap_future(
+                    self._executor().submit(_transform, source, width, height, fmt, fit)
+                )
+                return await asyncio.to_thread(self._store, key, url, data, content_type)
+
+        async with self._key_lock_async(key):
+            hit = await asyncio.to_thread(self.lookup, key)
+            if hit:
+                return hit
+            data, content_type = await self._download_async(url)
+            return await asyncio.to_thread(self._store, key, url, data, content_type)
+
+    async def _download_async(self, url: str):
+        r = await http_client.aget('proxy', url, headers=self.fetch_headers, stream=True)
+        try:
+            r.raise_for_status()
+            content_type = r.headers.get('Content-Type', 'image/jpeg')
+            buf = io.BytesIO()
+            async for chunk in r.aiter_bytes(chunk_size=64 * 1024):
+                buf.write(chunk)
+                if buf.tell() > MAX_SOURCE_BYTES:
+                    raise ValueError("Upstream image too large")
+            return buf.getvalue(), content_type
+        finally:
+            await r.aclose()
+
+    def _download(self, url: str):
+        r = http_client.get('proxy', url, headers=self.fetch_headers, stream=True)
+        try:
+            r.raise_for_status()
+            content_type = r.headers.get('Content-Type', 'image/jpeg')
+            buf = io.BytesIO()
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                buf.write(chunk)
+                if buf.tell() > MAX_SOURCE_BYTES:
+                    raise ValueError("Upstream image too large")
+            return buf.getvalue(), content_type
+        finally:
+            r.close()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_guard:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+
+class PrefetchBatch:
+    """
+    Pre-carga de las imágenes de un resultado en la variante que se va a
+    pedir. La concurrencia total la acota el `executor` compartido y la de
+    cada lote `max_inflight`; `budget` son los bytes que el lote puede
+    descargar (se comprueba antes de cada descarga, así que como mucho se
+    pasa en lo que ya estaba en curso).
+    """
+
+    def __init__(self, cache: ImageCache, executor, budget: int, width: int = None, height: int = None,
+                 fmt: str = None, fit: str = None, max_inflight: int = 2):
+        self.cache = cache
+        self.executor = executor
+        self.budget = budget
+        self.variant = (width, height, fmt, fit)
+        self.max_inflight = max_inflight
+        self.spent = 0
+        self.outcomes = Counter()
+        self._seen = set()
+        self._pending = deque()
+        self._inflight = 0
+        self._lock = threading.Lock()
+
+    def add(self, url: str) -> bool:
+        if not url or urlparse(url).scheme not in ("http", "https"):
+            return False
+        with self._lock:
+            if url in self._seen:
+                return False
+            self._seen.add(url)
+            self._pending.append(url)
+        self._pump()
+        return True
+
+    def add_all(self, urls) -> int:
+        return sum(self.add(url) for url in urls)
+
+    def _pump(self):
+        while True:
+            with self._lock:
+                if not self._pending or self._inflight >= self.max_inflight:
+                    return
+                url = self._pending.popleft()
+                self._inflight += 1
+            self.executor.submit(self._run, url)
+
+    def _run(self, url: str):
+        try:
+            self._prefetch(url)
+        finally:
+            with self._lock:
+                self._inflight -= 1
+            self._pump()
+
+    def _outcome(self, outcome: str, size: int = 0):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.spent += size
+        PREFETCH_EVENTS.inc(outcome=outcome)
+        if size:
+            PREFETCH_BYTES.inc(size)
+
+    def _prefetch(self, url: str):
+        try:
+            if self.cache.contains(url, *self.variant):
+                return self._outcome("cached")
+            with self._lock:
+                over_budget = self.spent >= self.budget
+            if over_budget:
+                return self._outcome("over_budget")
+            had_original = self.cache.contains(url)
+            variant = self.cache.fetch(url, *self.variant)
+            size = variant.size
+            if not had_original and any(self.variant):
+                original = self.cache.lookup(self.cache.variant_key(url))
+                size += original.size if original else 0
+            self._outcome("fetched", size)
+        except Exception as e:
+            print(f"⚠️ Pre-carga de imagen falló ({url[:80]}): {e}")
+            self._outcome("error")
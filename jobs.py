@@ -0,0 +1,243 @@
+"""
+Cola de trabajos persistente (SQLite) con un pool de hilos local.
+
+Cada proceso (worker de gunicorn) arranca sus propios hilos consumidores
+la primera vez que se usa la cola; todos leen la misma tabla, así que un
+trabajo encolado desde un worker puede ejecutarlo cualquier otro. Los
+trabajos sobreviven a reinicios y los que quedan 'running' de un proceso
+muerto se reencolan pasado `stale_after`.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED = (DONE, FAILED, CANCELLED)
+
+
+class JobCancelled(Exception):
+    """Se lanza desde Job.check() cuando el trabajo fue cancelado."""
+
+
+class Job:
+    """Vista que recibe el handler: id, payload y cancelación cooperativa."""
+
+    def __init__(self, queue: "JobQueue", job_id: str, kind: str, payload: dict):
+        self.queue = queue
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+
+    def check(self):
+        """Llamar entre etapas: aborta si alguien canceló el trabajo."""
+        if self.queue.status(self.id) == CANCELLED:
+            raise JobCancelled(self.id)
+
+    def progress(self, stage: str):
+        self.check()
+        self.queue._conn().execute(
+            "UPDATE jobs SET stage = ?, heartbeat = ? WHERE id = ?", (stage, time.time(), self.id)
+        )
+
+
+class JobQueue:
+
+    def __init__(self, path: str, workers: int = 4, poll_interval: float = 0.5,
+                 stale_after: float = 15 * 60, keep_for: float = 60 * 60 * 24):
+        self.path = path
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.keep_for = keep_for
+        self.handlers = {}
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._started_pid = None
+        self._start_lock = threading.Lock()
+        self._init_schema()
+
+    # ----------------------------------------------------------------
+    # Conexión / esquema
+    # ----------------------------------------------------------------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Cierra la conexión del hilo actual; la siguiente llamada abre otra."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                heartbeat REAL,
+                finished REAL
+            )
+        """)
+        self._conn().execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created)")
+
+    # ----------------------------------------------------------------
+    # API
+    # ----------------------------------------------------------------
+    def register(self, kind: str, handler):
+        """`handler(job) -> result` (JSON serializable)."""
+        self.handlers[kind] = handler
+
+    def submit(self, kind: str, payload: dict) -> str:
+        if kind not in self.handlers:
+            raise ValueError(f"No handler registered for job kind '{kind}'")
+        self.ensure_started()
+        job_id = uuid.uuid4().hex
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, payload, status, created) VALUES (?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), QUEUED, time.time())
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str):
+        row = self._conn().execute(
+            """
+            SELECT id, kind, status, stage, result, error, created, started, finished
+            FROM jobs WHERE id = ?
+            """,
+            (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "stage": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "created": row[6],
+            "started": row[7],
+            "finished": row[8],
+        }
+
+    def status(self, job_id: str):
+        row = self._conn().execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def cancel(self, job_id: str) -> bool:
+        """Marca el trabajo como cancelado si aún no terminó."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET status = ?, finished = ? WHERE id = ? AND status IN (?, ?)",
+            (CANCELLED, time.time(), job_id, QUEUED, RUNNING)
+        )
+        return cur.rowcount > 0
+
+    def depth(self) -> dict:
+        rows = self._conn().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    # ----------------------------------------------------------------
+    # Consumidores
+    # ----------------------------------------------------------------
+    def ensure_started(self):
+        """Arranca los hilos en este proceso (una vez por pid, seguro tras fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._start_lock:
+            if self._started_pid == pid:
+                return
+            self._started_pid = pid
+            for i in range(self.workers):
+                threading.Thread(target=self._worker_loop, name=f"job-worker-{i}", daemon=True).start()
+
+    def _claim(self):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Reencolar trabajos de procesos que murieron a mitad
+            conn.execute(
+                """
+                UPDATE jobs SET status = ?, started = NULL
+                WHERE status = ? AND COALESCE(heartbeat, started) < ?
+                """,
+                (QUEUED, RUNNING, now - self.stale_after)
+            )
+            row = conn.execute(
+                "SELECT id, kind, payload FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                (QUEUED,)
+            ).fetchone()
+            if row:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, started = ?, heartbeat = ? WHERE id = ?",
+                    (RUNNING, now, now, row[0])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id: str, status: str, result=None, error: str = None):
+        # No pisar una cancelación que llegó mientras corría
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ? WHERE id = ? AND status = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id, RUNNING)
+        )
+
+    def _purge(self):
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND finished < ?",
+            (*FINISHED, time.time() - self.keep_for)
+        )
+
+    def _worker_loop(self):
+        last_purge = 0
+        while True:
+            try:
+                row = self._claim()
+            except Exception as e:
+                print(f"⚠️ Cola de trabajos: error al reclamar: {e}")
+                row = None
+
+            if row is None:
+                if time.time() - last_purge > 600:
+                    last_purge = time.time()
+                    try:
+                        self._purge()
+                    except Exception:
+                        pass
+                with self._wakeup:
+                    self._wakeup.wait(self.poll_interval)
+                continue
+
+            job_id, kind, payload = row
+            job = Job(self, job_id, kind, json.loads(payload))
+            try:
+                result = self.handlers[kind](job)
+                self._finish(job_id, DONE, result=result)
+            except JobCancelled:
+                print(f"🛑 Trabajo {job_id} cancelado")
+            except Exception as e:
+                print(f"⚠️ Trabajo {job_id} falló: {e}")
+                self._finish(job_id, FAILED, error=str(e))
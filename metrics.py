@@ -0,0 +1,351 @@
+"""
+Métricas en formato de texto de Prometheus, sin dependencias nuevas.
+
+Cada proceso acumula en memoria contadores, gauges e histogramas y cada
+pocos segundos vuelca una instantánea a SQLite (el mismo archivo que la
+caché). /metrics publica la del proceso que atiende y suma las de todos
+los workers, igual que el modo multiproceso de prometheus_client: los
+contadores e histogramas de workers ya muertos se siguen sumando (no hay
+"reinicios" falsos) y los gauges solo cuentan procesos vivos.
+
+timed(stage) mide una etapa en el histograma STAGE_SECONDS y además la
+anota en la petición en curso (contextvar) para el header Server-Timing.
+"""
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+COUNTER, GAUGE, HISTOGRAM = "counter", "gauge", "histogram"
+
+
+# --------------------------------------------------------------------
+# Tipos de métrica (por proceso)
+# --------------------------------------------------------------------
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labels):
+            raise ValueError(f"{self.name}: expected labels {self.labels}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = [[list(k), v if not isinstance(v, list) else list(v)] for k, v in self._values.items()]
+        return {"kind": self.kind, "help": self.help, "labels": list(self.labels), "values": values}
+
+
+class Counter(Metric):
+    kind = COUNTER
+
+    def inc(self, n: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+
+class Gauge(Metric):
+    kind = GAUGE
+
+    def inc(self, n: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def dec(self, n: float = 1, **labels):
+        self.inc(-n, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """Guarda por serie [cubetas acumuladas..., suma, cuenta]."""
+    kind = HISTOGRAM
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def snapshot(self) -> dict:
+        return dict(super().snapshot(), buckets=list(self.buckets))
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _add(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} already registered as {metric.kind}")
+            return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self._add(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self._add(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram, name, help, labels, buckets)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {m.name: m.snapshot() for m in metrics}
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+# --------------------------------------------------------------------
+# Agregación entre workers
+# --------------------------------------------------------------------
+class SnapshotStore:
+    """
+    Instantáneas por proceso en SQLite. `interval`: cada cuánto vuelca cada
+    proceso; `live_for`: antigüedad máxima para sumar gauges; `keep_for`:
+    a partir de ahí se borran las instantáneas de procesos desaparecidos.
+    """
+
+    def __init__(self, path: str, registry: Registry = REGISTRY, interval: float = 5,
+                 live_for: float = 60, keep_for: float = 60 * 60 * 24 * 7):
+        self.path = path
+        self.registry = registry
+        self.interval = interval
+        self.live_for = live_for
+        self.keep_for = keep_for
+        self._local = threading.local()
+        self._started_pid = None
+        self._proc = None
+        self._start_lock = threading.Lock()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Cierra la conexión de este hilo; se reabre al volver a usarla."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS metrics_snapshots (
+                proc TEXT PRIMARY KEY,
+                pid INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                data TEXT NOT NULL
+            )
+        """)
+
+    def ensure_started(self):
+        """Arranca el volcado periódico en este proceso (una vez por pid, seguro tras fork)."""
+        pid = os.getpid()
+        if self._started_pid == pid:
+            return
+        with self._start_lock:
+            if self._started_pid == pid:
+                return
+            self._started_pid = pid
+            # El pid se puede reutilizar tras reinicios: el id incluye el arranque
+            self._proc = f"{pid}-{time.time():.0f}"
+            threading.Thread(target=self._publish_loop, name="metrics-publish", daemon=True).start()
+
+    def _publish_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.publish()
+            except Exception as e:
+                print(f"⚠️ No se pudieron publicar las métricas: {e}")
+
+    def publish(self):
+        self.ensure_started()
+        self._conn().execute(
+            "INSERT OR REPLACE INTO metrics_snapshots (proc, pid, ts, data) VALUES (?, ?, ?, ?)",
+            (self._proc, os.getpid(), time.time(), json.dumps(self.registry.snapshot()))
+        )
+
+    def collect(self) -> dict:
+        """Publica la instantánea propia y devuelve la suma de todas."""
+        self.publish()
+        conn = self._conn()
+        now = time.time()
+        conn.execute("DELETE FROM metrics_snapshots WHERE ts < ?", (now - self.keep_for,))
+        rows = conn.execute("SELECT ts, data FROM metrics_snapshots").fetchall()
+
+        merged = {}
+        for ts, data in rows:
+            live = now - ts < self.live_for
+            for name, metric in json.loads(data).items():
+                if metric["kind"] == GAUGE and not live:
+                    continue
+                target = merged.setdefault(name, dict(metric, values={}))
+                for labels, value in metric["values"]:
+                    key = tuple(labels)
+                    if isinstance(value, list):
+                        prev = target["values"].get(key) or [0] * len(value)
+                        target["values"][key] = [a + b for a, b in zip(prev, value)]
+                    else:
+                        target["values"][key] = target["values"].get(key, 0) + value
+        return merged
+
+
+# --------------------------------------------------------------------
+# Exposición
+# --------------------------------------------------------------------
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: dict = None) -> str:
+    pairs = list(zip(names, values)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def family(help: str, values: dict, labels: tuple = (), kind: str = GAUGE) -> dict:
+    """
+    Familia ya agregada para render(): estado compartido que se lee en el
+    momento (p. ej. de SQLite) y que no debe sumarse por worker.
+    `values` = {(valores de etiquetas...): valor}.
+    """
+    return {"kind": kind, "help": help, "labels": list(labels), "values": dict(values)}
+
+
+def render(merged: dict) -> str:
+    """Texto de exposición de Prometheus (versión 0.0.4)."""
+    lines = []
+    for name in sorted(merged):
+        metric = merged[name]
+        values = metric["values"]
+        if isinstance(values, list):
+            values = {tuple(k): v for k, v in values}
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['kind']}")
+        names = metric["labels"]
+        for key in sorted(values):
+            value = values[key]
+            if metric["kind"] == HISTOGRAM:
+                for bound, count in zip(metric["buckets"], value):
+                    lines.append(f"{name}_bucket{_labels(names, key, {'le': _number(bound)})} {_number(count)}")
+                lines.append(f"{name}_bucket{_labels(names, key, {'le': '+Inf'})} {_number(value[-1])}")
+                lines.append(f"{name}_sum{_labels(names, key)} {value[-2]!r}")
+                lines.append(f"{name}_count{_labels(names, key)} {_number(value[-1])}")
+            else:
+                lines.append(f"{name}{_labels(names, key)} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# --------------------------------------------------------------------
+# Etapas y Server-Timing
+# --------------------------------------------------------------------
+STAGE_SECONDS = histogram(
+    "sentient_stage_duration_seconds", "Duración de cada etapa del pipeline", ("stage",)
+)
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request():
+    """Empieza a recoger las etapas de la petición en curso (Server-Timing)."""
+    _request_timings.set([])
+
+
+def end_request():
+    _request_timings.set(None)
+
+
+def request_timings() -> list:
+    return _request_timings.get() or []
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((stage, elapsed))
+
+
+def with_context(fn):
+    """
+    Envuelve `fn` para que corra en una copia del contexto actual. Los
+    executors no propagan contextvars; sin esto las etapas que corren en
+    otro hilo no aparecerían en el Server-Timing de la petición.
+    """
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def server_timing(timings: list, total: float = None) -> str:
+    """'stage;dur=ms' por etapa (sumando repeticiones) en orden de aparición."""
+    totals, counts = {}, {}
+    for stage, elapsed in timings:
+        totals[stage] = totals.get(stage, 0) + elapsed
+        counts[stage] = counts.get(stage, 0) + 1
+    parts = []
+    for stage, elapsed in totals.items():
+        part = f"{stage};dur={elapsed * 1000:.1f}"
+        if counts[stage] > 1:
+            part += f';desc="x{counts[stage]}"'
+        parts.append(part)
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
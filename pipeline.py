@@ -0,0 +1,69 @@
+"""
+Ejecución de etapas como grafo de dependencias con paralelismo acotado.
+
+Cada etapa declara de qué etapas depende; en cuanto sus dependencias
+terminan se envía al executor, de modo que las ramas independientes
+(p. ej. variantes IA y carrusel IA) corren a la vez y el tiempo total es
+el de la rama más lenta, no la suma de todas.
+"""
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, wait
+
+
+class DependencyFailed(Exception):
+    """Una etapa no se ejecutó porque falló alguna de sus dependencias."""
+
+
+def run_graph(stages: dict, executor, on_done=None):
+    """
+    Ejecuta `stages` = {nombre: (deps, fn)} sobre `executor`.
+
+    `fn` recibe como kwargs los resultados de sus dependencias. Si se pasa
+    `on_done(nombre, resultado, error)` se llama en el hilo del llamador a
+    medida que cada etapa termina. Devuelve (results, errors).
+    """
+    for name, (deps, _) in stages.items():
+        missing = [d for d in deps if d not in stages]
+        if missing:
+            raise ValueError(f"Stage '{name}' depends on unknown stages: {missing}")
+
+    results, errors = {}, {}
+    pending = dict(stages)
+    running = {}
+
+    def settle(name, value=None, error=None):
+        if error is None:
+            results[name] = value
+        else:
+            errors[name] = error
+        if on_done:
+            on_done(name, value, error)
+
+    while pending or running:
+        # Lanzar todo lo que ya tiene sus dependencias resueltas
+        for name, (deps, fn) in list(pending.items()):
+            failed = [d for d in deps if d in errors]
+            if failed:
+                del pending[name]
+                settle(name, error=DependencyFailed(f"{name}: dependency failed ({', '.join(failed)})"))
+            elif all(d in results for d in deps):
+                del pending[name]
+                kwargs = {d: results[d] for d in deps}
+                # Cada etapa hereda los contextvars del llamador (p. ej. las métricas de la petición)
+                running[executor.submit(contextvars.copy_context().run, fn, **kwargs)] = name
+
+        if not running:
+            if pending:
+                # Solo puede pasar con ciclos
+                raise ValueError(f"Dependency cycle between stages: {sorted(pending)}")
+            break
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for fut in done:
+            name = running.pop(fut)
+            try:
+                settle(name, value=fut.result())
+            except Exception as e:
+                settle(name, error=e)
+
+    return results, errors
@@ -0,0 +1,175 @@
+"""
+Compactación del texto del artículo antes de mandarlo a la IA.
+
+En lugar de cortar los primeros N caracteres (que suelen arrastrar
+boilerplate y dejar fuera lo importante), se parte el texto en frases, se
+puntúan con un ranking extractivo barato (frecuencia de términos, solapamiento
+con el título, posición, cifras) y se eligen las mejores hasta un
+presupuesto de tokens, conservando el orden original. Si así no se llena
+ni la mitad del presupuesto (un párrafo enorme que no se deja partir en
+frases, texto sin puntuación, CJK...) se manda el principio del texto
+cortado al presupuesto, como antes.
+
+Los tokens se cuentan con tiktoken si está instalado; si no, con la
+aproximación habitual de ~4 caracteres por token.
+"""
+import re
+from collections import Counter
+from dataclasses import dataclass
+
+try:
+    import tiktoken
+except Exception:
+    tiktoken = None
+
+CHARS_PER_TOKEN = 4
+MIN_SENTENCE_CHARS = 25
+# Frases con más solapamiento de términos que esto con una ya elegida se saltan
+MAX_OVERLAP = 0.6
+# Por debajo de esta fracción del presupuesto se usa el principio del texto
+MIN_FILL = 0.5
+
+STOP_WORDS = frozenset("""
+a an the and or but if so of in on at by for with from to into about as is are was were be been being
+it its this that these those he she they we you i his her their our your them him has have had do does did
+not no than then there here what which who whom when where why how all any each more most other some such
+will would can could should may might must also just over after before under again said says told
+el la los las un una unos unas y o pero de del en con por para a al que se su sus es son fue era
+como más ya lo le les este esta estos estas ese esa""".split())
+
+BOILERPLATE = re.compile(
+    r"subscribe|newsletter|sign up|log in|cookie|all rights reserved|click here|read more|"
+    r"follow us|advertisement|share this|related:|suscríbete|publicidad|lee también",
+    re.IGNORECASE
+)
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?…])[\"'”’)]?\s+(?=[\"'“‘(¿¡]?[A-ZÁÉÍÓÚÑ0-9])")
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+
+_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if not text:
+        return 0
+    if tiktoken is not None:
+        try:
+            if _encoding is None:
+                _encoding = tiktoken.get_encoding("o200k_base")
+            return len(_encoding.encode(text))
+        except Exception:
+            pass
+    return max(1, round(len(text) / CHARS_PER_TOKEN))
+
+
+def truncate_tokens(text: str, budget: int) -> str:
+    """Principio de `text` que cabe en `budget` tokens (cortado en un espacio si hay uno cerca)."""
+    global _encoding
+    if count_tokens(text) <= budget:
+        return text
+    prefix = None
+    if tiktoken is not None:
+        try:
+            if _encoding is None:
+                _encoding = tiktoken.get_encoding("o200k_base")
+            prefix = _encoding.decode(_encoding.encode(text)[:budget])
+        except Exception:
+            prefix = None
+    if prefix is None:
+        prefix = text[:budget * CHARS_PER_TOKEN]
+    cut = prefix.rfind(" ")
+    if cut > len(prefix) * 0.8:
+        prefix = prefix[:cut]
+    return prefix.rstrip()
+
+
+@dataclass
+class CompactContext:
+    text: str
+    tokens: int
+    source_tokens: int
+    sentences_kept: int
+    sentences_total: int
+
+    @property
+    def saved_tokens(self) -> int:
+        return max(self.source_tokens - self.tokens, 0)
+
+
+def split_sentences(text: str) -> list:
+    sentences = []
+    for paragraph in re.split(r"\n\s*\n|\n", text or ""):
+        paragraph = re.sub(r"\s+", " ", paragraph).strip()
+        if paragraph:
+            sentences.extend(s.strip() for s in _SENTENCE_SPLIT.split(paragraph) if s.strip())
+    return sentences
+
+
+def _terms(text: str) -> list:
+    return [w for w in (m.lower() for m in _WORD.findall(text)) if len(w) > 2 and w not in STOP_WORDS]
+
+
+def rank_sentences(title: str, sentences: list) -> list:
+    """Puntuación 0..1 por frase (misma longitud que `sentences`)."""
+    terms = [_terms(s) for s in sentences]
+    freq = Counter(w for ts in terms for w in set(ts))
+    top = max(freq.values(), default=1)
+    title_terms = set(_terms(title or ""))
+    n = len(sentences)
+
+    scores = []
+    for i, (sentence, ts) in enumerate(zip(sentences, terms)):
+        if len(sentence) < MIN_SENTENCE_CHARS or BOILERPLATE.search(sentence) or not ts:
+            scores.append(0.0)
+            continue
+        unique = set(ts)
+        # Términos que se repiten en el artículo = tema central
+        density = sum(freq[w] for w in unique) / (top * len(unique))
+        overlap = len(unique & title_terms) / len(title_terms) if title_terms else 0.0
+        position = 1.0 - i / n
+        figures = 0.1 if re.search(r"\d", sentence) else 0.0
+        scores.append(0.4 * density + 0.3 * overlap + 0.2 * position + figures)
+    return scores
+
+
+def compact(title: str, text: str, budget: int) -> CompactContext:
+    """
+    Las frases más informativas de `text` que caben en `budget` tokens, en
+    su orden original. Si el texto ya cabe se devuelve tal cual.
+    """
+    text = (text or "").strip()
+    source_tokens = count_tokens(text)
+    sentences = split_sentences(text)
+    if source_tokens <= budget:
+        return CompactContext(text, source_tokens, source_tokens, len(sentences), len(sentences))
+
+    scores = rank_sentences(title, sentences)
+    terms = [set(_terms(s)) for s in sentences]
+    chosen, used = [], 0
+    for i in sorted(range(len(sentences)), key=lambda i: (-scores[i], i)):
+        if scores[i] <= 0:
+            break
+        cost = count_tokens(sentences[i]) + 1
+        if used + cost > budget:
+            continue
+        # Evitar casi-duplicados (párrafos repetidos, pies de foto, etc.)
+        if any(len(terms[i] & terms[j]) / len(terms[i] | terms[j]) > MAX_OVERLAP for j in chosen):
+            continue
+        chosen.append(i)
+        used += cost
+
+    if used < budget * MIN_FILL:
+        # Las frases no sirven (no se pudo partir el texto o ninguna puntúa)
+        prefix = truncate_tokens(re.sub(r"\s+", " ", text), budget)
+        return CompactContext(prefix, count_tokens(prefix), source_tokens, 0, len(sentences))
+
+    # Orden original; un salto de línea marca donde se omitieron frases
+    chosen.sort()
+    parts = []
+    for prev, i in zip([None] + chosen, chosen):
+        if prev is not None:
+            parts.append(" " if i == prev + 1 else "\n")
+        parts.append(sentences[i])
+    compacted = "".join(parts)
+    return CompactContext(compacted, count_tokens(compacted), source_tokens, len(chosen), len(sentences))
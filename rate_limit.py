@@ -0,0 +1,246 @@
+"""
+Token bucket por upstream compartido entre workers (SQLite).
+
+Cada upstream con cuota (pexels, google, scrape_do, openai) tiene un cubo
+con `rate` tokens/segundo y capacidad `burst`. Antes de cada llamada se
+toma un token; si no hay, el llamador espera (esa es la cola) hasta
+`max_wait` y después recibe RateLimited para degradar de forma explícita.
+
+Prioridades: el trabajo en segundo plano (refrescos, pre-calentado, lotes)
+solo puede gastar tokens por encima de una reserva del cubo, que queda para
+las peticiones interactivas. La prioridad va en un contextvar, así que se
+hereda en las etapas que corren en executors (ver pipeline.run_graph).
+"""
+import asyncio
+import contextvars
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import metrics
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+_priority = contextvars.ContextVar("rate_limit_priority", default=INTERACTIVE)
+
+WAIT_SECONDS = metrics.histogram(
+    "sentient_rate_limit_wait_seconds", "Espera por un token del limitador", ("upstream", "priority"),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+WAITING = metrics.gauge(
+    "sentient_rate_limit_waiting", "Llamadas esperando un token (profundidad de la cola)", ("upstream", "priority")
+)
+REJECTED = metrics.counter(
+    "sentient_rate_limit_rejected_total", "Llamadas rechazadas tras esperar max_wait", ("upstream", "priority")
+)
+
+
+class RateLimited(RuntimeError):
+    """No hubo token a tiempo. `retry_after`: segundos estimados hasta el siguiente."""
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(f"{upstream} rate limited, retry in {retry_after:.0f}s")
+        self.upstream = upstream
+        self.retry_after = retry_after
+
+
+@dataclass(frozen=True)
+class Bucket:
+    rate: float                 # tokens por segundo
+    burst: float                # capacidad
+    reserve: float = 0.3        # fracción del cubo reservada a peticiones interactivas
+
+
+def parse_limits(spec: str) -> dict:
+    """'pexels=200/3600:20,openai=60/60' -> {upstream: Bucket} (n/segundos[:burst])."""
+    buckets = {}
+    for item in filter(None, (spec or "").replace(" ", "").split(",")):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        count, _, seconds = rate.partition("/")
+        per_second = float(count) / float(seconds or 1)
+        buckets[name] = Bucket(rate=per_second, burst=float(burst) if burst else max(float(count), 1.0))
+    return buckets
+
+
+@contextmanager
+def priority(level: str):
+    """Marca el trabajo del bloque (y lo que herede su contexto) con `level`."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+def set_thread_priority(level: str):
+    """Para initializer= de executors dedicados a trabajo en segundo plano."""
+    _priority.set(level)
+
+
+class RateLimiter:
+
+    def __init__(self, path: str, buckets: dict, max_wait: dict = None):
+        self.path = path
+        self.buckets = dict(buckets)
+        self.max_wait = {INTERACTIVE: 5.0, BACKGROUND: 120.0, **(max_wait or {})}
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Suelta la conexión del hilo actual (el proceso maestro antes del fork)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS rate_buckets (
+                upstream TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+
+    def _try_take(self, upstream: str, bucket: Bucket, floor: float) -> float:
+        """Toma un token si quedan más de `floor`. Devuelve 0 o los segundos a esperar."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated FROM rate_buckets WHERE upstream = ?", (upstream,)
+            ).fetchone()
+            tokens = bucket.burst if row is None else min(bucket.burst, row[0] + (now - row[1]) * bucket.rate)
+            wait = 0.0
+            if tokens >= floor + 1:
+                tokens -= 1
+            else:
+                wait = (floor + 1 - tokens) / bucket.rate
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (upstream, tokens, updated) VALUES (?, ?, ?)",
+                (upstream, tokens, now)
+            )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _plan(self, upstream: str, level: str):
+        """(bucket, floor, max_wait) para esta llamada; bucket None = sin límite."""
+        bucket = self.buckets.get(upstream)
+        if bucket is None:
+            return None, 0.0, 0.0
+        # El fondo deja siempre `reserve` tokens (pero nunca tantos que no pueda tomar ninguno)
+        floor = min(bucket.burst * bucket.reserve, max(bucket.burst - 1, 0)) if level == BACKGROUND else 0.0
+        return bucket, floor, self.max_wait.get(level, self.max_wait[INTERACTIVE])
+
+    def _next_sleep(self, upstream: str, level: str, wait: float, elapsed: float, deadline: float) -> float:
+        if elapsed + wait > deadline:
+            REJECTED.inc(upstream=upstream, priority=level)
+            raise RateLimited(upstream, wait)
+        # Jitter para que los workers que esperan no despierten a la vez
+        return wait + random.uniform(0, min(wait, 0.05))
+
+    def acquire(self, upstream: str, level: str = None) -> float:
+        """
+        Espera un token de `upstream` (sin límite configurado no hace nada).
+        Devuelve los segundos esperados; lanza RateLimited si pasa max_wait.
+        """
+        level = level or current_priority()
+        bucket, floor, deadline = self._plan(upstream, level)
+        if bucket is None:
+            return 0.0
+        start = time.monotonic()
+
+        wait = self._try_take(upstream, bucket, floor)
+        if not wait:
+            WAIT_SECONDS.observe(0, upstream=upstream, priority=level)
+            return 0.0
+
+        WAITING.inc(upstream=upstream, priority=level)
+        try:
+            while wait:
+                time.sleep(self._next_sleep(upstream, level, wait, time.monotonic() - start, deadline))
+                wait = self._try_take(upstream, bucket, floor)
+        finally:
+            WAITING.dec(upstream=upstream, priority=level)
+        waited = time.monotonic() - start
+        WAIT_SECONDS.observe(waited, upstream=upstream, priority=level)
+        return waited
+
+    async def acquire_async(self, upstream: str, level: str = None) -> float:
+        """acquire() para el modo ASGI: la espera no bloquea el event loop."""
+        level = level or current_priority()
+        bucket, floor, deadline = self._plan(upstream, level)
+        if bucket is None:
+            return 0.0
+        start = time.monotonic()
+
+        # La transacción SQLite puede esperar al lock de escritura: fuera del loop
+        wait = await asyncio.to_thread(self._try_take, upstream, bucket, floor)
+        if not wait:
+            WAIT_SECONDS.observe(0, upstream=upstream, priority=level)
+            return 0.0
+
+        WAITING.inc(upstream=upstream, priority=level)
+        try:
+            while wait:
+                await asyncio.sleep(self._next_sleep(upstream, level, wait, time.monotonic() - start, deadline))
+                wait = await asyncio.to_thread(self._try_take, upstream, bucket, floor)
+        finally:
+            WAITING.dec(upstream=upstream, priority=level)
+        waited = time.monotonic() - start
+        WAIT_SECONDS.observe(waited, upstream=upstream, priority=level)
+        return waited
+
+    def drain(self, upstream: str, seconds: float):
+        """
+        El upstream respondió 429: vaciar el cubo (en todos los workers) para
+        que nadie vuelva a intentarlo hasta dentro de `seconds`.
+        """
+        bucket = self.buckets.get(upstream)
+        if bucket is None or seconds <= 0:
+            return
+        self._conn().execute(
+            "INSERT OR REPLACE INTO rate_buckets (upstream, tokens, updated) VALUES (?, ?, ?)",
+            (upstream, -seconds * bucket.rate, time.time())
+        )
+
+    def state(self) -> dict:
+        """Tokens disponibles ahora por upstream (para depuración / stats)."""
+        rows = dict(
+            (r[0], (r[1], r[2])) for r in self._conn().execute("SELECT upstream, tokens, updated FROM rate_buckets")
+        )
+        now = time.time()
+        out = {}
+        for name, bucket in self.buckets.items():
+            tokens, updated = rows.get(name, (bucket.burst, now))
+            out[name] = {
+                "tokens": round(min(bucket.burst, tokens + (now - updated) * bucket.rate), 2),
+                "burst": bucket.burst,
+                "rate_per_second": bucket.rate,
+                "reserved_for_interactive": bucket.burst * bucket.reserve,
+            }
+        return out
@@ -0,0 +1,357 @@
+"""
+Render en el servidor de las tarjetas A–D y de los slides del carrusel.
+
+Reproduce con Pillow el layout de static/style.css (.render-target,
+.layout-*, .c-pill/.c-title/.c-subtitle y .carousel-*) y los tamaños fijos
+de FIXED_FS en ui-manager.js, para exportar sin abrir un navegador.
+
+Los render corren en un pool de procesos; cada proceso carga las fuentes
+una sola vez (initializer) y recibe la ruta del fondo ya descargado en la
+caché de imágenes, no los bytes. content_key() identifica un render por
+su contenido (spec + hash del fondo + formato + fuentes + RENDER_VERSION).
+
+Las fuentes Inter no vienen en el repo: hay que dejarlas en RENDER_FONT_DIR.
+Sin ellas Renderer.check() lanza FontsMissing (salvo require_fonts=False,
+que usa la más cercana o la de Pillow).
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from image_cache import FORMATS
+
+# Subir al cambiar el layout: invalida los render cacheados
+RENDER_VERSION = "1"
+
+DEFAULT_FONT_DIR = os.getenv("RENDER_FONT_DIR", "fonts")
+# Peso CSS -> archivo (Inter estática, como la que carga index.html)
+FONT_FILES = {
+    400: "Inter-Regular.ttf",
+    500: "Inter-Medium.ttf",
+    700: "Inter-Bold.ttf",
+    800: "Inter-ExtraBold.ttf",
+    900: "Inter-Black.ttf",
+}
+
+CARD_W, CARD_H = 1080, 1440
+CARD_PADDING = 80
+BRAND = (204, 255, 0)       # --brand (#CCFF00)
+BG_MAIN = (0, 0, 0)         # --bg-main
+NAMED_COLORS = {"brand": BRAND, "white": (255, 255, 255), "black": (0, 0, 0)}
+
+# .layout-* de style.css + FIXED_FS de ui-manager.js
+LAYOUTS = {
+    "layout-standard": {"title": 84, "subtitle": 32, "title_lh": 0.98, "sub_lh": 1.15,
+                        "max_width": 820, "align": "left", "valign": "bottom", "top": CARD_PADDING},
+    "layout-centered": {"title": 92, "subtitle": 36, "title_lh": 0.98, "sub_lh": 1.15,
+                        "max_width": 900, "align": "center", "valign": "center", "top": CARD_PADDING},
+    "layout-bold": {"title": 110, "subtitle": 34, "title_lh": 0.95, "sub_lh": 1.15,
+                    "max_width": 860, "align": "left", "valign": "top", "top": 160},
+    "layout-chatgptricks": {"title": 140, "subtitle": 0, "title_lh": 0.9, "sub_lh": 1,
+                            "max_width": CARD_W - 2 * CARD_PADDING, "align": "left", "valign": "bottom",
+                            "top": CARD_PADDING},
+}
+PILL = {"size": 36, "weight": 900, "pad_x": 48, "pad_y": 16, "margin_bottom": 50}
+SUBTITLE_MARGIN = 24
+
+# .carousel-text-header / .carousel-title / .carousel-sentence
+SLIDE = {"pad_top": 50, "pad_x": 50, "pad_bottom": 30, "title": 56, "title_lh": 1.05, "title_margin": 16,
+         "sentence": 28, "sentence_lh": 1.3}
+
+# Valores por defecto de una tarjeta (state.data en app.js)
+CARD_DEFAULTS = {
+    "title": "", "subtitle": "", "tag": "", "bg": "", "layout": "layout-standard",
+    "overlayColor": "black", "overlayOpacity": 50, "customOverlayColor": "",
+    "titleColor": "brand", "subtitleColor": "white", "pillBgColor": "brand", "pillTextColor": "black",
+    "blur": 0, "contrast": 100, "brightness": 100, "grayscale": 0,
+}
+
+
+def card_spec(data: dict) -> dict:
+    """Tarjeta normalizada (solo los campos que afectan al render)."""
+    spec = {k: data.get(k, default) for k, default in CARD_DEFAULTS.items()}
+    if spec["layout"] not in LAYOUTS:
+        spec["layout"] = CARD_DEFAULTS["layout"]
+    for k in ("overlayOpacity", "blur", "contrast", "brightness", "grayscale"):
+        try:
+            spec[k] = float(spec[k])
+        except (TypeError, ValueError):
+            spec[k] = float(CARD_DEFAULTS[k])
+    for k in ("title", "subtitle", "tag", "bg"):
+        spec[k] = str(spec[k] or "")
+    return spec
+
+
+def slide_spec(data: dict) -> dict:
+    return {k: str(data.get(k) or "") for k in ("title", "sentence", "image")}
+
+
+def content_key(kind: str, spec: dict, fmt: str, image_digest: str = None, fonts: str = "default") -> str:
+    """`fonts`: font_set() de las fuentes con las que se renderiza."""
+    payload = json.dumps([RENDER_VERSION, kind, spec, fmt, image_digest, fonts], sort_keys=True)
+    return "render:" + hashlib.sha256(payload.encode()).hexdigest()
+
+
+class FontsMissing(RuntimeError):
+    """Faltan archivos de FONT_FILES en el directorio de fuentes."""
+
+
+def missing_fonts(font_dir: str) -> list:
+    return [name for name in FONT_FILES.values() if not os.path.isfile(os.path.join(font_dir, name))]
+
+
+def font_set(font_dir: str) -> str:
+    """Huella de las fuentes presentes en `font_dir` (nombre + hash); 'default' si no hay ninguna."""
+    digest = hashlib.sha256()
+    found = False
+    for weight, name in sorted(FONT_FILES.items()):
+        try:
+            with open(os.path.join(font_dir, name), "rb") as f:
+                data = f.read()
+        except OSError:
+            continue
+        found = True
+        digest.update(f"{weight}:{name}:".encode())
+        digest.update(hashlib.sha256(data).digest())
+    return digest.hexdigest()[:16] if found else "default"
+
+
+# --------------------------------------------------------------------
+# Worker (proceso del pool)
+# --------------------------------------------------------------------
+_font_data = {}
+_fonts_loaded = False
+
+
+def init_worker(font_dir: str = DEFAULT_FONT_DIR):
+    """Carga las fuentes una vez por proceso."""
+    global _fonts_loaded
+    _fonts_loaded = True
+    for weight, name in FONT_FILES.items():
+        try:
+            with open(os.path.join(font_dir, name), "rb") as f:
+                _font_data[weight] = f.read()
+        except OSError:
+            pass
+    if len(_font_data) < len(FONT_FILES):
+        missing = sorted(set(FONT_FILES) - set(_font_data))
+        print(f"⚠️ Render: faltan fuentes Inter {missing} en '{font_dir}', se usa la más cercana o la de Pillow")
+
+
+@lru_cache(maxsize=64)
+def _font(weight: int, size: int):
+    from PIL import ImageFont
+
+    if not _fonts_loaded:
+        init_worker()
+    if _font_data:
+        nearest = min(_font_data, key=lambda w: abs(w - weight))
+        return ImageFont.truetype(io.BytesIO(_font_data[nearest]), size)
+    return ImageFont.load_default(size)
+
+
+def _color(value, default):
+    if value in NAMED_COLORS:
+        return NAMED_COLORS[value]
+    value = str(value or "").lstrip("#")
+    if len(value) == 3:
+        value = "".join(c * 2 for c in value)
+    try:
+        return tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return default
+
+
+def _wrap(text: str, font, max_width: int) -> list:
+    # Como white-space: normal sin cortar palabras (overflow-wrap: normal)
+    lines = []
+    for paragraph in text.splitlines() or [""]:
+        line = ""
+        for word in paragraph.split():
+            candidate = f"{line} {word}" if line else word
+            if line and font.getlength(candidate) > max_width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return [line for line in lines if line]
+
+
+def _draw_lines(draw, lines, font, x, y, width, line_height, align, fill) -> int:
+    """Pinta `lines` desde `y` (borde superior de la caja de línea). Devuelve el y final."""
+    ascent, descent = font.getmetrics()
+    for line in lines:
+        baseline = y + (line_height - (ascent + descent)) / 2 + ascent
+        lx = x + (width - font.getlength(line)) / 2 if align == "center" else x
+        draw.text((lx, baseline), line, font=font, fill=fill, anchor="ls")
+        y += line_height
+    return y
+
+
+def _cover(path: str, width: int, height: int):
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        img = img.convert("RGB")
+    return ImageOps.fit(img, (width, height), Image.LANCZOS)
+
+
+def _encode(img, fmt: str):
+    pil_format, content_type = FORMATS.get(fmt) or FORMATS["png"]
+    out = io.BytesIO()
+    save_kwargs = {"quality": 92} if pil_format in ("JPEG", "WEBP") else {}
+    img.convert("RGB").save(out, format=pil_format, **save_kwargs)
+    return out.getvalue(), content_type
+
+
+def render_card(spec: dict, background_path: str = None, fmt: str = "png"):
+    """Tarjeta 1080x1440 (.render-target). Devuelve (bytes, content_type)."""
+    from PIL import Image, ImageDraw, ImageEnhance, ImageFilter
+
+    canvas = Image.new("RGB", (CARD_W, CARD_H), BG_MAIN)
+    if background_path:
+        bg = _cover(background_path, CARD_W, CARD_H)
+        # Mismo orden que el filter CSS: blur, contrast, brightness, grayscale
+        if spec["blur"] > 0:
+            bg = bg.filter(ImageFilter.GaussianBlur(spec["blur"]))
+        if spec["contrast"] != 100:
+            bg = ImageEnhance.Contrast(bg).enhance(spec["contrast"] / 100)
+        if spec["brightness"] != 100:
+            bg = ImageEnhance.Brightness(bg).enhance(spec["brightness"] / 100)
+        if spec["grayscale"] > 0:
+            gray = bg.convert("L").convert("RGB")
+            bg = Image.blend(bg, gray, min(spec["grayscale"], 100) / 100)
+        canvas.paste(bg)
+
+    # .card-overlay
+    opacity = max(0.0, min(spec["overlayOpacity"], 100)) / 100
+    if opacity:
+        overlay_key = spec["customOverlayColor"] if spec["overlayColor"] == "custom" else spec["overlayColor"]
+        rgb = _color(overlay_key, NAMED_COLORS["black"])
+        overlay = Image.new("RGBA", canvas.size, rgb + (round(255 * opacity),))
+        canvas = Image.alpha_composite(canvas.convert("RGBA"), overlay).convert("RGB")
+
+    layout = LAYOUTS[spec["layout"]]
+    # En layout-chatgptricks 'brand' es blanco (getResolvedColor en ui-manager.js)
+    brand = NAMED_COLORS["white"] if spec["layout"] == "layout-chatgptricks" else BRAND
+
+    def resolve(value, default):
+        return brand if value == "brand" else _color(value, default)
+
+    content_x = CARD_PADDING
+    content_w = CARD_W - 2 * CARD_PADDING
+    text_w = min(layout["max_width"], content_w)
+    text_x = content_x + (content_w - text_w) / 2 if layout["align"] == "center" else content_x
+
+    title_font = _font(800, layout["title"])
+    title_lines = _wrap(spec["title"].upper(), title_font, text_w)
+    title_lh = layout["title"] * layout["title_lh"]
+    sub_font = _font(500, layout["subtitle"]) if layout["subtitle"] else None
+    sub_lines = _wrap(spec["subtitle"], sub_font, text_w) if sub_font else []
+    sub_lh = layout["subtitle"] * layout["sub_lh"]
+
+    pill_font = _font(PILL["weight"], PILL["size"])
+    tag = spec["tag"].strip()
+    pill_h = 0
+    if tag:
+        ascent, descent = pill_font.getmetrics()
+        pill_h = ascent + descent + 2 * PILL["pad_y"]
+
+    block_h = (pill_h + PILL["margin_bottom"] if tag else 0) + len(title_lines) * title_lh
+    if sub_lines:
+        block_h += SUBTITLE_MARGIN + len(sub_lines) * sub_lh
+
+    if layout["valign"] == "bottom":
+        y = CARD_H - CARD_PADDING - block_h
+    elif layout["valign"] == "center":
+        y = CARD_PADDING + (CARD_H - 2 * CARD_PADDING - block_h) / 2
+    else:
+        y = layout["top"]
+
+    draw = ImageDraw.Draw(canvas)
+    if tag:
+        pill_w = pill_font.getlength(tag) + 2 * PILL["pad_x"]
+        px = content_x + (content_w - pill_w) / 2 if layout["align"] == "center" else content_x
+        draw.rounded_rectangle((px, y, px + pill_w, y + pill_h), radius=pill_h / 2,
+                               fill=resolve(spec["pillBgColor"], BRAND))
+        _draw_lines(draw, [tag], pill_font, px + PILL["pad_x"], y + PILL["pad_y"], pill_w - 2 * PILL["pad_x"],
+                    pill_h - 2 * PILL["pad_y"], "left", resolve(spec["pillTextColor"], NAMED_COLORS["black"]))
+        y += pill_h + PILL["margin_bottom"]
+
+    y = _draw_lines(draw, title_lines, title_font, text_x, y, text_w, title_lh, layout["align"],
+                    resolve(spec["titleColor"], brand))
+    if sub_lines:
+        _draw_lines(draw, sub_lines, sub_font, text_x, y + SUBTITLE_MARGIN, text_w, sub_lh, layout["align"],
+                    resolve(spec["subtitleColor"], NAMED_COLORS["white"]))
+    return _encode(canvas, fmt)
+
+
+def render_slide(spec: dict, image_path: str = None, fmt: str = "png"):
+    """Slide de carrusel 1080x1440 (.carousel-slide-content). Devuelve (bytes, content_type)."""
+    from PIL import Image, ImageDraw
+
+    canvas = Image.new("RGB", (CARD_W, CARD_H), BG_MAIN)
+    draw = ImageDraw.Draw(canvas)
+    text_w = CARD_W - 2 * SLIDE["pad_x"]
+
+    title_font = _font(400, SLIDE["title"])
+    sentence_font = _font(400, SLIDE["sentence"])
+    title_lines = _wrap(spec["title"], title_font, text_w)
+    sentence_lines = _wrap(spec["sentence"], sentence_font, text_w)
+
+    y = SLIDE["pad_top"]
+    if title_lines:
+        y = _draw_lines(draw, title_lines, title_font, SLIDE["pad_x"], y, text_w,
+                        SLIDE["title"] * SLIDE["title_lh"], "left", BRAND) + SLIDE["title_margin"]
+    y = _draw_lines(draw, sentence_lines, sentence_font, SLIDE["pad_x"], y, text_w,
+                    SLIDE["sentence"] * SLIDE["sentence_lh"], "left", NAMED_COLORS["white"])
+    y = round(y + SLIDE["pad_bottom"])
+
+    # .carousel-image-container ocupa el resto (object-fit: cover)
+    if image_path and y < CARD_H:
+        canvas.paste(_cover(image_path, CARD_W, CARD_H - y), (0, y))
+    return _encode(canvas, fmt)
+
+
+RENDERERS = {"card": render_card, "slide": render_slide}
+
+
+class Renderer:
+    """Pool de procesos para render_card / render_slide (se crea al primer uso)."""
+
+    def __init__(self, workers: int = 2, font_dir: str = DEFAULT_FONT_DIR, require_fonts: bool = True):
+        self.workers = workers
+        self.font_dir = font_dir
+        self.require_fonts = require_fonts
+        self.missing = missing_fonts(font_dir)
+        self._fonts = None
+        self._pool = None
+        self._pool_guard = threading.Lock()
+
+    @property
+    def fonts(self) -> str:
+        """font_set() del directorio de fuentes (se calcula una vez)."""
+        if self._fonts is None:
+            self._fonts = font_set(self.font_dir)
+        return self._fonts
+
+    def check(self):
+        """FontsMissing si faltan fuentes y no se aceptan las de reemplazo."""
+        if self.require_fonts and self.missing:
+            raise FontsMissing(f"Render fonts missing in '{self.font_dir}': {', '.join(self.missing)}")
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._pool_guard:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                                 initargs=(self.font_dir,))
+            return self._pool
+
+    def submit(self, kind: str, spec: dict, image_path: str = None, fmt: str = "png"):
+        """Future con (bytes, content_type)."""
+        return self._executor().submit(RENDERERS[kind], spec, image_path, fmt)
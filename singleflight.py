@@ -0,0 +1,391 @@
+"""
+Single-flight: peticiones idénticas simultáneas esperan a un solo cálculo.
+
+Dentro de un proceso se coalescen con un Event por clave. Entre procesos
+(workers de gunicorn) el líder toma un lease en SQLite; los demás sondean
+hasta que el líder publica el resultado en la misma fila, que se guarda
+unos segundos para quien llegue justo después. Mientras calcula, un hilo
+del proceso líder renueva el lease; si el proceso muere, el lease expira
+y otro toma el relevo.
+
+Los errores del líder se propagan a quienes esperaban, salvo los tipos de
+`retry_on` (p. ej. la cancelación de un trabajo concreto): con esos, los
+seguidores vuelven a intentarlo y uno de ellos pasa a ser el líder. En el
+mismo proceso reciben la excepción original; en otros, un LeaderFailed con
+su mensaje (el error se publica en la fila). Quien llega después de un
+error no lo hereda: calcula de nuevo.
+
+do_async() es la variante para el modo ASGI: comparte las mismas llamadas
+en curso con do() (hilos y corrutinas del mismo proceso se coalescen entre sí).
+
+Broadcast reparte los eventos parciales que publica el líder mientras
+calcula (p. ej. para /api/scrape/stream) entre quienes esperan esa clave
+en el mismo proceso.
+"""
+import asyncio
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+
+class LeaderFailed(RuntimeError):
+    """El líder (en otro proceso) falló; el mensaje es el de su excepción."""
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.waiters = []  # (loop, asyncio.Event) de los seguidores de do_async
+        self.result = None
+        self.error = None
+
+    def finish(self):
+        self.event.set()
+        for loop, waiter in self.waiters:
+            try:
+                loop.call_soon_threadsafe(waiter.set)
+            except RuntimeError:
+                pass  # Loop ya cerrado
+
+
+class SingleFlight:
+
+    def __init__(self, path: str, namespace: str = "scrape", lease: float = 300,
+                 poll_interval: float = 0.25, keep_results: float = 30, retry_on: tuple = ()):
+        self.path = path
+        self.namespace = namespace
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.keep_results = keep_results
+        self.retry_on = tuple(retry_on)
+        self.owner = uuid.uuid4().hex
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._leading = {}  # clave -> owner de los leases de este proceso (los renueva _renew_loop)
+        self._renewer_pid = None
+        self._local = threading.local()
+        self._init_schema()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def close(self):
+        """Cierra la conexión del hilo actual."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def _init_schema(self):
+        self._conn().execute("""
+            CREATE TABLE IF NOT EXISTS inflight (
+                ns TEXT NOT NULL,
+                key TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                expires REAL NOT NULL,
+                done REAL,
+                result TEXT,
+                error TEXT,
+                PRIMARY KEY (ns, key)
+            )
+        """)
+        # Bases creadas antes de que se publicaran los errores del líder
+        columns = [row[1] for row in self._conn().execute("PRAGMA table_info(inflight)")]
+        if "error" not in columns:
+            self._conn().execute("ALTER TABLE inflight ADD COLUMN error TEXT")
+
+    # ----------------------------------------------------------------
+    # API
+    # ----------------------------------------------------------------
+    def do(self, key: str, fn):
+        """
+        Ejecuta `fn()` una sola vez para todas las llamadas concurrentes con
+        la misma `key`. El resultado debe ser serializable a JSON (los
+        seguidores de otros procesos lo reciben ya deserializado).
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+            if leader:
+                break
+            call.event.wait()
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, self.retry_on):
+                raise call.error
+            # El fallo era solo del líder: reintentar (quizá como líder)
+
+        try:
+            call.result = self._do_shared(key, fn)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.finish()
+        return call.result
+
+    async def do_async(self, key: str, afn):
+        """do() para corrutinas: `afn()` devuelve un awaitable; las esperas no bloquean el loop."""
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None
+                if leader:
+                    call = self._calls[key] = _Call()
+                else:
+                    # Se registra con el lock: el líder reparte los avisos tras sacar la llamada
+                    waiter = asyncio.Event()
+                    call.waiters.append((asyncio.get_running_loop(), waiter))
+            if leader:
+                break
+            await waiter.wait()
+            if call.error is None:
+                return call.result
+            if not isinstance(call.error, self.retry_on):
+                raise call.error
+            # El fallo era solo del líder: reintentar (quizá como líder)
+
+        try:
+            call.result = await self._do_shared_async(key, afn)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.finish()
+        return call.result
+
+    async def _do_shared_async(self, key: str, afn):
+        owner = f"{self.owner}:{os.getpid()}"
+        while True:
+            state, value = await asyncio.to_thread(self._claim, key, owner)
+            if state == "done":
+                return value
+            if state == "leader":
+                break
+            outcome = await self._wait_async(key)
+            if outcome is not None:
+                return outcome[0]
+
+        self._hold(key, owner)
+        try:
+            result = await afn()
+        except BaseException as e:
+            await asyncio.to_thread(self._fail, key, owner, e)
+            raise
+        finally:
+            self._drop(key)
+        await asyncio.to_thread(self._publish, key, owner, result)
+        return result
+
+    def _release(self, key: str, owner: str):
+        self._conn().execute(
+            "DELETE FROM inflight WHERE ns = ? AND key = ? AND owner = ?",
+            (self.namespace, key, owner)
+        )
+
+    def _fail(self, key: str, owner: str, error: BaseException):
+        """Publica el error del líder; los de `retry_on` (o no-Exception) solo liberan el lease."""
+        if not isinstance(error, Exception) or isinstance(error, self.retry_on):
+            self._release(key, owner)
+            return
+        self._conn().execute(
+            "UPDATE inflight SET done = ?, error = ? WHERE ns = ? AND key = ? AND owner = ?",
+            (time.time(), str(error) or type(error).__name__, self.namespace, key, owner)
+        )
+
+    def _publish(self, key: str, owner: str, result):
+        self._conn().execute(
+            "UPDATE inflight SET done = ?, result = ? WHERE ns = ? AND key = ? AND owner = ?",
+            (time.time(), json.dumps(result), self.namespace, key, owner)
+        )
+
+    def _do_shared(self, key: str, fn):
+        owner = f"{self.owner}:{os.getpid()}"
+        while True:
+            state, value = self._claim(key, owner)
+            if state == "done":
+                return value
+            if state == "leader":
+                break
+            # Otro proceso lo está calculando
+            outcome = self._wait(key)
+            if outcome is not None:
+                return outcome[0]
+
+        self._hold(key, owner)
+        try:
+            result = fn()
+        except BaseException as e:
+            self._fail(key, owner, e)
+            raise
+        finally:
+            self._drop(key)
+        self._publish(key, owner, result)
+        return result
+
+    # ----------------------------------------------------------------
+    # Renovación del lease
+    # ----------------------------------------------------------------
+    def _hold(self, key: str, owner: str):
+        pid = os.getpid()
+        with self._lock:
+            if self._renewer_pid != pid:
+                # Primer lease de este proceso (o tras fork): hilo propio
+                self._renewer_pid = pid
+                self._leading = {}
+                threading.Thread(target=self._renew_loop, name="singleflight-lease", daemon=True).start()
+            self._leading[key] = owner
+
+    def _drop(self, key: str):
+        with self._lock:
+            self._leading.pop(key, None)
+
+    def _renew_loop(self):
+        while True:
+            time.sleep(self.lease / 3)
+            with self._lock:
+                leading = list(self._leading.items())
+            for key, owner in leading:
+                try:
+                    self._conn().execute(
+                        "UPDATE inflight SET expires = ? WHERE ns = ? AND key = ? AND owner = ? AND done IS NULL",
+                        (time.time() + self.lease, self.namespace, key, owner)
+                    )
+                except Exception as e:
+                    print(f"⚠️ Single-flight: no se pudo renovar el lease de {key}: {e}")
+
+    def _claim(self, key: str, owner: str):
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT owner, expires, done, result, error FROM inflight WHERE ns = ? AND key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            # Un error publicado es solo para quienes esperaban: el que llega después calcula
+            if row and row[2] is not None and row[4] is None and now - row[2] < self.keep_results:
+                conn.execute("COMMIT")
+                return "done", json.loads(row[3])
+            if row and row[2] is None and row[1] > now:
+                conn.execute("COMMIT")
+                return "follower", None
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO inflight (ns, key, owner, expires, done, result, error)
+                VALUES (?, ?, ?, ?, NULL, NULL, NULL)
+                """,
+                (self.namespace, key, owner, now + self.lease)
+            )
+            # Limpieza de resultados viejos
+            conn.execute(
+                "DELETE FROM inflight WHERE ns = ? AND done IS NOT NULL AND done < ?",
+                (self.namespace, now - self.keep_results)
+            )
+            conn.execute("COMMIT")
+            return "leader", None
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _poll(self, key: str):
+        """
+        (result,) si el líder publicó, None si se liberó o caducó su lease,
+        False si sigue; LeaderFailed si publicó un error.
+        """
+        row = self._conn().execute(
+            "SELECT expires, done, result, error FROM inflight WHERE ns = ? AND key = ?",
+            (self.namespace, key)
+        ).fetchone()
+        if row is None:
+            return None  # El líder liberó el lease (p. ej. cancelado): reintentar el claim
+        if row[1] is not None:
+            if row[3] is not None:
+                raise LeaderFailed(row[3])
+            return (json.loads(row[2]),)
+        if row[0] <= time.time():
+            return None
+        return False
+
+    def _wait(self, key: str):
+        """Sondea hasta que el líder publica (devuelve (result,) o lanza LeaderFailed) o se va (None)."""
+        while True:
+            outcome = self._poll(key)
+            if outcome is not False:
+                return outcome
+            time.sleep(self.poll_interval)
+
+    async def _wait_async(self, key: str):
+        while True:
+            outcome = await asyncio.to_thread(self._poll, key)
+            if outcome is not False:
+                return outcome
+            await asyncio.sleep(self.poll_interval)
+
+
+class Broadcast:
+    """
+    Eventos parciales de los cálculos en curso, por clave. El líder publica
+    dentro de publishing(key); cada suscriptor recibe en su cola lo ya
+    publicado y lo que llegue después. Solo dentro del proceso: quien espera
+    a un líder de otro worker recibe únicamente el resultado final.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}       # clave en curso -> eventos publicados
+        self._subscribers = {}  # clave -> [queue.Queue]
+
+    @contextmanager
+    def publishing(self, key: str):
+        with self._lock:
+            self._events[key] = []
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._events.pop(key, None)
+
+    def publish(self, key: str, event):
+        with self._lock:
+            events = self._events.get(key)
+            if events is None:
+                return
+            events.append(event)
+            for q in self._subscribers.get(key, ()):
+                q.put(event)
+
+    def subscribe(self, key: str) -> queue.Queue:
+        q = queue.Queue()
+        with self._lock:
+            for event in self._events.get(key, ()):
+                q.put(event)
+            self._subscribers.setdefault(key, []).append(q)
+        return q
+
+    def unsubscribe(self, key: str, q: queue.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(key, [])
+            if q in subscribers:
+                subscribers.remove(q)
+            if not subscribers:
+                self._subscribers.pop(key, None)
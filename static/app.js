@@ -1,7 +1,7 @@
 // static/app.js
 import { DataHandler } from './data-handler.js';
 import { UIManager } from './ui-manager.js';
-import { CARD_IDS, toast } from './utils.js';
+import { CARD_IDS, proxyImageUrl, toast } from './utils.js';
 import { Animation } from './animation.js';
 
 const SENTIENT_THEME = {
@@ -374,7 +374,7 @@ const App = {
       if (titleEl) titleEl.textContent = slide.title || '';
       if (sentenceEl) sentenceEl.textContent = slide.sentence || '';
       if (imageEl && slide.image) {
-        imageEl.src = `/api/proxy_image?url=${encodeURIComponent(slide.image)}`;
+        imageEl.src = proxyImageUrl(slide.image);
       }
     });
 
@@ -501,6 +501,37 @@ const App = {
     }
   },
 
+  // Eventos de /api/scrape/stream posteriores al primer render (ver DataHandler.scrapeContentStream)
+  onScrapeEvent(evt) {
+    if (!this.state.cardsReady) {
+      // finalizeUi aún no ha pintado las tarjetas: se aplican al terminar
+      this.state.pendingScrapeEvents.push(evt);
+      return;
+    }
+    const data = evt.data || {};
+    if (evt.event === 'variants') {
+      DataHandler.applyVariants(this, data.variants);
+    } else if (evt.event === 'carousel') {
+      DataHandler.storeCarousel(this, data);
+    } else if (evt.event === 'slide_image') {
+      const slide = this.state.carouselData?.slides?.[data.index];
+      if (slide) slide.image = data.image;
+    } else if (evt.event === 'done') {
+      DataHandler.applyVariants(this, data.ai_content?.variants);
+      if (data.carousel?.slides?.length) {
+        DataHandler.storeCarousel(this, data.carousel, data.ai_content?.common_caption);
+      }
+      if (data.ai_error) toast(`Scrape OK, but AI failed: ${data.ai_error}`, 'warn');
+    }
+  },
+
+  flushScrapeEvents() {
+    this.state.cardsReady = true;
+    const pending = this.state.pendingScrapeEvents || [];
+    this.state.pendingScrapeEvents = [];
+    pending.forEach(evt => this.onScrapeEvent(evt));
+  },
+
   renderCard(v) { UIManager.renderCard(this, v, `card${v}`); },
   renderAll() { UIManager.renderAll(this); },
 
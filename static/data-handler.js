@@ -33,6 +33,12 @@ export const DataHandler = {
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({ query, count })
       });
+      if (res.status === 503) {
+        // Cuota de Pexels agotada: avisar en lugar de dejar la tarjeta sin imagen sin más
+        const wait = res.headers.get('Retry-After');
+        toast(`Image search is rate limited${wait ? `, try again in ${wait}s` : ''}.`, 'error');
+        return [];
+      }
       if (!res.ok) throw new Error(`Pexels search failed with status ${res.status}.`);
       const data = await res.json();
       console.log(`[Frontend: Pexels] Recibidas ${data.imageUrls.length} URLs de Pexels.`);
@@ -47,6 +53,9 @@ export const DataHandler = {
   async generateCarousel(app) {
     console.log('[DataHandler] Generating carousel...');
 
+    // Si el scrape en streaming sigue en curso, su carrusel está al llegar
+    if (app.state.scrapeDone) await app.state.scrapeDone.catch(() => {});
+
     // Check if carousel data was already generated during scraping
     if (app.state.carouselData && app.state.carouselData.slides && app.state.carouselData.slides.length > 0) {
       console.log('[DataHandler] Using pre-generated carousel data from scrape');
@@ -108,12 +117,7 @@ export const DataHandler = {
     // Store carousel data if it was generated during scraping
     if (data.carousel && data.carousel.slides) {
       console.log('[DataHandler] Storing pre-generated carousel data from scrape');
-      app.state.carouselData = {
-        slides: data.carousel.slides || [],
-        caption: data.carousel.caption || data.ai_content?.common_caption || '',
-        recommendedSlides: data.carousel.recommended_slides || 3,
-        recommendationReason: data.carousel.recommendation_reason || 'Based on article analysis'
-      };
+      this.storeCarousel(app, data.carousel, data.ai_content?.common_caption);
     }
 
 
@@ -162,8 +166,7 @@ export const DataHandler = {
       const cardData = app.state.data[v];
 
       cardData.isPlaceholder = false;
-      cardData.title = (variants[v]?.title || cardData.defaultTitle || '').toUpperCase();
-      cardData.subtitle = variants[v]?.subtitle || cardData.defaultSubtitle || '';
+      this._setCardText(cardData, variants[v]);
       app.renderCard(v);
     });
 
@@ -190,9 +193,49 @@ export const DataHandler = {
     if (data.ai_error) {
       toast(`Scrape OK, but AI failed: ${data.ai_error}`, 'warn');
     }
+
+    // Eventos del stream que llegaron mientras se pintaban las tarjetas
+    app.flushScrapeEvents?.();
+  },
+
+  storeCarousel(app, carousel, fallbackCaption = '') {
+    app.state.carouselData = {
+      slides: carousel.slides || [],
+      caption: carousel.caption || fallbackCaption || '',
+      recommendedSlides: carousel.recommended_slides || 3,
+      recommendationReason: carousel.recommendation_reason || 'Based on article analysis'
+    };
+  },
+
+  // Texto de una tarjeta; se recuerda para saber luego si el usuario lo tocó
+  _setCardText(cardData, variant) {
+    cardData.title = (variant?.title || cardData.defaultTitle || '').toUpperCase();
+    cardData.subtitle = variant?.subtitle || cardData.defaultSubtitle || '';
+    cardData.autoTitle = cardData.title;
+    cardData.autoSubtitle = cardData.subtitle;
+  },
+
+  // Variantes IA que llegan con las tarjetas ya pintadas (scrape en streaming).
+  // Solo en el overview y en tarjetas que el usuario no ha editado.
+  applyVariants(app, variants) {
+    if (!variants || app.state.mode !== 'APP') return;
+    ['A', 'B', 'C', 'D'].forEach(v => {
+      const cardData = app.state.data[v];
+      if (!variants[v] || cardData.title !== cardData.autoTitle || cardData.subtitle !== cardData.autoSubtitle) return;
+      this._setCardText(cardData, variants[v]);
+      app.renderCard(v);
+    });
   },
 
   async scrapeContent(app, url) {
+    // Preferir la variante en streaming; si no está disponible, usar /api/scrape
+    try {
+      return await this.scrapeContentStream(app, url);
+    } catch (e) {
+      if (!e.streamUnavailable) throw e;
+      console.warn('[scrape stream] unavailable, falling back to /api/scrape', e);
+    }
+
     const res = await fetch('/api/scrape', {
       method: 'POST', headers: { 'Content-Type': 'application/json' },
       body: JSON.stringify({ url })
@@ -203,6 +246,76 @@ export const DataHandler = {
     return d;
   },
 
+  // Lee /api/scrape/stream (NDJSON). Resuelve con lo primero que se puede
+  // pintar: el resultado final ('done') o, si llega antes, el evento
+  // 'original' (marcado con partial). El resto del stream se sigue leyendo:
+  // cada evento pasa a app.onScrapeEvent y app.state.scrapeDone resuelve con
+  // el resultado final.
+  async scrapeContentStream(app, url) {
+    // Un stream anterior (otra URL) deja de entregar eventos
+    const token = app.state.scrapeToken = {};
+    app.state.scrapeDone = null;
+    app.state.cardsReady = false;
+    app.state.pendingScrapeEvents = [];
+    const res = await fetch('/api/scrape/stream', {
+      method: 'POST', headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ url })
+    });
+    if (!res.ok || !res.body) {
+      const err = new Error(`scrape stream failed: ${res.status}`);
+      err.streamUnavailable = res.status === 404 || !res.body;
+      if (!err.streamUnavailable) {
+        const d = await res.json().catch(() => ({}));
+        if (d.error) err.message = d.error;
+      }
+      throw err;
+    }
+
+    const events = this._ndjsonEvents(res.body);
+    for await (const evt of events) {
+      if (evt.event === 'error') throw new Error(evt.data?.error || 'scrape failed');
+      if (evt.event === 'done') return evt.data;
+      if (evt.event === 'original') {
+        app.state.scrapeDone = this._followStream(app, events, token);
+        app.state.scrapeDone.catch(e => {
+          console.error('[scrape stream]', e);
+          toast(`AI generation failed: ${e.message}`, 'warn');
+        });
+        return { ...evt.data, partial: true };
+      }
+    }
+    throw new Error('scrape stream ended without a result');
+  },
+
+  async _followStream(app, events, token) {
+    for await (const evt of events) {
+      if (evt.event === 'error') throw new Error(evt.data?.error || 'scrape failed');
+      if (app.state.scrapeToken === token) app.onScrapeEvent?.(evt);
+      if (evt.event === 'done') return evt.data;
+    }
+    throw new Error('scrape stream ended without a result');
+  },
+
+  async *_ndjsonEvents(body) {
+    const reader = body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (value) buffer += decoder.decode(value, { stream: true });
+
+      let nl;
+      while ((nl = buffer.indexOf('\n')) >= 0) {
+        const line = buffer.slice(0, nl).trim();
+        buffer = buffer.slice(nl + 1);
+        if (line) yield JSON.parse(line);
+      }
+
+      if (done) return;
+    }
+  },
+
   async _reveal(app, v) {
     const mock = $(`mock${v}`);
     if (!mock) { console.warn('[reveal] missing', v); return; }
@@ -1,7 +1,7 @@
 // static/ui-manager.js
 
 // --- CORRECCIÓN: "toast" AÑADIDO A LA IMPORTACIÓN ---
-import { CARD_IDS, LAYOUTS, OVERLAYS, toast } from './utils.js';
+import { CARD_IDS, LAYOUTS, OVERLAYS, proxyImageUrl, toast } from './utils.js';
 
 const CARD_W = 1080;
 const CARD_H = 1440;
@@ -125,7 +125,7 @@ export const UIManager = {
 
     const imgEl = c.closest('.mockup').querySelector('.card-bg');
     if (d.bg && d.bg.length > 0) {
-      const proxyUrl = `/api/proxy_image?url=${encodeURIComponent(d.bg)}`;
+      const proxyUrl = proxyImageUrl(d.bg);
       imgEl.src = d.bg.startsWith('data:') ? d.bg : proxyUrl;
     } else {
       imgEl.src = '';
@@ -186,7 +186,7 @@ export const UIManager = {
 
     const imgEl = c.closest('.mockup').querySelector('.card-bg');
     if (d.bg && d.bg.length > 0) {
-      const proxyUrl = `/api/proxy_image?url=${encodeURIComponent(d.bg)}`;
+      const proxyUrl = proxyImageUrl(d.bg);
       imgEl.src = d.bg.startsWith('data:') ? d.bg : proxyUrl;
     }
 
@@ -302,7 +302,7 @@ export const UIManager = {
       if (imgEl) {
         const bg = app.state.data[id].bg;
         if (bg) {
-          imgEl.src = bg.startsWith('data:') ? bg : `/api/proxy_image?url=${encodeURIComponent(bg)}`;
+          imgEl.src = bg.startsWith('data:') ? bg : proxyImageUrl(bg);
         } else {
           imgEl.src = '';
         }
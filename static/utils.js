@@ -13,6 +13,11 @@ export const OVERLAYS = [
 
 export const CARD_IDS = ['A', 'B', 'C', 'D']; // <-- 4 tarjetas post
 
+// Variante del proxy que pintan las tarjetas (1080x1440, fondo en cover).
+// El servidor pre-carga exactamente esta variante (CARD_IMAGE_VARIANT en app.py).
+export const proxyImageUrl = (url) =>
+    `/api/proxy_image?url=${encodeURIComponent(url)}&w=1080&h=1440&fit=cover`;
+
 export const toast = (msg, type = 'info') => {
     Toastify({
         text: msg,
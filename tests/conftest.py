@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py abre sus bases y la caché de imágenes al importarse: fuera del repo
+_workdir = tempfile.mkdtemp(prefix="tests-")
+os.environ.setdefault("CACHE_DB", os.path.join(_workdir, "cache.db"))
+os.environ.setdefault("IMAGE_CACHE_DIR", os.path.join(_workdir, "images"))
+os.environ.setdefault("RATE_LIMITS", "")
+os.environ.setdefault("IMAGE_PREFETCH", "0")
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import batches
+from batches import BatchStore, run_batch
+
+URLS = [f"https://site{i % 2}.example/a{i}" for i in range(6)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    s = BatchStore(str(tmp_path / "batches.db"))
+    yield s
+    s.close()
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=4) as ex:
+        yield ex
+
+
+def items_of(pending):
+    return [(key, url, url.split("/")[2]) for key, url in pending]
+
+
+def test_create_skips_duplicate_keys(store):
+    batch_id, duplicates = store.create("urls", [("k1", "u1"), ("k2", "u2"), ("k1", "u1-again")])
+    assert duplicates == ["u1-again"]
+    assert store.pending(batch_id) == [("k1", "u1"), ("k2", "u2")]
+    assert store.summary(batch_id)["total"] == 2
+
+
+def test_summary_counts_statuses(store):
+    batch_id, _ = store.create("urls", [(u, u) for u in URLS[:3]])
+    store.mark(batch_id, URLS[0], batches.DONE)
+    store.mark(batch_id, URLS[1], batches.FAILED, "boom")
+    summary = store.summary(batch_id, with_items=True)
+    assert summary["counts"] == {batches.DONE: 1, batches.FAILED: 1, batches.PENDING: 1}
+    assert not summary["complete"]
+    assert summary["items"][1] == {"url": URLS[1], "status": batches.FAILED, "error": "boom"}
+    assert store.summary("missing") is None
+
+
+def test_resume_only_runs_what_is_pending(store, tmp_path, executor):
+    batch_id, _ = store.create("urls", [(u, u) for u in URLS])
+    calls = Counter()
+
+    def fn(url):
+        calls[url] += 1
+        return {"url": url}
+
+    def on_finish(key, url, result, error):
+        store.mark(batch_id, key, batches.FAILED if error else batches.DONE, error)
+
+    # El cliente se va tras el primer resultado: lo que no arrancó queda pendiente
+    run = run_batch(executor, items_of(store.pending(batch_id)), fn, on_finish=on_finish,
+                    concurrency=1, domain_delay=0)
+    next(run)
+    run.close()
+    assert len(store.pending(batch_id)) == len(URLS) - 1
+
+    # Retomar (otro proceso: otra instancia sobre la misma base) hace solo el resto
+    resumed = BatchStore(str(tmp_path / "batches.db"))
+    done = list(run_batch(executor, items_of(resumed.pending(batch_id)), fn, on_finish=on_finish,
+                          concurrency=4, domain_delay=0))
+    assert len(done) == len(URLS) - 1
+    assert set(calls) == set(URLS) and set(calls.values()) == {1}
+    summary = resumed.summary(batch_id)
+    assert summary["complete"] and summary["counts"] == {batches.DONE: len(URLS)}
+
+
+def test_failures_are_reported_not_raised(store, executor):
+    def fn(url):
+        if url.endswith("a1"):
+            raise RuntimeError("scrape failed")
+        return url
+
+    results = {url: (result, error) for _, url, result, error in
+               run_batch(executor, items_of((u, u) for u in URLS), fn, domain_delay=0)}
+    assert results[URLS[1]] == (None, "scrape failed")
+    assert results[URLS[0]] == (URLS[0], None)
+
+
+def test_respects_per_domain_limit_and_delay(executor):
+    lock = threading.Lock()
+    running, peak, starts = Counter(), Counter(), {}
+
+    def fn(url):
+        domain = url.split("/")[2]
+        with lock:
+            running[domain] += 1
+            peak[domain] = max(peak[domain], running[domain])
+            starts.setdefault(domain, []).append(time.monotonic())
+        time.sleep(0.02)
+        with lock:
+            running[domain] -= 1
+        return url
+
+    list(run_batch(executor, items_of((u, u) for u in URLS), fn, concurrency=4, per_domain=1,
+                   domain_delay=0.05))
+    assert max(peak.values()) == 1
+    for times in starts.values():
+        assert all(b - a >= 0.045 for a, b in zip(times, times[1:]))
+
+
+def test_job_id_column_is_added_to_old_databases(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE batches (id TEXT PRIMARY KEY, source TEXT NOT NULL, "
+                 "created REAL NOT NULL, updated REAL NOT NULL)")
+    conn.execute("INSERT INTO batches VALUES ('b1', 'urls', 0, 0)")
+    conn.commit()
+    conn.close()
+    store = BatchStore(path, keep_for=float("inf"))
+    assert store.job_id("b1") is None
+    store.set_job("b1", "j1")
+    assert store.job_id("b1") == "j1"
+    store.close()
@@ -0,0 +1,65 @@
+import json
+import time
+
+import pytest
+
+import app
+import batches
+
+
+@pytest.fixture
+def client(monkeypatch):
+    scraped = []
+
+    def fake_item(url):
+        scraped.append(url)
+        if "fail" in url:
+            raise RuntimeError("boom")
+        return {"url": url}
+
+    monkeypatch.setattr(app, "bulk_scrape_item", fake_item)
+    monkeypatch.setattr(app, "BULK_STREAM_POLL", 0.05)
+    client = app.app.test_client()
+    client.scraped = scraped
+    return client
+
+
+def wait_complete(client, batch_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        summary = client.get(f"/api/bulk_scrape/{batch_id}").get_json()
+        if summary["complete"]:
+            return summary
+        time.sleep(0.05)
+    raise AssertionError("batch did not finish")
+
+
+def test_batch_runs_as_a_job(client):
+    urls = ["https://a.example/1", "https://b.example/fail", "https://a.example/1?utm_source=x"]
+    r = client.post("/api/bulk_scrape", json={"urls": urls, "domain_delay": 0})
+    assert r.status_code == 202
+    body = r.get_json()
+    assert body["duplicates"] == [urls[2]]
+
+    summary = wait_complete(client, body["batch_id"])
+    assert summary["job_id"] == body["job_id"]
+    assert summary["counts"] == {batches.DONE: 1, batches.FAILED: 1}
+    assert sorted(client.scraped) == sorted(urls[:2])
+
+
+def test_stream_reports_progress_from_the_store(client):
+    urls = ["https://c.example/1", "https://d.example/2"]
+    r = client.post("/api/bulk_scrape", json={"urls": urls, "domain_delay": 0, "stream": True})
+    events = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert events[0]["event"] == "batch"
+    assert sorted(e["data"]["url"] for e in events if e["event"] == "item") == urls
+    assert events[-1]["event"] == "done"
+    assert events[-1]["data"]["complete"]
+
+
+def test_resume_reuses_the_running_job(client, monkeypatch):
+    batch_id, _ = app.BATCHES.create("urls", [("k", "https://e.example/1")])
+    monkeypatch.setattr(app.JOBS, "status", lambda job_id: "running")
+    app.BATCHES.set_job(batch_id, "existing")
+    r = client.post("/api/bulk_scrape", json={"batch_id": batch_id})
+    assert r.get_json()["job_id"] == "existing"
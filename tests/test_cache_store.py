@@ -0,0 +1,38 @@
+import json
+
+from cache_store import CacheStore
+
+
+def test_rekey_merges_into_the_newest_entry(tmp_path):
+    store = CacheStore(str(tmp_path / "cache.db"), namespace="scrape")
+    store.set("http://www.example.com/a", {"v": "old"}, ts=100)
+    store.set("https://example.com/a", {"v": "new"}, ts=200)
+    store.set("http://www.example.com/b", {"v": "b"}, ts=100)
+
+    moved = store.rekey(lambda k: k.replace("http://www.", "https://"), "v1")
+
+    assert moved == 2
+    assert store.get("https://example.com/a") == {"ts": 200, "data": {"v": "new"}}
+    assert store.get("https://example.com/b")["data"] == {"v": "b"}
+    assert store.peek("http://www.example.com/a") is None
+    assert len(store) == 2
+
+
+def test_rekey_runs_once_per_version(tmp_path):
+    store = CacheStore(str(tmp_path / "cache.db"), namespace="scrape")
+    store.rekey(str.lower, "v1")
+    store.set("UPPER", {"v": 1}, ts=100)
+    assert store.rekey(str.lower, "v1") == 0
+    assert store.peek("UPPER") == 100
+    assert store.rekey(str.lower, "v2") == 1
+    assert store.peek("upper") == 100
+
+
+def test_import_json_maps_keys(tmp_path):
+    dump = tmp_path / "dump.json"
+    dump.write_text(json.dumps({"HTTP://A": {"ts": 5, "data": {"x": 1}}}))
+    store = CacheStore(str(tmp_path / "cache.db"), namespace="scrape")
+    assert store.import_json(str(dump), key_fn=str.lower) == 1
+    assert store.get("http://a") == {"ts": 5, "data": {"x": 1}}
+    # Una sola vez por archivo
+    assert store.import_json(str(dump), key_fn=str.lower) == 0
@@ -0,0 +1,41 @@
+import pytest
+
+from app import canonical_url
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("http://www.Example.com/a/b/?b=2&a=1#frag", "https://example.com/a/b?a=1&b=2"),
+    ("example.com/a", "https://example.com/a"),
+    ("https://m.example.com/a", "https://example.com/a"),
+    ("https://amp.example.com/a/", "https://example.com/a"),
+    ("https://example.com/news/amp", "https://example.com/news"),
+    ("https://example.com/story.amp", "https://example.com/story"),
+    ("https://example.com:8443//a//b", "https://example.com:8443/a/b"),
+    ("https://example.com:443/a", "https://example.com/a"),
+])
+def test_normalizes_scheme_host_and_path(url, expected):
+    assert canonical_url(url) == expected
+
+
+@pytest.mark.parametrize("query", [
+    "utm_source=x&utm_medium=y", "fbclid=1", "gclid=2", "msclkid=3", "mc_cid=4&mc_eid=5",
+    "pk_campaign=q", "mtm_source=r", "_ga=1.2", "igshid=abc",
+])
+def test_strips_tracking_params(query):
+    assert canonical_url(f"https://example.com/a?id=7&{query}") == "https://example.com/a?id=7"
+
+
+@pytest.mark.parametrize("query", ["ref=home", "src=rss", "cid=9", "share=1", "amp=1"])
+def test_keeps_generic_params(query):
+    # Nombres genéricos que algunos sitios usan para identificar el artículo
+    assert canonical_url(f"https://example.com/a?{query}") == f"https://example.com/a?{query}"
+
+
+def test_variants_share_a_key():
+    variants = [
+        "https://www.example.com/news/story?utm_source=tw",
+        "http://example.com/news/story/",
+        "https://m.example.com/news/story/amp",
+        "https://example.com/news/story#comments",
+    ]
+    assert {canonical_url(u) for u in variants} == {"https://example.com/news/story"}
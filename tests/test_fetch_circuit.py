@@ -0,0 +1,73 @@
+import pytest
+import requests
+
+import app
+from domain_health import DomainHealth, CLOSED, OPEN
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, text="<html>ok</html>", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def health(tmp_path, monkeypatch):
+    health = DomainHealth(str(tmp_path / "health.db"), failure_threshold=2)
+    monkeypatch.setattr(app, "DOMAIN_HEALTH", health)
+    monkeypatch.setattr(app, "SCRAPE_DO_KEY", "test")
+    return health
+
+
+def respond_with(monkeypatch, outcome):
+    def get(upstream, url, **kwargs):
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    monkeypatch.setattr(app.http_client, "get", get)
+
+
+def test_missing_key_does_not_touch_the_circuit(health, monkeypatch):
+    monkeypatch.setattr(app, "SCRAPE_DO_KEY", None)
+    for _ in range(3):
+        with pytest.raises(app.ScrapeDoUnavailable):
+            app.fetch_with_circuit("https://example.com/a")
+    assert health.state("example.com") == CLOSED
+
+
+@pytest.mark.parametrize("outcome", [
+    requests.ConnectionError("proxy down"),
+    requests.Timeout("proxy timeout"),
+    FakeResponse(502, "bad gateway"),
+    FakeResponse(401, "invalid token"),
+    FakeResponse(429, "concurrency limit"),
+])
+def test_proxy_failures_do_not_open_the_circuit(health, monkeypatch, outcome):
+    respond_with(monkeypatch, outcome)
+    for _ in range(3):
+        with pytest.raises(Exception) as raised:
+            app.fetch_with_circuit("https://example.com/a")
+        assert not isinstance(raised.value, app.TargetSiteError)
+    assert health.state("example.com") == CLOSED
+
+
+@pytest.mark.parametrize("outcome", [
+    FakeResponse(404, "not found", {app.SCRAPE_DO_TARGET_STATUS: "404"}),
+    FakeResponse(200, "blocked", {app.SCRAPE_DO_TARGET_STATUS: "503"}),
+    FakeResponse(200, ""),
+])
+def test_target_failures_open_the_circuit(health, monkeypatch, outcome):
+    respond_with(monkeypatch, outcome)
+    for _ in range(2):
+        with pytest.raises(app.TargetSiteError):
+            app.fetch_with_circuit("https://example.com/a")
+    assert health.state("example.com") == OPEN
+    with pytest.raises(app.CircuitOpen):
+        app.fetch_with_circuit("https://example.com/a")
+
+
+def test_success_returns_html(health, monkeypatch):
+    respond_with(monkeypatch, FakeResponse(200, "<p>hola</p>", {app.SCRAPE_DO_TARGET_STATUS: "200"}))
+    assert app.fetch_with_circuit("https://example.com/a") == "<p>hola</p>"
+    assert health.state("example.com") == CLOSED
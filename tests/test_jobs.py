@@ -0,0 +1,61 @@
+import time
+
+import jobs
+from jobs import JobQueue
+
+
+def wait_for(queue, job_id, status, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if queue.status(job_id) == status:
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_job_persisted_before_the_queue_is_consumed(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    # Proceso anterior: encola pero no tiene consumidores (p. ej. murió justo después)
+    before = JobQueue(path, workers=0)
+    before.register("echo", lambda job: job.payload)
+    job_id = before.submit("echo", {"n": 1})
+    assert before.status(job_id) == jobs.QUEUED
+
+    after = JobQueue(path, workers=1, poll_interval=0.02)
+    after.register("echo", lambda job: job.payload)
+    after.ensure_started()
+    assert wait_for(after, job_id, jobs.DONE)
+    assert after.get(job_id)["result"] == {"n": 1}
+
+
+def test_running_job_of_a_dead_process_is_requeued(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    before = JobQueue(path, workers=0)
+    before.register("echo", lambda job: "ok")
+    job_id = before.submit("echo", {})
+    before._conn().execute(
+        "UPDATE jobs SET status = ?, started = ?, heartbeat = ? WHERE id = ?",
+        (jobs.RUNNING, time.time() - 60, time.time() - 60, job_id)
+    )
+
+    after = JobQueue(path, workers=1, poll_interval=0.02, stale_after=30)
+    after.register("echo", lambda job: "ok")
+    after.ensure_started()
+    assert wait_for(after, job_id, jobs.DONE)
+
+
+def test_cancelled_job_is_not_finished(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"), workers=1, poll_interval=0.02)
+
+    def slow(job):
+        for _ in range(100):
+            job.check()
+            time.sleep(0.01)
+        return "done"
+
+    queue.register("slow", slow)
+    job_id = queue.submit("slow", {})
+    assert wait_for(queue, job_id, jobs.RUNNING)
+    assert queue.cancel(job_id)
+    time.sleep(0.2)
+    assert queue.status(job_id) == jobs.CANCELLED
@@ -0,0 +1,60 @@
+from prompt_context import compact, count_tokens, split_sentences, truncate_tokens
+
+ARTICLE = (
+    "The central bank held interest rates at 4.5% on Thursday, citing persistent inflation.\n\n"
+    "Officials said the economy grew faster than expected in the third quarter. "
+    "Subscribe to our newsletter for more updates. "
+    "Analysts had expected the central bank to cut rates by a quarter point. "
+    "The decision sent bond yields higher across the region.\n"
+    "Markets will now watch the next inflation report, due in two weeks."
+)
+
+
+def test_split_sentences_by_paragraph_and_punctuation():
+    sentences = split_sentences("First one here. Second one! «Third»\n\nNew paragraph? ¿Sí? Yes.")
+    assert sentences == ["First one here.", "Second one! «Third»", "New paragraph?", "¿Sí?", "Yes."]
+
+
+def test_split_sentences_keeps_abbreviations_and_lowercase_together():
+    assert split_sentences("Rates rose 2.5 pct. in may. the bank said so.") == \
+        ["Rates rose 2.5 pct. in may. the bank said so."]
+    assert split_sentences("") == []
+
+
+def test_text_within_budget_is_returned_as_is():
+    context = compact("Rates", ARTICLE, 10_000)
+    assert context.text == ARTICLE.strip()
+    assert context.saved_tokens == 0
+
+
+def test_compact_keeps_relevant_sentences_in_order_within_budget():
+    context = compact("Central bank holds interest rates", ARTICLE, 45)
+    assert context.tokens <= 45
+    assert "Subscribe" not in context.text
+    assert context.text.startswith("The central bank held interest rates")
+    kept = [s for s in split_sentences(ARTICLE) if s in context.text]
+    assert kept == sorted(kept, key=ARTICLE.index)
+    assert context.sentences_kept == len(kept) < context.sentences_total
+
+
+def test_unsplittable_text_falls_back_to_a_prefix():
+    text = "the economy grew. the central bank said rates would hold. " * 200
+    context = compact("Economy", text, 800)
+    assert context.text
+    assert text.startswith(context.text)
+    assert 400 <= context.tokens <= 800
+
+
+def test_text_without_spaces_falls_back_to_a_prefix():
+    text = "経済は成長した" * 3000
+    context = compact("経済", text, 300)
+    assert context.text and text.startswith(context.text)
+    assert context.tokens <= 300
+
+
+def test_truncate_tokens_cuts_at_a_word_boundary():
+    text = " ".join(f"word{i}" for i in range(1000))
+    prefix = truncate_tokens(text, 50)
+    assert count_tokens(prefix) <= 50
+    assert text.startswith(prefix) and text[len(prefix)] == " "
+    assert truncate_tokens("short text", 50) == "short text"
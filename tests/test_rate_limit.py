@@ -0,0 +1,92 @@
+import asyncio
+
+import pytest
+
+from rate_limit import BACKGROUND, INTERACTIVE, Bucket, RateLimited, RateLimiter, parse_limits, priority
+
+
+def limiter(tmp_path, rate=0.001, burst=10, reserve=0.3, max_wait=0.0):
+    return RateLimiter(str(tmp_path / "limits.db"), {"api": Bucket(rate, burst, reserve)},
+                       max_wait={INTERACTIVE: max_wait, BACKGROUND: max_wait})
+
+
+def take_until_limited(rl, level) -> int:
+    taken = 0
+    while True:
+        try:
+            rl.acquire("api", level)
+        except RateLimited:
+            return taken
+        taken += 1
+
+
+def test_background_leaves_the_reserve_to_interactive(tmp_path):
+    rl = limiter(tmp_path)
+    assert take_until_limited(rl, BACKGROUND) == 7
+    assert take_until_limited(rl, INTERACTIVE) == 3
+
+
+def test_interactive_can_use_the_whole_bucket(tmp_path):
+    rl = limiter(tmp_path)
+    assert take_until_limited(rl, INTERACTIVE) == 10
+    assert take_until_limited(rl, BACKGROUND) == 0
+
+
+def test_priority_comes_from_the_context(tmp_path):
+    rl = limiter(tmp_path)
+    with priority(BACKGROUND):
+        assert take_until_limited(rl, None) == 7
+    assert take_until_limited(rl, None) == 3
+
+
+def test_rate_limited_reports_retry_after(tmp_path):
+    rl = limiter(tmp_path, rate=0.5, burst=1)
+    rl.acquire("api")
+    with pytest.raises(RateLimited) as info:
+        rl.acquire("api")
+    assert info.value.upstream == "api"
+    assert 1 <= info.value.retry_after <= 2
+
+
+def test_waits_for_a_token_within_max_wait(tmp_path):
+    rl = limiter(tmp_path, rate=20, burst=1, max_wait=1.0)
+    assert rl.acquire("api") == 0
+    assert 0 < rl.acquire("api") < 1
+
+
+def test_drain_blocks_every_priority(tmp_path):
+    rl = limiter(tmp_path, rate=1, burst=10)
+    rl.drain("api", 30)
+    with pytest.raises(RateLimited) as info:
+        rl.acquire("api", INTERACTIVE)
+    assert info.value.retry_after > 29
+
+
+def test_unlimited_upstreams_never_wait(tmp_path):
+    rl = limiter(tmp_path)
+    assert all(rl.acquire("other", BACKGROUND) == 0 for _ in range(50))
+
+
+def test_async_acquire_keeps_the_reserve(tmp_path):
+    rl = limiter(tmp_path)
+
+    async def main():
+        taken = 0
+        while True:
+            try:
+                await rl.acquire_async("api", BACKGROUND)
+            except RateLimited:
+                return taken
+            taken += 1
+
+    assert asyncio.run(main()) == 7
+    assert take_until_limited(rl, INTERACTIVE) == 3
+
+
+def test_parse_limits():
+    buckets = parse_limits("pexels=200/3600:20, openai=60/60,scrape_do=5")
+    assert buckets["pexels"].rate == pytest.approx(200 / 3600)
+    assert buckets["pexels"].burst == 20
+    assert buckets["openai"].burst == 60
+    assert buckets["scrape_do"].rate == 5
+    assert parse_limits("") == {}
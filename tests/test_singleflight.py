@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from jobs import JobCancelled
+from singleflight import LeaderFailed, SingleFlight
+
+
+@pytest.fixture
+def flights(tmp_path):
+    sf = SingleFlight(str(tmp_path / "flights.db"), retry_on=(JobCancelled,), poll_interval=0.01)
+    yield sf
+    sf.close()
+
+
+def run_leader_and_follower(sf, key, leader_fn, follower_fn):
+    """Lanza un líder lento y, mientras calcula, un seguidor; devuelve {rol: resultado o excepción}."""
+    started = threading.Event()
+    outcome = {}
+
+    def leader():
+        def fn():
+            started.set()
+            time.sleep(0.2)
+            return leader_fn()
+        try:
+            outcome["leader"] = sf.do(key, fn)
+        except Exception as e:
+            outcome["leader"] = e
+
+    def follower():
+        started.wait()
+        try:
+            outcome["follower"] = sf.do(key, follower_fn)
+        except Exception as e:
+            outcome["follower"] = e
+
+    threads = [threading.Thread(target=leader), threading.Thread(target=follower)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return outcome
+
+
+def test_followers_share_the_result(flights):
+    calls = []
+    outcome = run_leader_and_follower(flights, "k", lambda: calls.append("leader") or 1,
+                                      lambda: calls.append("follower") or 2)
+    assert outcome == {"leader": 1, "follower": 1}
+    assert calls == ["leader"]
+
+
+def test_leader_error_propagates_to_followers(flights):
+    def boom():
+        raise ValueError("upstream down")
+    outcome = run_leader_and_follower(flights, "k", boom, lambda: 2)
+    assert isinstance(outcome["leader"], ValueError)
+    assert outcome["follower"] is outcome["leader"]
+
+
+def test_cancelled_leader_does_not_cancel_followers(flights):
+    def cancelled():
+        raise JobCancelled("job-1")
+    outcome = run_leader_and_follower(flights, "k", cancelled, lambda: "recomputed")
+    assert isinstance(outcome["leader"], JobCancelled)
+    assert outcome["follower"] == "recomputed"
+
+
+def test_failed_leader_releases_the_lease(tmp_path):
+    # Otro proceso (otra instancia sobre la misma base) puede tomar el relevo
+    path = str(tmp_path / "flights.db")
+    first, second = SingleFlight(path), SingleFlight(path)
+    with pytest.raises(ValueError):
+        first.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert second.do("k", lambda: 42) == 42
+    # Y el resultado publicado le llega a quien pida justo después
+    assert first.do("k", lambda: 0) == 42
+
+
+def cross_process(path, leader_fn, follower_fn, **kwargs):
+    """Como run_leader_and_follower, pero cada rol con su instancia (otro proceso)."""
+    leader, follower = SingleFlight(path, **kwargs), SingleFlight(path, **kwargs)
+    started = threading.Event()
+    outcome = {}
+
+    def run(role, sf, fn):
+        try:
+            outcome[role] = sf.do("k", fn)
+        except Exception as e:
+            outcome[role] = e
+
+    def slow():
+        started.set()
+        return leader_fn()
+
+    thread = threading.Thread(target=run, args=("leader", leader, slow))
+    thread.start()
+    started.wait()
+    time.sleep(0.05)
+    run("follower", follower, follower_fn)
+    thread.join(5)
+    return outcome
+
+
+def test_leader_error_reaches_followers_in_other_processes(tmp_path):
+    def boom():
+        time.sleep(0.2)
+        raise ValueError("upstream down")
+    outcome = cross_process(str(tmp_path / "flights.db"), boom, lambda: "recomputed", poll_interval=0.01)
+    assert isinstance(outcome["leader"], ValueError)
+    assert isinstance(outcome["follower"], LeaderFailed)
+    assert str(outcome["follower"]) == "upstream down"
+    # Quien llega después del error vuelve a calcular
+    assert SingleFlight(str(tmp_path / "flights.db")).do("k", lambda: 7) == 7
+
+
+def test_retry_on_errors_let_other_processes_take_over(tmp_path):
+    def cancelled():
+        time.sleep(0.2)
+        raise JobCancelled("job-1")
+    outcome = cross_process(str(tmp_path / "flights.db"), cancelled, lambda: "recomputed",
+                            poll_interval=0.01, retry_on=(JobCancelled,))
+    assert isinstance(outcome["leader"], JobCancelled)
+    assert outcome["follower"] == "recomputed"
+
+
+def test_leader_renews_its_lease(tmp_path):
+    def slow():
+        time.sleep(0.6)
+        return 1
+    outcome = cross_process(str(tmp_path / "flights.db"), slow, lambda: 2, lease=0.15, poll_interval=0.01)
+    assert outcome == {"leader": 1, "follower": 1}
+
+
+def test_error_column_is_added_to_old_databases(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE inflight (ns TEXT NOT NULL, key TEXT NOT NULL, owner TEXT NOT NULL, "
+                 "expires REAL NOT NULL, done REAL, result TEXT, PRIMARY KEY (ns, key))")
+    conn.commit()
+    conn.close()
+    assert SingleFlight(path).do("k", lambda: 3) == 3
+
+
+def test_async_followers_retry_after_cancellation(flights):
+    async def main():
+        async def cancelled():
+            await asyncio.sleep(0.1)
+            raise JobCancelled("job-1")
+
+        async def recompute():
+            return "recomputed"
+
+        async def follower():
+            await asyncio.sleep(0.02)
+            return await flights.do_async("k", recompute)
+
+        return await asyncio.gather(flights.do_async("k", cancelled), follower(), return_exceptions=True)
+
+    leader, follower = asyncio.run(main())
+    assert isinstance(leader, JobCancelled)
+    assert follower == "recomputed"
+
+
+def test_async_followers_wait_for_a_thread_leader(flights):
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        time.sleep(0.2)
+        return 5
+
+    leader = threading.Thread(target=lambda: flights.do("k", slow))
+    leader.start()
+    started.wait()
+
+    async def never():
+        raise AssertionError("should have coalesced")
+
+    async def main():
+        return await asyncio.gather(*[flights.do_async("k", never) for _ in range(20)])
+
+    assert asyncio.run(main()) == [5] * 20
+    leader.join()